@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of wetmill answer typing: the strptime/float implementation against
+utils.field_types, over answers shaped like a Wet Mill Visit (12 surveys of nested
+sections, yes/no flags, dates, counts, prices, free text and multi-select lists).
+
+Run from app/:  python -m benchmarks.bench_field_types
+"""
+import datetime
+import random
+import timeit
+from utils.field_types import _infer_text_type, first_positions, infer_field_types
+
+SURVEYS = 12
+SECTIONS_PER_SURVEY = 6
+QUESTIONS_PER_SECTION = 12
+VISITS = 50
+
+def legacy_infer_field_type(value):
+    if isinstance(value, str):
+        val = value.strip()
+        if val.upper() in ("TRUE", "FALSE"):
+            return "boolean", (val.upper() == "TRUE")
+        if val in ("1", "0"):
+            return "boolean", (val == "1")
+        try:
+            return "date", datetime.datetime.strptime(val, "%Y-%m-%d")
+        except:
+            pass
+        try:
+            return "number", float(val)
+        except:
+            pass
+        return "text", val or None
+    elif isinstance(value, bool):
+        return "boolean", value
+    elif isinstance(value, (int, float)):
+        return "number", float(value)
+    return "text", str(value) if value is not None else None
+
+def legacy_positions(items):
+    return [items.index(item) + 1 for item in items]
+
+def build_visit(rng):
+    """Answers of one visit, flattened as save_form_visit walks them, and its multi-select lists."""
+    answers = []
+    lists = []
+    for _ in range(SURVEYS):
+        for _ in range(SECTIONS_PER_SURVEY):
+            for _ in range(QUESTIONS_PER_SECTION):
+                kind = rng.random()
+                if kind < 0.35:
+                    answers.append(rng.choice(["yes", "no", "TRUE", "FALSE", "1", "0", "n/a"]))
+                elif kind < 0.45:
+                    answers.append(f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+                elif kind < 0.7:
+                    answers.append(str(rng.choice([rng.randint(0, 5000), round(rng.uniform(0, 900), 2)])))
+                elif kind < 0.9:
+                    answers.append(rng.choice(["good", "needs_improvement", "well maintained", "option_a option_c", ""]))
+                else:
+                    selected = [f"option_{rng.randint(1, 15)}" for _ in range(rng.randint(2, 30))]
+                    lists.append(selected)
+                    answers.extend(selected)
+    return answers, lists
+
+def main():
+    rng = random.Random(7)
+    visits = [build_visit(rng) for _ in range(VISITS)]
+    answers = sum(len(visit_answers) for visit_answers, _ in visits)
+
+    def legacy():
+        for visit_answers, lists in visits:
+            [legacy_infer_field_type(answer) for answer in visit_answers]
+            [legacy_positions(items) for items in lists]
+
+    def current():
+        for visit_answers, lists in visits:
+            infer_field_types(visit_answers)
+            [first_positions(items) for items in lists]
+
+    def current_cold():
+        _infer_text_type.cache_clear()
+        current()
+
+    print(f"{VISITS} visits, {answers} answers")
+    for name, run in [("legacy", legacy), ("field_types (cold cache)", current_cold), ("field_types (warm cache)", current)]:
+        seconds = min(timeit.repeat(run, number=1, repeat=5))
+        print(f"{name:26} {seconds * 1000:8.1f} ms  {seconds / answers * 1e6:6.2f} us/answer")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of CommCare XForm rendering: generate_xml (f-strings, escaping every
+use of a field) against utils.xml_templates (one compiled template per job, fields
+escaped once), one record at a time and through render_batch.
+
+Run from app/:  python -m benchmarks.bench_xml_templates
+"""
+import random
+import timeit
+from utils.generate_xml import generate_xml
+from utils.xml_templates import render_batch, render_xml
+
+RECORDS = 20000
+PROJECT = "coffee_ke_2024ac"
+
+def build_participants(rng):
+    return [
+        {
+            "participantName": rng.choice(["Jean", "Amina", "Peter", "Grace"]),
+            "participantMiddleName": rng.choice(["", "Marie", "K."]),
+            "participantLastName": rng.choice(["Mwangi", "Niyonzima", "O'Brien", "Smith & Co"]),
+            "participantAge": str(rng.randint(18, 80)),
+            "participantGender": rng.choice(["m", "f"]),
+            "participantPhoneNumber": str(rng.randint(700000000, 799999999)),
+            "tnsId": f"TNS/{i:06d}",
+            "participantPrimaryHouseholdMember": rng.choice(["Yes", "No"]),
+            "participantOtherIDNumber": f"C-{i}",
+            "householdId": f"hh-{i // 2}",
+            "householdPIMAId": f"PIMA-{i // 2}",
+            "shadeTrees": str(rng.randint(0, 50)),
+            "HHID": f"{i // 2:03d}",
+            "householdFarmSize": str(rng.randint(100, 3000)),
+            "trainingGroupId": f"tg-{i // 25}",
+            "status": "Active",
+            "commCareCaseId": f"case-{i}",
+            "ccMobileWorkerGroupId": f"owner-{i // 500}",
+        }
+        for i in range(RECORDS)
+    ]
+
+def main():
+    records = build_participants(random.Random(7))
+    buffer = []
+
+    runs = [
+        ("generate_xml", lambda: [generate_xml("Participant", "job-1", record, PROJECT) for record in records]),
+        ("render_xml", lambda: [render_xml("Participant", "job-1", record, PROJECT) for record in records]),
+        ("render_batch", lambda: render_batch("Participant", "job-1", records, PROJECT, buffer)),
+    ]
+    size = len(generate_xml("Participant", "job-1", records[0], PROJECT))
+    compact_size = len(render_xml("Participant", "job-1", records[0], PROJECT))
+    print(f"{RECORDS} Participant records; document size {size} -> {compact_size} characters")
+    for name, run in runs:
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{name:14} {seconds * 1000:8.1f} ms  {seconds / RECORDS * 1e6:6.2f} us/record")
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from geoalchemy2.shape import from_shape
 from shapely.geometry import Point
 from utils.logging_config import logger
+from utils.metrics import POSTGRES_COMMIT_SECONDS, get_job_name
 from utils.mappings import map_status, map_mill_status, map_manager_role, EXPORTING_STATUS_MAP, MANAGER_ROLE_MAP, WET_MILL_STATUS_MAP, VERTICAL_INTEGRATION_MAP
 from simple_salesforce import Salesforce # I don't know if this is needed, but I left it in for now
 
@@ -146,7 +147,8 @@ def save_wetmill_registration(data, sf):
                 "commcare_case_id": commcare_case_id,
                 "wet_mill_unique_id": wet_mill_unique_id
             })
-        session.commit()
+        with POSTGRES_COMMIT_SECONDS.time(job_name=get_job_name(), step="save_wetmill_registration"):
+            session.commit()
         return True, None
 
     except SQLAlchemyError as e:
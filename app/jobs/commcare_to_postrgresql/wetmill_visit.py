@@ -3,11 +3,14 @@ import datetime
 
 from geoalchemy2.shape import from_shape
 from shapely.geometry import Point
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError
-from utils.postgres import SessionLocal
+from utils.postgres import session_scope
 from utils.models import FormVisit, Wetmill, SurveyResponse, SurveyQuestionResponse, User
 from utils.mappings import SURVEY_TRANSFORMATIONS
+from utils.field_types import first_positions, infer_field_types
 from utils.logging_config import logger
+from utils.metrics import POSTGRES_COMMIT_SECONDS, get_job_name
 
 ALLOWED_SURVEYS = [
     "wet_mill_training",
@@ -25,8 +28,10 @@ ALLOWED_SURVEYS = [
     ]
 
 def save_form_visit(data, wetmill_id=None, user_id=None):
-    session = SessionLocal()
-    # try:
+    with session_scope() as session:
+        return write_form_visit(session, data, wetmill_id, user_id)
+
+def write_form_visit(session, data, wetmill_id=None, user_id=None):
     form = data.get("form", {})
     case = form.get("case", {})
     case_id = case.get("@case_id")
@@ -94,6 +99,12 @@ def save_form_visit(data, wetmill_id=None, user_id=None):
     surveys = form.get("surveys", {})
     completed = form.get("completed_surveys", {})
     url_string = f'https://www.commcarehq.org/a/{data.get("domain")}/api/form/attachment/{data.get("form", {}).get("meta", {}).get("instanceID")}'
+
+    # Rows are collected by submission_id and written with one upsert per table, so a
+    # visit costs two statements instead of a SELECT per survey and per question. A
+    # repeated submission_id keeps its last answer, as the per-row lookups did.
+    survey_rows = {}
+    question_rows = {}
     for survey_name, content in surveys.items():
         if survey_name not in ALLOWED_SURVEYS:
             print('skipping survey: ' + survey_name)
@@ -116,79 +127,61 @@ def save_form_visit(data, wetmill_id=None, user_id=None):
 
         general_feedback = content.get("general_feedback")
 
-        survey_response = session.query(SurveyResponse).filter_by(
-            submission_id=f'SR-{form_id}-{survey_name}'
-        ).first()
-
-        if survey_response:
-            survey_response.form_visit = form_visit
-            survey_response.survey_type = survey_name
-            survey_response.completed_date = completed_date
-            survey_response.general_feedback = general_feedback
-            logger.info({
-                "message": "Updated existing survey response",
-                "submission_id": f'SR-{form_id}-{survey_name}',
-                "survey_type": survey_name,
-                "completed_date": completed_date,
-                "survey_response": survey_response.id
-            })
-        else:
-            survey_response = SurveyResponse(
-                submission_id=f'SR-{form_id}-{survey_name}',
-                form_visit=form_visit,
-                survey_type=survey_name,
-                completed_date=completed_date,
-                general_feedback=general_feedback
-            )
-            session.add(survey_response)
-            logger.info({
-                "message": "Added new survey response",
-                "submission_id": f'SR-{form_id}-{survey_name}',
-                "survey_type": survey_name,
-                "completed_date": completed_date,
-                "general_feedback": general_feedback
-            })
+        survey_submission_id = f'SR-{form_id}-{survey_name}'
+        survey_rows[survey_submission_id] = {
+            "submission_id": survey_submission_id,
+            "survey_type": survey_name,
+            "completed_date": completed_date,
+            "general_feedback": general_feedback
+        }
 
         # Insert question responses
         for section, sec_content in content.items():
             # handle multiple answers questions on top level
             if isinstance(sec_content, list):
-                for item in sec_content:
-                    item_index = str(sec_content.index(item) + 1)  # 1-based index
+                for item, item_index in zip(sec_content, first_positions(sec_content)):
                     submission_id = f'SQR-{form_id}-{survey_name}-{section}-{item_index}'
-                    add_question_response(session, survey_response, section, section, item, submission_id)
+                    add_question_response(question_rows, survey_submission_id, section, section, item, submission_id)
             # Nested questions
             elif isinstance(sec_content, dict):
                 for q_name, ans in sec_content.items():
                     # handle multiple answers questions in nested
                     if isinstance(ans, list):
-                        for item in ans:
-                            item_index = str(ans.index(item) + 1)  # 1-based index
+                        for item, item_index in zip(ans, first_positions(ans)):
                             submission_id = f'SQR-{form_id}-{survey_name}-{section}-{q_name}-{item_index}'
-                            add_question_response(session, survey_response, section, q_name, item, submission_id)
+                            add_question_response(question_rows, survey_submission_id, section, q_name, item, submission_id)
                     else:
                         # Skip label fields
                         if q_name.endswith('_label'):
                             continue
                         submission_id = f'SQR-{form_id}-{survey_name}-{section}-{q_name}'
-                        add_question_response(session, survey_response, section, q_name, ans, submission_id)
+                        add_question_response(question_rows, survey_submission_id, section, q_name, ans, submission_id)
             # Single value questions or flags
             else:
                 # Skip top-level label or survey keys
                 if section.endswith('_label') or section.startswith('survey_'):
                     continue
                 submission_id = f'SQR-{form_id}-{survey_name}-{section}'
-                add_question_response(session, survey_response, None, section, sec_content, submission_id)
-    session.commit()
+                add_question_response(question_rows, survey_submission_id, None, section, sec_content, submission_id)
+
+    set_field_values(question_rows.values())
+
+    # Assigns form_visit.id for new visits
+    session.flush()
+    survey_response_ids = upsert_survey_responses(session, form_visit.id, list(survey_rows.values()))
+    for row in question_rows.values():
+        row["survey_response_id"] = survey_response_ids[row.pop("survey_submission_id")]
+    upsert_question_responses(session, list(question_rows.values()))
+    logger.info({
+        "message": "Saved survey responses",
+        "submission_id": f'WV-{form_id}',
+        "survey_responses": len(survey_rows),
+        "question_responses": len(question_rows)
+    })
+
+    with POSTGRES_COMMIT_SECONDS.time(job_name=get_job_name(), step="save_form_visit"):
+        session.commit()
     return True, None
-#except SQLAlchemyError as e:
-#    session.rollback()
-#    return False, str(e)
-# except Exception as e:
-#   session.rollback()
-#    return False, str(e)
-#finally:
-#    session.close()
 
 def extract_location_string(location_string):
     """
@@ -200,90 +193,74 @@ def extract_location_string(location_string):
     except:
         return None
 
-def infer_field_type(value):
-    """
-    Infer the data type of the answer and return (field_type, parsed_value).
-    - Booleans: 'TRUE', 'FALSE', '1', '0'
-    - Dates: ISO format 'YYYY-MM-DD'
-    - Numbers: integers or floats (e.g., '50', '50.0')
-    - Fallback to text
-    """
-    # Handle string inputs
-    if isinstance(value, str):
-        val = value.strip()
-        # Detect booleans
-        if val.upper() in ("TRUE", "FALSE"):
-            return "boolean", (val.upper() == "TRUE")
-        if val in ("1", "0"):
-            return "boolean", (val == "1")
-        # Detect dates
-        try:
-            dt = datetime.datetime.strptime(val, "%Y-%m-%d")
-            return "date", dt
-        except:
-            pass
-        # Detect numbers
-        try:
-            num = float(val)
-            return "number", num
-        except:
-            pass
-        # Otherwise text
-        return "text", val or None
-    # Non-strings
-    elif isinstance(value, bool):
-        return "boolean", value
-    elif isinstance(value, (int, float)):
-        return "number", float(value)
-    # Turn unknown types to text
-    return "text", str(value) if value is not None else None
-
-
-def add_question_response(session, survey_response, section_name, question_name, answer, submission_id):
+def add_question_response(question_rows, survey_submission_id, section_name, question_name, answer, submission_id):
     """
-    Create and add a SurveyQuestionResponse for a given answer.
+    Add the SurveyQuestionResponse row for a given answer to `question_rows`. The
+    answer is typed later by set_field_values, together with the rest of the visit.
     """
-    field_type, field_value = infer_field_type(answer)
-
-    question_response = session.query(SurveyQuestionResponse).filter_by(
-        submission_id=submission_id
-    ).first()
+    question_rows[submission_id] = {
+        "submission_id": submission_id,
+        "survey_submission_id": survey_submission_id,
+        "section_name": section_name,
+        "question_name": question_name,
+        "answer": answer,
+    }
 
-    if question_response:
-        question_response.survey_response = survey_response
-        question_response.section_name = section_name
-        question_response.question_name = question_name
-        question_response.field_type = field_type
-        question_response.value_text = field_value if field_type == "text" else None
-        question_response.value_number = field_value if field_type == "number" else None
-        question_response.value_boolean = field_value if field_type == "boolean" else None
-        question_response.value_date = field_value if field_type == "date" else None
-        question_response.value_gps = from_shape(field_value, srid=4326) if field_type == "gps" else None
-        logger.info({
-            "message": "Updated existing question response",
-            "submission_id": submission_id,
-            "question_name": question_name,
+def set_field_values(rows):
+    """Type every answer in one pass and fill in the field_type and value_* columns."""
+    rows = list(rows)
+    for row, (field_type, field_value) in zip(rows, infer_field_types([row.pop("answer") for row in rows])):
+        row.update({
             "field_type": field_type,
-            "value": field_value
+            "value_text": field_value if field_type == "text" else None,
+            "value_number": field_value if field_type == "number" else None,
+            "value_boolean": field_value if field_type == "boolean" else None,
+            "value_date": field_value if field_type == "date" else None,
+            "value_gps": from_shape(field_value, srid=4326) if field_type == "gps" else None,
         })
-    else:
-        question_response = SurveyQuestionResponse(
-            submission_id=submission_id,
-            survey_response=survey_response,
-            section_name=section_name,
-            question_name=question_name,
-            field_type=field_type,
-            value_text=field_value if field_type == "text" else None,
-            value_number=field_value if field_type == "number" else None,
-            value_boolean=field_value if field_type == "boolean" else None,
-            value_date=field_value if field_type == "date" else None,
-            value_gps=from_shape(field_value, srid=4326) if field_type == "gps" else None,   
-        )
-        session.add(question_response)
-        logger.info({
-            "message": "Added new question response",
-            "submission_id": submission_id,
-            "question_name": question_name,
+        logger.debug({
+            "message": "Added question response",
+            "submission_id": row["submission_id"],
+            "question_name": row["question_name"],
             "field_type": field_type,
             "value": field_value
-        })
\ No newline at end of file
+        })
+
+def upsert_survey_responses(session, form_visit_id, rows):
+    """
+    Insert or update the visit's survey responses in one statement, on their unique
+    submission_id. Returns submission_id -> id.
+    """
+    if not rows:
+        return {}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    table = SurveyResponse.__table__
+    statement = insert(table).values([
+        {"id": uuid.uuid4(), "form_visit_id": form_visit_id, "created_at": now, "updated_at": now, **row}
+        for row in rows
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.submission_id],
+        set_={column: statement.excluded[column] for column in ["form_visit_id", "survey_type", "completed_date", "general_feedback", "updated_at"]}
+    ).returning(table.c.submission_id, table.c.id)
+    return dict(session.execute(statement).all())
+
+def upsert_question_responses(session, rows):
+    """
+    Insert or update question responses on their unique submission_id. The rows are
+    sent as one executemany, which the driver batches into multi-row INSERTs.
+    """
+    if not rows:
+        return
+    now = datetime.datetime.now(datetime.timezone.utc)
+    table = SurveyQuestionResponse.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.submission_id],
+        set_={
+            column: statement.excluded[column]
+            for column in ["survey_response_id", "section_name", "question_name", "field_type", "value_text",
+                           "value_number", "value_boolean", "value_date", "value_gps", "updated_at"]
+        }
+    )
+    session.execute(statement, [{"id": uuid.uuid4(), "created_at": now, "updated_at": now, **row} for row in rows])
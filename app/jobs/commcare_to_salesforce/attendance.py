@@ -26,7 +26,7 @@ async def send_to_salesforce(data: dict, sf_connection):
             "message": "Processing attendance",
             "request_id": request_id
         })
-        process_attendance(data, sf_connection)
+        failed_participants = process_attendance(data, sf_connection)
     except Exception as e:
         logger.error({
             "message": "Error processing attendance",
@@ -35,6 +35,15 @@ async def send_to_salesforce(data: dict, sf_connection):
         })
         return False, str(e)
 
+    # The form still completes; the rejected participants are kept on the record
+    # checkpoint, so retrying the document resends only their attendances
+    if failed_participants:
+        logger.warning({
+            "message": "Some attendances were rejected by Salesforce",
+            "request_id": request_id,
+            "failed_participants": failed_participants
+        })
+
     # Completion log
     logger.info({
         "message": "Attendance processing completed",
@@ -2,6 +2,7 @@
 import asyncio
 from utils.attendance_util import process_attendance, process_training_session
 from utils.registration_util import process_training_group, process_household, process_participant, process_participant_deactivation
+from utils.salesforce_client import CompositeGraph, commit_composite_graphs
 from utils.logging_config import logger
 import os
   
@@ -10,6 +11,10 @@ environment = os.getenv("SALESFORCE_ENV")
 async def send_to_salesforce(data: dict, sf_connection):
     request_id = data.get("id")
 
+    # Composite mode: send every step of the form in one Salesforce request
+    if os.getenv("SF_COMPOSITE_REGISTRATION", "false").lower() == "true":
+        return await send_to_salesforce_composite(data, sf_connection)
+
     try:
         # Step 1: Process training group
         try:
@@ -104,4 +109,49 @@ async def send_to_salesforce(data: dict, sf_connection):
             "error": str(e)
         })
         return False, str(e)
-    
+
+async def send_to_salesforce_composite(data: dict, sf_connection):
+    request_id = data.get("id")
+
+    # The training group counter is best effort (errors were only logged in the step-by-step flow),
+    # so it goes in its own graph and cannot roll back the registration itself.
+    training_group_graph = CompositeGraph("training_group")
+    registration_graph = CompositeGraph("registration")
+
+    try:
+        logger.info({
+            "message": "Building registration composite graph",
+            "request_id": request_id
+        })
+        process_training_group(data, training_group_graph)
+        process_household(data, registration_graph)
+        process_participant(data, registration_graph)
+        process_participant_deactivation(data, registration_graph)
+        process_training_session(data, registration_graph)
+        if os.getenv("SALESFORCE_ENV", "sandbox") != "sandbox":
+            process_attendance(data, registration_graph)
+
+        errors = commit_composite_graphs([training_group_graph, registration_graph], sf_connection)
+    except Exception as e:
+        logger.error({
+            "request_id": request_id,
+            "error": str(e)
+        })
+        return False, str(e)
+
+    if errors.get("training_group"):
+        logger.error({
+            "message": "Error processing training group",
+            "request_id": request_id,
+            "error": "; ".join(errors["training_group"])
+        })
+
+    if errors.get("registration"):
+        error = "; ".join(errors["registration"])
+        logger.error({
+            "request_id": request_id,
+            "error": error
+        })
+        return False, error
+
+    return True, None
@@ -0,0 +1,109 @@
+import asyncio
+import importlib
+import time
+from dataclasses import dataclass
+from utils.api_budget import track_job
+from utils.logging_config import logger
+
+@dataclass(frozen=True)
+class JobHandler:
+    """
+    How one job type is processed: the handler function (module and name), the system
+    it writes to, whether it is a coroutine, and the arguments it takes, out of
+    "data", "job_name" and "sf_connection". Handlers return (success, error).
+    """
+    module: str
+    function: str
+    destination: str
+    is_async: bool = True
+    arguments: tuple = ("data", "sf_connection")
+
+    @property
+    def name(self):
+        return f"{self.module.rsplit('.', 1)[-1]}.{self.function}"
+
+    def resolve(self):
+        # Imported on first use, so the registry can be loaded without every job module
+        return getattr(importlib.import_module(self.module), self.function)
+
+REGISTRATION = JobHandler("jobs.commcare_to_salesforce.registration", "send_to_salesforce", "Salesforce")
+ATTENDANCE = JobHandler("jobs.commcare_to_salesforce.attendance", "send_to_salesforce", "Salesforce")
+TRAINING_OBSERVATION = JobHandler("jobs.commcare_to_salesforce.training_observation", "send_to_salesforce", "Salesforce")
+DEMOPLOT_OBSERVATION = JobHandler("jobs.commcare_to_salesforce.demoplot_observation", "send_to_salesforce", "Salesforce")
+FARM_VISIT = JobHandler("jobs.commcare_to_salesforce.farm_visit", "send_to_salesforce", "Salesforce")
+COMMCARE_SYNC = JobHandler("jobs.salesforce_to_commcare.process_commcare_data", "process_records_parallel", "CommCare", arguments=("data", "job_name"))
+WETMILL_REGISTRATION = JobHandler("jobs.commcare_to_postrgresql.wetmill_registration", "save_wetmill_registration", "PostgreSQL", is_async=False)
+WETMILL_VISIT = JobHandler("jobs.commcare_to_postrgresql.wetmill_visit", "save_form_visit", "PostgreSQL", is_async=False, arguments=("data",))
+
+JOB_HANDLERS = {
+    # CommCare -> Salesforce
+    "Farmer Registration": REGISTRATION,
+    "Edit Farmer Details": REGISTRATION,
+    "Field Day Farmer Registration": REGISTRATION,
+    "Attendance Full - Current Module": ATTENDANCE,
+    "Attendance Light - Current Module": ATTENDANCE,
+    "Field Day Attendance Full": ATTENDANCE,
+    "Training Observation": TRAINING_OBSERVATION,
+    "Demo Plot Observation": DEMOPLOT_OBSERVATION,
+    "Farm Visit Full": FARM_VISIT,
+    "Farm Visit - AA": FARM_VISIT,
+
+    # Salesforce -> CommCare
+    "Participant": COMMCARE_SYNC,
+    "Training Group": COMMCARE_SYNC,
+    "Training Session": COMMCARE_SYNC,
+    "Project Role": COMMCARE_SYNC,
+    "Household Sampling": COMMCARE_SYNC,
+
+    # CommCare -> PostgreSQL
+    "Wet Mill Registration Form": WETMILL_REGISTRATION,
+    "Wet Mill Visit": WETMILL_VISIT,
+}
+
+_timing_hooks = []
+
+def add_timing_hook(hook):
+    """
+    Register `hook(job_name, handler, seconds, success)`, called after every dispatch.
+    `success` is None when the handler raised.
+    """
+    _timing_hooks.append(hook)
+
+def get_destination(job_name, default=None):
+    handler = JOB_HANDLERS.get(job_name)
+    return handler.destination if handler else default
+
+def _run_timing_hooks(job_name, handler, seconds, success):
+    for hook in _timing_hooks:
+        try:
+            hook(job_name, handler, seconds, success)
+        except Exception as e:
+            logger.error({
+                "message": "Job timing hook failed",
+                "job_name": job_name,
+                "error": str(e)
+            })
+
+async def dispatch(job_name, data, sf_connection=None):
+    """Run the handler registered for `job_name` and return its (success, error)."""
+    handler = JOB_HANDLERS.get(job_name)
+    if handler is None:
+        return False, f"No handler registered for job '{job_name}'"
+
+    values = {"data": data, "job_name": job_name, "sf_connection": sf_connection}
+    args = [values[argument] for argument in handler.arguments]
+    function = handler.resolve()
+
+    success = None
+    start = time.perf_counter()
+    try:
+        # Salesforce requests made by the job are counted against its job name
+        with track_job(job_name):
+            if handler.is_async:
+                success, error = await function(*args)
+            else:
+                # Blocking handlers (PostgreSQL) run in a thread so the event loop stays free
+                success, error = await asyncio.to_thread(function, *args)
+        return success, error
+    finally:
+        _run_timing_hooks(job_name, handler, time.perf_counter() - start, success)
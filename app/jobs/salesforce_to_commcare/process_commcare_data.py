@@ -3,16 +3,20 @@ import aiohttp
 from datetime import datetime
 import requests
 from utils.logging_config import logger
-from main import authenticate_commcare
-from utils.generate_xml import generate_xml
+from utils.commcare_client import authenticate_commcare
+from utils.xml_templates import get_case_id, render_case_batch, render_xml
+from utils.case_batches import CC_CASES_PER_SUBMISSION, split_batches, submit_case_batch
+from utils.metrics import COMMCARE_SUBMISSION_SECONDS, get_caller_step, get_job_name
+from utils.rate_limit import CC_MAX_CONCURRENCY, get_throttle, is_retryable_status, parse_retry_after
+from utils.record_checkpoint import current_checkpoint
 import xml.etree.ElementTree as ET
 
-async def process_record(job_name, job_id, record, project_unique_id, record_number, processed_counter, session, url, headers, semaphore):
+async def process_record(job_name, job_id, record, project_unique_id, record_number, processed_counter, session, url, headers, semaphore, throttle=None):
     async with semaphore:
         try:
-            xml_string = generate_xml(job_name, job_id, record, project_unique_id)
+            xml_string = render_xml(job_name, job_id, record, project_unique_id)
             
-            success, error = await send_to_commcare(xml_string, session, url, headers)
+            success, error = await send_to_commcare(xml_string, session, url, headers, throttle)
             if success:
                 processed_counter[0] += 1
             log_message = f"Processed {job_name} record #{record_number} with case ID: {record.get("commCareCaseId")}"
@@ -23,6 +27,31 @@ async def process_record(job_name, job_id, record, project_unique_id, record_num
             logger.error(f"Failed to process {job_name} #{record_number}: {str(e)}")
             return False, str(e)
 
+async def process_batch(job_name, job_id, batch, project_unique_id, processed_counter, session, url, headers, semaphore, throttle=None):
+    """Submit a batch of (record_number, record) pairs as multi-case forms; one (success, error) per record."""
+    async def send_batch(items):
+        async with semaphore:
+            try:
+                xml_string = render_case_batch(job_name, job_id, [record for _, record in items], project_unique_id)
+                success, error, status = await submit_to_commcare(xml_string, session, url, headers, throttle)
+            except Exception as e:
+                logger.error(f"Failed to process {job_name} records #{items[0][0]}-#{items[-1][0]}: {str(e)}")
+                return False, str(e), False
+        if success:
+            processed_counter[0] += len(items)
+            logger.info(f"Processed {job_name} records #{items[0][0]}-#{items[-1][0]} successfully in one submission")
+        # The receiver answered and refused the form; connection errors, 429s and 5xx say nothing about its cases
+        rejected = not success and status is not None and not is_retryable_status(status)
+        return success, error, rejected
+
+    async def send_one(item):
+        record_number, record = item
+        return await process_record(
+            job_name, job_id, record, project_unique_id, record_number, processed_counter, session, url, headers, semaphore, throttle
+        )
+
+    return await submit_case_batch(batch, lambda item: get_case_id(job_name, item[1]), send_batch, send_one)
+
 async def process_records_parallel(data, job_name):
     project_unique_id = data.get("uniqueProjectKey", "").lower()
     
@@ -39,22 +68,57 @@ async def process_records_parallel(data, job_name):
     processed_counter = [0]
     start_time = datetime.now()
     url, headers = authenticate_commcare()
-    semaphore = asyncio.Semaphore(50)  # Concurrency limit
+    # Records in progress at once; the receiver's throttle, shared with every other job
+    # of the instance, adapts the submissions in flight below this
+    semaphore = asyncio.Semaphore(CC_MAX_CONCURRENCY)
+    throttle = get_throttle(url)
+    throttle_start = throttle.counters()
+
+    # Records an earlier run of the same document delivered are not sent again
+    checkpoint = current_checkpoint.get()
+    if checkpoint is not None:
+        checkpoint.start(len(records))
+        pending = checkpoint.pending(records)
+    else:
+        pending = list(enumerate(records))
+    numbered = [(position + 1, record) for position, record in pending]
 
     async with aiohttp.ClientSession() as session:
-        tasks = []
-        for idx, record in enumerate(records, start=1):
-            task = process_record(
-                job_name, job_id, record, project_unique_id, idx, processed_counter, session, url, headers, semaphore
-            )
-            tasks.append(task)
-        
-        results = await asyncio.gather(*tasks)
+        if CC_CASES_PER_SUBMISSION > 1:
+            # Pack the case blocks of several records into each submission
+            batches = split_batches(numbered)
+            batch_results = await asyncio.gather(*(
+                process_batch(job_name, job_id, batch, project_unique_id, processed_counter, session, url, headers, semaphore, throttle)
+                for batch in batches
+            ))
+            results = [result for batch_result in batch_results for result in batch_result]
+        else:
+            tasks = []
+            for idx, record in numbered:
+                task = process_record(
+                    job_name, job_id, record, project_unique_id, idx, processed_counter, session, url, headers, semaphore, throttle
+                )
+                tasks.append(task)
+            
+            results = await asyncio.gather(*tasks)
+
+    if checkpoint is not None:
+        for (idx, _), (success, _) in zip(numbered, results):
+            if success:
+                checkpoint.mark_completed(idx - 1)
     
     end_time = datetime.now()
     total_duration = (end_time - start_time).total_seconds()
-    logger.info(f"Total {job_name} records processed successfully: {processed_counter[0]}/{len(records)}")
+    logger.info(f"Total {job_name} records processed successfully: {processed_counter[0]}/{len(numbered)}")
     logger.info(f"Total time taken: {total_duration:.2f} seconds")
+    logger.info({
+        "message": f"{job_name} submission throughput",
+        "job_id": job_id,
+        "records": len(records),
+        "succeeded": processed_counter[0],
+        "skipped": len(records) - len(numbered),
+        **throttle.summary(processed_counter[0], since=throttle_start),
+    })
     
     if all(result[0] for result in results):
         return True, None
@@ -62,23 +126,49 @@ async def process_records_parallel(data, job_name):
         errors = [result[1] for result in results if result[1] is not None]
         return False, "; ".join(errors)
 
-async def send_to_commcare(data, session, url, headers):
-    try:
-        async with session.post(url=url, data=data, headers=headers) as response:
-            response_text = await response.text()
-            response_nature, response_message = extract_xml_response(response_text)
-            
-            if response.status == 201 and response_nature == "submit_success":
-                logger.info(f"Form submitted successfully! HTTP Status: {response.status}")
-                logger.info(f"Response nature: '{response_nature}', message: '{response_message}'")
-                return True, None
-            else:
-                logger.error(f"Failed to submit form. HTTP Status: {response.status}")
-                logger.error(f"Response nature: '{response_nature}', message: '{response_message}'")
-                return False, f"HTTP Status: {response.status}, message: '{response_message}'"
-    except Exception as e:
-        logger.error(f"An error occurred: {str(e)}")
-        return False, f"An error occurred: {str(e)}"
+async def send_to_commcare(data, session, url, headers, throttle=None):
+    """Submit one XForm; with a throttle, paced and retried on 429/5xx. Returns (success, error)."""
+    success, error, _ = await submit_to_commcare(data, session, url, headers, throttle, get_caller_step())
+    return success, error
+
+async def submit_to_commcare(data, session, url, headers, throttle=None, step=None):
+    """Like send_to_commcare; returns (success, error, HTTP status of the last attempt or None without a response)."""
+    step = step or get_caller_step()
+    if throttle is None:
+        success, error, status, _ = await post_to_commcare(data, session, url, headers, step)
+        return success, error, status
+
+    last_status = [None]
+    async def request():
+        outcome = await post_to_commcare(data, session, url, headers, step)
+        last_status[0] = outcome[2]
+        return outcome
+
+    success, error = await throttle.call(request, "CommCare submission")
+    return success, error, last_status[0]
+
+async def post_to_commcare(data, session, url, headers, step):
+    """Returns (success, error, HTTP status or None without a response, Retry-After seconds or None)."""
+    with COMMCARE_SUBMISSION_SECONDS.time(job_name=get_job_name(), step=step) as labels:
+        try:
+            async with session.post(url=url, data=data, headers=headers) as response:
+                response_text = await response.text()
+                response_nature, response_message = extract_xml_response(response_text)
+                
+                if response.status == 201 and response_nature == "submit_success":
+                    logger.info(f"Form submitted successfully! HTTP Status: {response.status}")
+                    logger.info(f"Response nature: '{response_nature}', message: '{response_message}'")
+                    return True, None, response.status, None
+                else:
+                    logger.error(f"Failed to submit form. HTTP Status: {response.status}")
+                    logger.error(f"Response nature: '{response_nature}', message: '{response_message}'")
+                    labels["outcome"] = "failed"
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    return False, f"HTTP Status: {response.status}, message: '{response_message}'", response.status, retry_after
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            labels["outcome"] = "error"
+            return False, f"An error occurred: {str(e)}", None, None
     
 def extract_xml_response(xml_response):
     try:
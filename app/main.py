@@ -1,19 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import asyncio
 from google.cloud import firestore
 from google.cloud.firestore import FieldFilter
 from google.api_core.retry import Retry
-from jobs.commcare_to_salesforce import registration, attendance, training_observation, demoplot_observation, farm_visit
-from jobs.commcare_to_postrgresql import wetmill_registration, wetmill_visit
-from utils.firestore_client import save_to_firestore, update_firestore_status
+from jobs.registry import dispatch, get_destination, add_timing_hook
+from utils.firestore_client import get_firestore_client, save_to_firestore, update_firestore_status, claim_documents, release_expired_leases, new_lease_owner, StatusWriteBatcher, find_documents_by_job_ids, backfill_job_ids, get_job_id
+from utils.worker_pool import get_record_lock_keys, group_by_lock_keys, run_lanes, run_in_thread
+from utils.batch_controller import AdaptiveBatchController
+from utils.salesforce_session import SalesforceSessionManager
+from utils.api_budget import is_throttled, get_api_budget, refresh_api_usage
+from utils.background_jobs import BackgroundJob, get_background_job, run_items, start_background_job
+from utils.status_counters import STATUSES, add_status_change, apply_status_deltas, get_status_counts, reconcile_status_counts
+from utils.metrics import observe_job, render_metrics
+from utils.record_checkpoint import track_records
+from utils.job_shards import get_sharded_records, is_shard_parent, save_sharded_to_firestore, settle_shard
 import os
-from simple_salesforce import Salesforce
 from dotenv import load_dotenv
 from utils.logging_config import logger  # Import the centralized logger
 from datetime import datetime, timezone
-import requests
-from jobs.salesforce_to_commcare import process_commcare_data
-import httpx
+import time
+import threading
 
 from utils.postgres import init_db
 
@@ -26,7 +32,7 @@ def main():
 load_dotenv()  # Load environment variables
 
 app = Flask(__name__)
-db = firestore.Client()
+db = get_firestore_client()
 
 migrated_form_types = [
     "Farmer Registration", "Attendance Full - Current Module", 
@@ -40,43 +46,113 @@ migrated_form_types = [
 
 # Salesforce Authentication
 def authenticate_salesforce():
-    environment = os.getenv("SALESFORCE_ENV", "sandbox")
-    password = os.getenv("SF_PROD_PASSWORD")
-    security_token = os.getenv("SF_PROD_SECURITY_TOKEN")
+    """
+    Return the session manager shared by all workers. It logs in here (or reuses the
+    cached token) and logs in again whenever the session expires, so a failed login
+    at startup is retried on the next request instead of lasting until a restart.
+    """
+    sf = SalesforceSessionManager.from_env()
+    sf.get_connection()
+    return sf
+
+# Initialize Salesforce connection
+sf_connection = authenticate_salesforce()
 
-    if environment == "sandbox":
-        username = os.getenv("SF_TEST_USERNAME")
-        domain = "test"  # Salesforce sandbox domain
-    else:
-        username = os.getenv("SF_PROD_USERNAME")
-        domain = "login"  # Salesforce production domain
+# Documents pulled per page from each queue: the first page uses "initial", later pages
+# are sized by the AdaptiveBatchController up to "max"
+batch_sizes = {
+    "salesforce_collection": {"initial": 1, "max": int(os.getenv("SF_COLLECTION_MAX_BATCH_SIZE", "5"))},
+    "commcare_collection": {"initial": 10, "max": int(os.getenv("CC_COLLECTION_MAX_BATCH_SIZE", "100"))}
+}
 
-    try:
-        sf = Salesforce(username=username, password=password, security_token=security_token, domain=domain)
-        logger.info({
-            "message": "Authenticated with Salesforce",
-            "environment": environment
+# Fields returned by /failed unless the form payload is requested with include=data
+FAILED_JOB_FIELDS = ["job_name", "job_id", "status", "error", "run_retries", "last_retried_at", "created_at", "updated_at"]
+FAILED_JOBS_PAGE_SIZE = 100
+FAILED_JOBS_MAX_PAGE_SIZE = 1000
+
+# Handlers taking longer than this are logged with their timing
+SLOW_JOB_SECONDS = float(os.getenv("SLOW_JOB_SECONDS", "60"))
+
+def log_slow_job(job_name, handler, seconds, success):
+    if seconds >= SLOW_JOB_SECONDS:
+        logger.warning({
+            "message": "Slow job handler",
+            "job_name": job_name,
+            "handler": handler.name,
+            "destination": handler.destination,
+            "seconds": round(seconds, 2),
+            "success": success
         })
-        return sf
-    except Exception as e:
-        logger.error({
-            "message": "Error authenticating with Salesforce",
-            "environment": environment,
-            "error": str(e)
+
+add_timing_hook(log_slow_job)
+add_timing_hook(observe_job)
+
+def salesforce_unavailable(destination):
+    """
+    True when the run is bound for Salesforce but no session can be established. The
+    run then stops before claiming documents, so they keep their status and retry count.
+    """
+    if destination != "Salesforce" or sf_connection.is_available():
+        return False
+
+    logger.error({
+        "message": "Salesforce session unavailable, skipping run",
+        "destination": destination
+    })
+    return True
+
+def get_runnable_form_types(collection):
+    """
+    Form types to pull from the queue. Forms bound for Salesforce are left queued
+    while the org's daily API usage is past their throttle threshold.
+    """
+    if collection != "commcare_collection":
+        return migrated_form_types
+
+    refresh_api_usage(sf_connection)
+    runnable = [job_name for job_name in migrated_form_types if not is_throttled(job_name, get_destination(job_name))]
+    if len(runnable) < len(migrated_form_types):
+        logger.warning({
+            "message": "Deferring form types while Salesforce API usage is high",
+            "deferred": [job_name for job_name in migrated_form_types if job_name not in runnable],
+            "api_usage": get_api_budget()["api_usage"]
         })
-        return None
+    return runnable
 
-def authenticate_commcare():
-    domain = os.getenv("CC_DOMAIN")
-    apikey = os.getenv("CC_API_KEY")
-    username = os.getenv("CC_USERNAME")
-    url = f'https://www.commcarehq.org/a/{domain}/receiver/GCP_Forms/'
-    headers = {'Authorization': 'ApiKey ' + f'{username}:{apikey}',
-               "Content-Type": "text/xml"}
-    return url, headers
+def get_failed_jobs_query(collection, include_data=False, page_token=None, page_size=None):
+    """
+    Failed documents ordered by document ID, starting after `page_token` (a document ID).
+    Unless `include_data` is set, only the summary fields are read from Firestore.
+    """
+    query = (
+        db.collection(collection)
+        .where(filter=FieldFilter("status", "==", "failed"))
+        .order_by("__name__")  # Document ID
+    )
+    if not include_data:
+        query = query.select(FAILED_JOB_FIELDS)
+    if page_token:
+        query = query.start_after({"__name__": page_token})
+    if page_size:
+        query = query.limit(page_size)
+    return query
+
+def get_backlog(collection, status):
+    """
+    Documents in `status`, read from the sharded status counters rather than counted.
+    None when the counter is not positive: it may have drifted, so the queue is still
+    read page by page until it comes back empty.
+    """
+    backlog = get_status_counts(collection, db).get(status, 0)
+    return backlog if backlog > 0 else None
 
-# Initialize Salesforce connection
-sf_connection = authenticate_salesforce()
+def get_status_count(collection, status):
+    query = (
+        db.collection(collection)
+        .where(filter=FieldFilter("status", "==", status))
+    )
+    result = query.count().get(retry=Retry(deadline=120))
+    return result[0][0].value
 
 @app.route('/process-data-<origin_url_parameter>', methods=['POST'])
 def process_data(origin_url_parameter):
@@ -154,7 +230,12 @@ def process_data(origin_url_parameter):
             
             # PIMA Agronomy saved to firestore and later forwarded to Salesforce     
             # else:
-            doc_id = save_to_firestore(data, job_name, "new", collection)
+            # Large Salesforce payloads are split into shard documents under a parent job
+            records_key, records = get_sharded_records(data) if origin == "Salesforce" else (None, None)
+            if records_key:
+                doc_id = save_sharded_to_firestore(data, job_name, collection, records_key, db=db)
+            else:
+                doc_id = save_to_firestore(data, job_name, "new", collection, db=db)
             logger.info({
                 "message": "Data stored in Firestore",
                 "request_id": request_id,
@@ -183,100 +264,112 @@ def process_data(origin_url_parameter):
 # Function to check the size of records from Salesforce to be able to process the record immediately
 
 async def process_firestore_records(collection):
-    # Query records to send to SF. 10 Records at a time
-    
-    query_size = {"salesforce_collection": 1, 
-                  "commcare_collection": 10
-                  }
-    
-    docs = db.collection(collection).where(
-        filter=FieldFilter("status", "==", "new")).where(
-        filter=FieldFilter("job_name", "in", migrated_form_types)
-        ).limit(query_size.get(collection, 0)).get()
-    
-    destination = 'CommCare' if collection == 'salesforce_collection' else "Salesforce" if collection == 'commcare_collection' else None
+    # Pull pages of new records until the backlog is drained or the request time budget is spent
+    sizes = batch_sizes.get(collection, {"initial": 0, "max": 0})
+    controller = AdaptiveBatchController(sizes["initial"], sizes["max"])
+    backlog = get_backlog(collection, "new")
 
+    status_writer = StatusWriteBatcher(db=db)
     processed_records = []
-    for doc in docs:
-        doc_id = doc.id
-        data = doc.to_dict()  # Extract data from Firestore
-        request_id = data.get("data", {}).get("id")  # Request ID: Used to track the record in logs
-        job_name = data.get("job_name")
-        
-        destination = "PostgreSQL" if job_name in ["Wet Mill Registration Form", "Wet Mill Visit"] else destination
+    while True:
+        batch_size = controller.next_batch_size(backlog)
+        if not batch_size:
+            break
+
+        form_types = get_runnable_form_types(collection)
+        if not form_types:
+            break
+
+        page_start = time.monotonic()
+        docs = db.collection(collection).where(
+            filter=FieldFilter("status", "==", "new")).where(
+            filter=FieldFilter("job_name", "in", form_types)
+            ).limit(batch_size).get()
+        if not docs:
+            break
+        if backlog is not None:
+            backlog -= len(docs)
 
-        try:
-            logger.info({
-                "message": f"Started sending record with Request ID: '{request_id}' to {destination}",
-                "request_id": request_id,
-                "doc_id": doc_id
-            })
+        # Claim the documents so overlapping scheduler runs do not process them twice
+        docs = claim_documents(docs, collection, new_lease_owner(), db=db)
 
-            update_firestore_status(doc_id, "processing", collection)  # Set status to "processing" before handling the record
+        # Documents run concurrently, except those writing to the same household or training session
+        lanes = group_by_lock_keys(docs, lambda doc: get_record_lock_keys(doc.to_dict().get("data", {})))
+        results = await run_lanes(lanes, lambda doc: run_in_thread(process_firestore_record, doc, collection, status_writer))
+        processed_records.extend(doc_id for doc_id in results if doc_id)
 
-            # 1. Farmer Registration and Update
-            if job_name in ["Farmer Registration", "Edit Farmer Details", "Field Day Farmer Registration"]:
-                success, error = await registration.send_to_salesforce(data.get("data"), sf_connection)
+        # Commit the page's statuses before the leases on its documents can expire
+        status_writer.flush()
 
-            # 2. Attendance Light and Full
-            elif job_name in ["Attendance Full - Current Module", "Attendance Light - Current Module", "Field Day Attendance Full"]:
-                success, error = await attendance.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 3. Training Observation    
-            elif job_name == "Training Observation":
-                success, error = await training_observation.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 4. Salesforce -> CommCare    
-            elif job_name in ["Participant", "Training Group", "Training Session", "Project Role", "Household Sampling"]:
-                success, error = await process_commcare_data.process_records_parallel(data.get("data"), job_name)  # Use the new parallel processing function
-                
-            # 5. Demo Plot Observation    
-            elif job_name == "Demo Plot Observation":
-                # success, error = await demoplot_observation.send_to_salesforce(data.get("data"), sf_connection)
-                success, error = await demoplot_observation.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 6. Farm Visit
-            elif job_name in ["Farm Visit Full", "Farm Visit - AA"]:
-                success, error = await farm_visit.send_to_salesforce(data.get("data"), sf_connection)
-                
-            # 7. Wet Mill Registration and Visit to PostgreSQL
-            elif job_name in ["Wet Mill Registration Form", "Wet Mill Visit"]:
-                if job_name == "Wet Mill Registration Form":
-                    success, error = wetmill_registration.save_wetmill_registration(data.get("data"), sf_connection)
-                elif job_name == "Wet Mill Visit":
-                    success, error = wetmill_visit.save_form_visit(data.get("data"))
+        controller.record_batch(len(docs), time.monotonic() - page_start)
+        logger.info({
+            "message": "Processed page of Firestore records",
+            "collection": collection,
+            "page": controller.pages,
+            "page_size": len(docs),
+            "seconds_per_record": controller.seconds_per_record,
+            "remaining_time": controller.remaining_time(),
+            "backlog": backlog
+        })
 
+    return processed_records
 
-            if success:
-                # If processing is successful, mark as completed
-                update_firestore_status(doc_id, "completed", collection)
-                processed_records.append(doc_id)
-                logger.info({
-                    "message": f"Processed successfully record with Request ID: '{request_id}' to {destination}",
-                    "request_id": request_id,
-                    "doc_id": doc_id
-                })
-            else:
-                # If failed, mark record as failed with the error
-                update_firestore_status(doc_id, "failed", collection, {"error": error})
-                logger.error({
-                    "message": f"Failed to process record with Request ID: '{request_id}' to {destination}",
-                    "request_id": request_id,
-                    "doc_id": doc_id,
-                    "error": error
-                })
+async def process_firestore_record(doc, collection, status_writer):
+    doc_id = doc.id
+    data = doc.to_dict()  # Extract data from Firestore
+    request_id = data.get("data", {}).get("id")  # Request ID: Used to track the record in logs
+    job_name = data.get("job_name")
+    
+    destination = 'CommCare' if collection == 'salesforce_collection' else "Salesforce" if collection == 'commcare_collection' else None
+    destination = get_destination(job_name, destination)
 
-        except Exception as e:
-            # In case of error, mark as failed and log the error
-            update_firestore_status(doc_id, "failed", collection, {"error": str(e)})
+    try:
+        logger.info({
+            "message": f"Started sending record with Request ID: '{request_id}' to {destination}",
+            "request_id": request_id,
+            "doc_id": doc_id
+        })
+
+        # Run the handler registered for the job type, recording which of its records were delivered
+        with track_records(data.get("record_checkpoint")) as checkpoint:
+            success, error = await dispatch(job_name, data.get("data"), sf_connection)
+
+        if success:
+            # If processing is successful, mark as completed, keeping any records the destination rejected
+            status_writer.update_status(doc_id, "completed", collection, checkpoint.to_fields(), previous_status="processing")
+            if data.get("parent_id"):
+                settle_shard(collection, doc_id, data["parent_id"], "completed", db=db)
+            logger.info({
+                "message": f"Processed successfully record with Request ID: '{request_id}' to {destination}",
+                "request_id": request_id,
+                "doc_id": doc_id
+            })
+            return doc_id
+        else:
+            # If failed, mark record as failed with the error and the records already delivered
+            status_writer.update_status(doc_id, "failed", collection, {"error": error, **checkpoint.to_fields()}, previous_status="processing")
+            if data.get("parent_id"):
+                settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
             logger.error({
-                "message": f"Error processing record with Request ID: '{request_id}' to {destination}",
+                "message": f"Failed to process record with Request ID: '{request_id}' to {destination}",
                 "request_id": request_id,
                 "doc_id": doc_id,
-                "error": str(e)
+                "error": error
             })
 
-    return processed_records
+    except Exception as e:
+        # In case of error, mark as failed and log the error
+        status_writer.update_status(doc_id, "failed", collection, {"error": str(e)}, previous_status="processing")
+        if data.get("parent_id"):
+            settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
+        logger.error({
+            "message": f"Error processing record with Request ID: '{request_id}' to {destination}",
+            "request_id": request_id,
+            "doc_id": doc_id,
+            "error": str(e)
+        })
+
+    return None
 
 @app.route('/process-firestore-to-<destination_url_parameter>', methods=['POST'])
 async def process_firestore(destination_url_parameter):
@@ -289,12 +382,18 @@ async def process_firestore(destination_url_parameter):
     # Use the mapping to set destination and origin, defaulting to None if the collection is not found
     destination, origin, collection = mapping.get(destination_url_parameter.lower().strip(), {'destination': None, 'origin': None, 'collection': None}).values()
     
+    if salesforce_unavailable(destination):
+        return jsonify({"error": "Salesforce session unavailable"}), 503
+
     try:
         timeStart = datetime.now()
         logger.info({
             "message": "Batch processing started from scheduler",
             "timeStart": str(timeStart)
         })
+
+        # Return documents left behind by crashed or timed out workers to the queue
+        release_expired_leases(collection, db=db)
         
         # Assuming process_firestore_records is asynchronous and processes records in batches
         processed_records = await process_firestore_records(collection)
@@ -319,28 +418,36 @@ async def process_firestore(destination_url_parameter):
         return jsonify({"error": f"Error processing Firestore records: {str(e)}"}), 500
 
 async def process_failed_records(collection):
-    # Query records to send to SF. 10 Records at a time
-    
-    query_size = {"salesforce_collection": 1, 
-                  "commcare_collection": 10
-                  }
+    # Retries pull a single page (a record failing again would otherwise be picked up
+    # straight away), sized from the failed backlog
+    sizes = batch_sizes.get(collection, {"initial": 0, "max": 0})
+    controller = AdaptiveBatchController(sizes["initial"], sizes["max"])
+    batch_size = controller.next_batch_size(get_backlog(collection, "failed"))
+    form_types = get_runnable_form_types(collection)
+    if not batch_size or not form_types:
+        return []
     
     docs = db.collection(collection).where(
         filter=FieldFilter("status", "==", "failed")).where( 
-        filter=FieldFilter("job_name", "in", migrated_form_types)).where( 
+        filter=FieldFilter("job_name", "in", form_types)).where( 
         filter=FieldFilter("run_retries", "<", 3)
-        ).limit(query_size.get(collection, 0)).get()
+        ).limit(batch_size).get()
+
+    # Claim the documents so overlapping scheduler runs do not retry them twice
+    docs = claim_documents(docs, collection, new_lease_owner(), db=db)
     
     destination = 'CommCare' if collection == 'salesforce_collection' else "Salesforce" if collection == 'commcare_collection' else None
 
+    status_writer = StatusWriteBatcher(db=db)
     processed_records = []
+    skipped_records = 0
     for doc in docs:
         doc_id = doc.id
         data = doc.to_dict()  # Extract data from Firestore
         request_id = data.get("data", {}).get("id")  # Request ID: Used to track the record in logs
         job_name = data.get("job_name")
         
-        destination = "PostgreSQL" if job_name in ["Wet Mill Registration Form", "Wet Mill Visit"] else destination
+        destination = get_destination(job_name, destination)
 
         try:
             logger.info({
@@ -349,42 +456,16 @@ async def process_failed_records(collection):
                 "doc_id": doc_id
             })
 
-            update_firestore_status(doc_id, "processing", collection)  # Set status to "processing" before handling the record
-
-            # 1. Farmer Registration and Update
-            if job_name in ["Farmer Registration", "Edit Farmer Details", "Field Day Farmer Registration"]:
-                success, error = await registration.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 2. Attendance Light).where( Full    
-            elif job_name in ["Attendance Full - Current Module", "Attendance Light - Current Module", "Field Day Attendance Full"]:
-                success, error = await attendance.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 3. Training Observation    
-            elif job_name == "Training Observation":
-                success, error = await training_observation.send_to_salesforce(data.get("data"), sf_connection)
-            
-            # 4. Salesforce -> CommCare    
-            elif job_name in ["Participant", "Training Group", "Training Session", "Project Role", "Household Sampling"]:
-                success, error = await process_commcare_data.process_records_parallel(data.get("data"), job_name)  # Use the new parallel processing function 
-            
-            # 5. Demo Plot Observation    
-            elif job_name == "Demo Plot Observation":
-                success, error = await demoplot_observation.send_to_salesforce(data.get("data"), sf_connection)
-                
-            # 6. Farm Visit Full
-            elif job_name in ["Farm Visit Full", "Farm Visit - AA"]:
-                success, error = await farm_visit.send_to_salesforce(data.get("data"), sf_connection)
-                
-            # 7. Wet Mill Registration and Visit to PostgreSQL
-            elif job_name in ["Wet Mill Registration Form", "Wet Mill Visit"]:
-                if job_name == "Wet Mill Registration Form":
-                    success, error = wetmill_registration.save_wetmill_registration(data.get("data"), sf_connection)
-                elif job_name == "Wet Mill Visit":
-                    success, error = wetmill_visit.save_form_visit(data.get("data"))
+            # Run the handler registered for the job type; records delivered by earlier runs are skipped
+            with track_records(data.get("record_checkpoint")) as checkpoint:
+                success, error = await dispatch(job_name, data.get("data"), sf_connection)
+            skipped_records += checkpoint.skipped
 
             if success:
                 # If processing is successful, mark as completed
-                update_firestore_status(doc_id, "completed", collection)
+                status_writer.update_status(doc_id, "completed", collection, checkpoint.to_fields(), previous_status="processing")
+                if data.get("parent_id"):
+                    settle_shard(collection, doc_id, data["parent_id"], "completed", db=db)
                 processed_records.append(doc_id)
                 logger.info({
                     "message": f"Processed successfully record with Request ID: '{request_id}' to {destination}",
@@ -393,7 +474,9 @@ async def process_failed_records(collection):
                 })
             else:
                 # If failed, mark record as failed with the error
-                update_firestore_status(doc_id, "failed", collection, {"error": error, "run_retries": data.get("run_retries", 0) + 1})
+                status_writer.update_status(doc_id, "failed", collection, {"error": error, "run_retries": data.get("run_retries", 0) + 1, **checkpoint.to_fields()}, previous_status="processing")
+                if data.get("parent_id"):
+                    settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
                 logger.error({
                     "message": f"Failed to process record with Request ID: '{request_id}' to {destination}",
                     "request_id": request_id,
@@ -403,7 +486,9 @@ async def process_failed_records(collection):
 
         except Exception as e:
             # In case of error, mark as failed and log the error
-            update_firestore_status(doc_id, "failed", collection, {"error": str(e), "run_retries": data.get("run_retries", 0) + 1})
+            status_writer.update_status(doc_id, "failed", collection, {"error": str(e), "run_retries": data.get("run_retries", 0) + 1}, previous_status="processing")
+            if data.get("parent_id"):
+                settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
             logger.error({
                 "message": f"Error processing record with Request ID: '{request_id}' to {destination}",
                 "request_id": request_id,
@@ -411,7 +496,8 @@ async def process_failed_records(collection):
                 "error": str(e)
             })
 
-    return processed_records
+    status_writer.flush()
+    return processed_records, skipped_records
 
 @app.route('/auto-retry-firestore-to-<destination_url_parameter>', methods=['POST'])
 async def retry_firestore_records(destination_url_parameter):
@@ -424,20 +510,24 @@ async def retry_firestore_records(destination_url_parameter):
     # Use the mapping to set destination and origin, defaulting to None if the collection is not found
     destination, origin, collection = mapping.get(destination_url_parameter.lower().strip(), {'destination': None, 'origin': None, 'collection': None}).values()
     
+    if salesforce_unavailable(destination):
+        return jsonify({"error": "Salesforce session unavailable"}), 503
+
     try:
         logger.info({
             "message": "Auto Retrying started from scheduler"
         })
         
         # Assuming process_firestore_records is asynchronous and processes records in batches
-        processed_records = await process_failed_records(collection)
+        processed_records, skipped_records = await process_failed_records(collection)
 
         logger.info({
             "message": "Auto Retrying processing completed",
-            "processed_records": processed_records
+            "processed_records": processed_records,
+            "skipped_records": skipped_records
         })
 
-        return jsonify({"status": "Processing completed", "processed_records": processed_records, "processed_records_count": len(processed_records)}), 200
+        return jsonify({"status": "Processing completed", "processed_records": processed_records, "processed_records_count": len(processed_records), "skipped_records": skipped_records}), 200
 
     except Exception as e:
         logger.error({
@@ -450,7 +540,7 @@ async def retry_firestore_records(destination_url_parameter):
 def get_record(collection, id):
 
     try:
-        docs = db.collection(collection).where(filter=FieldFilter("data.id", "==", id)).get()
+        docs = find_documents_by_job_ids(collection, [id], db=db)
 
         if not docs:
             return jsonify({"message": f"No records found in {collection}", "id": id}), 404
@@ -468,6 +558,78 @@ def get_record(collection, id):
         })
         return jsonify({"error": "Failed to fetch record", "details": str(e)}), 500
     
+async def retry_document(doc, collection, destination, skipped_records=None):
+    """
+    Send one stored document to its destination again and record the outcome on the
+    document. Records an earlier run delivered are skipped, and their count appended
+    to `skipped_records` when given. Returns (success, error).
+    """
+    doc_id = doc.id
+    data = doc.to_dict()
+    request_id = data.get("data", {}).get("id")
+    job_name = data.get("job_name")
+
+    destination = get_destination(job_name, destination)
+    
+    try:
+        logger.info({
+            "message": f"Retrying record with Request ID: '{request_id}' to {destination}",
+            "request_id": request_id,
+            "job_name": job_name
+        })
+
+        # Run the handler registered for the job type
+        with track_records(data.get("record_checkpoint")) as checkpoint:
+            success, error = await dispatch(job_name, data.get("data"), sf_connection)
+        if skipped_records is not None:
+            skipped_records.append(checkpoint.skipped)
+
+        if success:
+            # If successful, update Firestore status to completed
+            update_firestore_status(doc_id, "completed", collection, db=db, previous_status=data.get("status"), fields=checkpoint.to_fields())
+            if data.get("parent_id"):
+                settle_shard(collection, doc_id, data["parent_id"], "completed", db=db)
+            logger.info({
+                "message": f"Processed successfully record with Request ID: '{request_id}' to {destination}",
+                "request_id": request_id,
+                "doc_id": doc_id,
+                "run_retries": data.get("run_retries", 0) + 1,
+                "last_retried_at": firestore.SERVER_TIMESTAMP
+            })
+        else:
+            # If failed, update Firestore status to failed with error
+            update_firestore_status(doc_id, "failed", collection, db=db, previous_status=data.get("status"), fields={
+                "error": error,
+                "run_retries": data.get("run_retries", 0) + 1,
+                "last_retried_at": firestore.SERVER_TIMESTAMP,
+                **checkpoint.to_fields()
+            })
+            if data.get("parent_id"):
+                settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
+            logger.error({
+                "message": f"Failed to process record with Request ID: '{request_id}' to {destination}",
+                "request_id": request_id,
+                "error": error
+            })
+        return success, error
+
+    except Exception as e:
+        # Handle any exceptions during processing
+        update_firestore_status(doc_id, "failed", collection, db=db, previous_status=data.get("status"), fields={
+            "error": str(e),
+            "run_retries": data.get("run_retries", 0) + 1,
+            "last_retried_at": firestore.SERVER_TIMESTAMP
+        })
+        if data.get("parent_id"):
+            settle_shard(collection, doc_id, data["parent_id"], "failed", db=db)
+        logger.error({
+            "message": "Error processing record",
+            "request_id": request_id,
+            "job_name": job_name,
+            "error": str(e)
+        })
+        return False, str(e)
+
 @app.route('/retry/<destination_url_parameter>/<id>', methods=['GET']) 
 async def retry_record(destination_url_parameter, id):
     
@@ -479,9 +641,12 @@ async def retry_record(destination_url_parameter, id):
     # Use the mapping to set destination and origin, defaulting to None if the collection is not found
     destination, origin, collection = mapping.get(destination_url_parameter.lower().strip(), {'destination': None, 'origin': None, 'collection': None}).values()
     
+    if salesforce_unavailable(destination):
+        return jsonify({"error": "Salesforce session unavailable", "id": id}), 503
+
     try:
-        # Query Firestore for documents matching the given ID
-        docs = db.collection(collection).where(filter=FieldFilter("data.id", "==", id)).get()
+        # Query Firestore for documents matching the given ID; a sharded job is retried through its shards
+        docs = [doc for doc in find_documents_by_job_ids(collection, [id], db=db) if not is_shard_parent(doc.to_dict())]
 
         if not docs:
             logger.info({
@@ -491,97 +656,12 @@ async def retry_record(destination_url_parameter, id):
             return jsonify({"message": f"No records found in {collection}", "id": id}), 404
 
         # Process each document retrieved
-    
+        skipped_records = []
         for doc in docs:
-            doc_id = doc.id
-            data = doc.to_dict()
-            request_id = data.get("data", {}).get("id")
-            job_name = data.get("job_name")
-
-            destination = "PostgreSQL" if job_name in ["Wet Mill Registration Form", "Wet Mill Visit"] else destination
-            
-            try:
-                logger.info({
-                    "message": f"Retrying record with Request ID: '{request_id}' to {destination}",
-                    "request_id": request_id,
-                    "job_name": job_name
-                })
-
-                # Check the job type and call the appropriate processing function
-                
-                # 1. Participant Registration
-                if job_name in ["Farmer Registration", "Edit Farmer Details", "Field Day Farmer Registration"]:
-                    success, error = await registration.send_to_salesforce(data.get("data"), sf_connection)
-                    logger.info(f'Process was successful: {success}')
-                
-                # 2. Participant Send to CommCare  
-                elif job_name in ["Participant", "Training Group", "Training Session", "Project Role", "Household Sampling"]:
-                    success, error = await process_commcare_data.process_records_parallel(data.get("data"), job_name)  # Use the new parallel processing function
-                    logger.info(f'Process was successful: {success}')
-                    
-                # 3. Attendance Full).where( Light
-                elif job_name in ["Attendance Full - Current Module", "Attendance Light - Current Module", "Field Day Attendance Full"]:
-                    success, error = await attendance.send_to_salesforce(data.get("data"), sf_connection)
-                    logger.info(f'Process was successful: {success}')
-                
-                # 4. Training Observation
-                elif job_name == "Training Observation":
-                    success, error = await training_observation.send_to_salesforce(data.get("data"), sf_connection)
-                    
-                # 5. Demo Plot Observation    
-                elif job_name == "Demo Plot Observation":
-                    success, error = await demoplot_observation.send_to_salesforce(data.get("data"), sf_connection)
-                    
-                # 6. Farm Visit Full
-                elif job_name in ["Farm Visit Full", "Farm Visit - AA"]:
-                    success, error = await farm_visit.send_to_salesforce(data.get("data"), sf_connection)
-                    
-                # 7. Wet Mill Registration and Visit to PostgreSQL
-                elif job_name in ["Wet Mill Registration Form", "Wet Mill Visit"]:
-                    if job_name == "Wet Mill Registration Form":
-                        success, error = wetmill_registration.save_wetmill_registration(data.get("data"), sf_connection)
-                    elif job_name == "Wet Mill Visit":
-                        success, error = wetmill_visit.save_form_visit(data.get("data"))
-
-                if success:
-                    # If successful, update Firestore status to completed
-                    update_firestore_status(doc_id, "completed", collection)
-                    logger.info({
-                        "message": f"Processed successfully record with Request ID: '{request_id}' to {destination}",
-                        "request_id": request_id,
-                        "doc_id": doc_id,
-                        "run_retries": data.get("run_retries", 0) + 1,
-                        "last_retried_at": firestore.SERVER_TIMESTAMP
-                    })
-                else:
-                    # If failed, update Firestore status to failed with error
-                    update_firestore_status(doc_id, "failed", collection, {
-                        "error": error,
-                        "run_retries": data.get("run_retries", 0) + 1,
-                        "last_retried_at": firestore.SERVER_TIMESTAMP
-                    })
-                    logger.error({
-                        "message": f"Failed to process record with Request ID: '{request_id}' to {destination}",
-                        "request_id": request_id,
-                        "error": error
-                    })
-
-            except Exception as e:
-                # Handle any exceptions during processing
-                update_firestore_status(doc_id, "failed", collection, {
-                    "error": str(e),
-                    "run_retries": data.get("run_retries", 0) + 1,
-                    "last_retried_at": firestore.SERVER_TIMESTAMP
-                })
-                logger.error({
-                    "message": "Error processing record",
-                    "request_id": request_id,
-                    "job_name": job_name,
-                    "error": str(e)
-                })
+            await retry_document(doc, collection, destination, skipped_records)
 
         # Return a success message once all records have been processed
-        return jsonify({"message": "Retry completed", "id": id}), 200
+        return jsonify({"message": "Retry completed", "id": id, "skipped_records": sum(skipped_records)}), 200
 
     except Exception as e:
         # Catch any errors in the retry operation
@@ -592,78 +672,200 @@ async def retry_record(destination_url_parameter, id):
         })
         return jsonify({"error": "Failed to retry records", "details": str(e)}), 500
 
+def run_batch_retry(job, collection, destination, ids_list):
+    docs = find_documents_by_job_ids(collection, ids_list, db=db)
+    not_found = len(set(ids_list) - {get_job_id(doc.to_dict()) for doc in docs})
+    # A sharded job is retried through its shards
+    docs = [doc for doc in docs if not is_shard_parent(doc.to_dict())]
+    job.update(not_found=not_found, documents=len(docs))
+
+    # Each document runs on its own event loop in a pool thread, so retries really overlap
+    skipped_records = []
+    run_items(
+        job,
+        docs,
+        lambda doc: get_destination(doc.to_dict().get("job_name"), destination),
+        lambda doc: asyncio.run(retry_document(doc, collection, destination, skipped_records)),
+        get_item_id=lambda doc: get_job_id(doc.to_dict())
+    )
+    job.update(skipped_records=sum(skipped_records))
+
 @app.route('/batch_retry/<destination_url_parameter>/', methods=['POST'])
 async def batch_retry(destination_url_parameter):
+    """
+    Start retrying the given IDs in the background and return a job handle straight
+    away. Poll GET /batch_retry/jobs/<job_id> for progress.
+    """
     data = request.get_json()
     ids_list = data.get('ids', [])
 
-    sem = asyncio.Semaphore(100)  # max 20 retries at once
+    mapping = {
+        'sf': {'destination': 'Salesforce','origin': 'CommCare' , 'collection': 'commcare_collection'},
+        'cc': {'destination': 'CommCare', 'origin': 'Salesforce', 'collection': 'salesforce_collection'}
+    }
+    destination, origin, collection = mapping.get(destination_url_parameter.lower().strip(), {'destination': None, 'origin': None, 'collection': None}).values()
+
+    if not collection:
+        return jsonify({"error": f"Unknown destination: {destination_url_parameter}"}), 404
 
-    async def limited_retry(idx, record_id):
-        async with sem:
-            try:
-                await retry_record(destination_url_parameter, record_id)
-                logger.info({
-                    "message": f"Retry number {idx+1} completed",
-                    "request_id": record_id,
-                })
-            except Exception as e:
-                logger.error({
-                    "message": f"Failed to complete retry number {idx+1}",
-                    "request_id": record_id,
-                    "error": str(e)
-                })
+    if salesforce_unavailable(destination):
+        return jsonify({"error": "Salesforce session unavailable"}), 503
 
     try:
-        await asyncio.gather(
-            *(limited_retry(idx, record_id) for idx, record_id in enumerate(ids_list))
-        )
-        return jsonify({"message": "Retry completed"}), 200
+        job = BackgroundJob("batch_retry", len(ids_list), {"destination": destination, "collection": collection}, db=db)
+        start_background_job(job, run_batch_retry, collection, destination, ids_list)
+
+        logger.info({
+            "message": "Batch retry started",
+            "job_id": job.job_id,
+            "destination": destination,
+            "ids": len(ids_list)
+        })
+        return jsonify({"message": "Retry started", "job_id": job.job_id, "status_url": f"/batch_retry/jobs/{job.job_id}"}), 202
     except Exception as e:
         logger.error({
-            "message": "Failed to complete batch retry",
+            "message": "Failed to start batch retry",
             "error": str(e)
         })
         return jsonify({"error": "Failed to retry records", "details": str(e)}), 500
 
+@app.route('/batch_retry/jobs/<job_id>', methods=['GET'])
+def batch_retry_status(job_id):
+    try:
+        job = get_background_job(job_id, db=db)
+        if job is None:
+            return jsonify({"message": "No batch retry job found", "job_id": job_id}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logger.error({
+            "message": "Error fetching batch retry job",
+            "job_id": job_id,
+            "error": str(e)
+        })
+        return jsonify({"error": "Failed to fetch batch retry job", "details": str(e)}), 500
+
 @app.route('/bulk_update/<collection>/', methods=['POST'])
 def bulk_update(collection):
     data = request.get_json()
     ids_list = data.get('ids', [])
     status = data.get('status', "new")
     
-
     try:
-        batch_size = 200
-        for i in range(0, len(ids_list), batch_size):
-            batch = db.batch()
-            chunk = ids_list[i:i+batch_size]
-            for id in chunk:
-                docs = db.collection(collection).where(filter=FieldFilter("data.id", "==", id)).get()
-                if not docs:
-                    logger.info({"message": "No records found for editing", "id": id})
-                    continue
-                for doc in docs:
-                    logger.info({
-                        "message": f"Parsing document {str(doc.id)}"
-                    })
-                    doc_ref = db.collection(collection).document(doc.id)
-                    update_data = {
-                        "status": status,
-                        "updated_at": str(datetime.now(timezone.utc)),
-                        "run_retries": 0
-                    }
-                    batch.update(doc_ref, update_data)
-            batch.commit()
-        
-        return jsonify({"message": "Update completed"}), 200
+        # Resolve all IDs up front with "in" queries of 30 IDs, run concurrently
+        docs = find_documents_by_job_ids(collection, ids_list, select=["status", "shards"], db=db)
+        matched_ids = {get_job_id(doc.to_dict()) for doc in docs}
+        for id in ids_list:
+            if id not in matched_ids:
+                logger.info({"message": "No records found for editing", "id": id})
+
+        # A sharded job is updated through its shards; its parent only aggregates them
+        docs = [doc for doc in docs if not is_shard_parent(doc.to_dict())]
+
+        previous_statuses = {doc.id: doc.to_dict().get("status") for doc in docs}
+        deltas = {}
+        failures = []
+        lock = threading.Lock()
+
+        def on_write_result(reference, result, writer):
+            with lock:
+                add_status_change(deltas, previous_statuses.get(reference.id), status)
+
+        def on_write_error(error, writer):
+            # Give up on a document after a few attempts instead of the default 15
+            if error.attempts < 3:
+                return True
+            with lock:
+                failures.append(error.message)
+            return False
+
+        # BulkWriter sends batches in parallel and retries per document
+        bulk_writer = db.bulk_writer()
+        bulk_writer.on_write_result(on_write_result)
+        bulk_writer.on_write_error(on_write_error)
+        update_data = {
+            "status": status,
+            "updated_at": str(datetime.now(timezone.utc)),
+            "run_retries": 0
+        }
+        if status == "new":
+            # A manual re-run resends every record, not just those a checkpoint left undelivered
+            update_data["record_checkpoint"] = firestore.DELETE_FIELD
+        for doc in docs:
+            bulk_writer.update(db.collection(collection).document(doc.id), update_data)
+        bulk_writer.close()
+
+        # Only documents that were written move between status counters
+        apply_status_deltas(collection, deltas, db)
+
+        updated = len(docs) - len(failures)
+        logger.info({
+            "message": "Bulk update completed",
+            "collection": collection,
+            "status": status,
+            "requested": len(ids_list),
+            "matched": len(docs),
+            "updated": updated,
+            "failed": len(failures)
+        })
+        return jsonify({
+            "message": "Update completed",
+            "requested": len(ids_list),
+            "matched": len(docs),
+            "updated": updated,
+            "failed": len(failures),
+            "errors": failures[:10]
+        }), 200
     except Exception as e:
         return jsonify({"error": "Failed to update records", "details": str(e)}), 500
 
+@app.route('/backfill-job-id/<collection>', methods=['POST'])
+def backfill_job_id(collection):
+    """
+    Populate the top-level job_id on legacy documents, `page_size` documents at a time
+    for up to `max_pages` pages. Call again with the returned next_page_token until it is null.
+    """
+    data = request.get_json(silent=True) or {}
+    page_token = data.get("page_token")
+    page_size = int(data.get("page_size", 500))
+    max_pages = int(data.get("max_pages", 20))
+
+    try:
+        scanned, updated = 0, 0
+        for _ in range(max_pages):
+            page_scanned, page_updated, page_token = backfill_job_ids(collection, page_token, page_size, db=db)
+            scanned += page_scanned
+            updated += page_updated
+            if not page_token:
+                break
+
+        logger.info({
+            "message": "Backfilled job_id",
+            "collection": collection,
+            "scanned": scanned,
+            "updated": updated,
+            "next_page_token": page_token
+        })
+        return jsonify({"scanned": scanned, "updated": updated, "next_page_token": page_token}), 200
+
+    except Exception as e:
+        logger.error({
+            "message": "Error backfilling job_id",
+            "collection": collection,
+            "page_token": page_token,
+            "error": str(e)
+        })
+        return jsonify({"error": f"Error backfilling job_id: {str(e)}", "page_token": page_token}), 500
+
 @app.route('/failed/<destination_url_parameter>', methods=['GET'])
 def get_failed_jobs(destination_url_parameter):
     """
     Endpoint to retrieve jobs with 'failed' status from the Firestore database.
+
+    Query parameters:
+    - page_size: jobs per page (default 100, at most 1000)
+    - page_token: the next_page_token returned by the previous page
+    - include=data: also return the stored form payload
+    - format=ndjson: stream one JSON job per line; without page_size, every failed job is streamed
     """
     
     mapping = {
@@ -675,21 +877,38 @@ def get_failed_jobs(destination_url_parameter):
     destination, origin, collection = mapping.get(destination_url_parameter.lower().strip(), {'destination': None, 'origin': None, 'collection': None}).values()
     
     try:
-        # Query Firestore for documents with status 'failed', limited to 5
-        processing_docs = db.collection(collection).where(filter=FieldFilter("status", "==", "failed")).get()
-
-        # Extract relevant fields from Firestore documents
-        failed_jobs = [
-            {
+        include_data = request.args.get("include") == "data"
+        stream = request.args.get("format") == "ndjson"
+        page_size = request.args.get("page_size", type=int)
+        if page_size is None and not stream:
+            page_size = FAILED_JOBS_PAGE_SIZE
+        if page_size is not None:
+            page_size = min(max(page_size, 1), FAILED_JOBS_MAX_PAGE_SIZE)
+
+        query = get_failed_jobs_query(collection, include_data, request.args.get("page_token"), page_size)
+
+        def to_job(doc):
+            return {
                 "id": doc.id, # Firestore document ID
                 "collection": collection,
                 **doc.to_dict()  # Document fields
             }
-            for doc in processing_docs
-        ]
+
+        if stream:
+            # Documents are serialized one at a time as Firestore returns them
+            def generate():
+                for doc in query.stream():
+                    yield app.json.dumps(to_job(doc)) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson"), 200
+
+        failed_jobs = [to_job(doc) for doc in query.get()]
+
+        # A full page means there may be more: the last document ID is the cursor for the next one
+        next_page_token = failed_jobs[-1]["id"] if len(failed_jobs) == page_size else None
 
         # Return the list of failed jobs
-        return jsonify({"failed_jobs": failed_jobs}), 200
+        return jsonify({"failed_jobs": failed_jobs, "next_page_token": next_page_token}), 200
 
     except Exception as e:
         # Log the error with additional context
@@ -703,19 +922,15 @@ def get_failed_jobs(destination_url_parameter):
 
 @app.route('/status-count/<collection>', methods=['GET'])
 def status_count(collection):
-    
+    """
+    Status counts from the sharded counters. Pass ?exact=true to count the
+    collection with aggregation queries instead (slow on large collections).
+    """
     try:
-        status_count_dict = {}
-        statuses = ["new", "processing", "failed", "completed"]
-
-        for status in statuses:
-            query = (
-                db.collection(collection)
-                .where(filter=FieldFilter("status", "==", status))
-            )
-
-            result = query.count().get(retry=Retry(deadline=120))
-            status_count_dict[status] = result[0][0].value
+        if request.args.get("exact", "false").lower() == "true":
+            status_count_dict = {status: get_status_count(collection, status) for status in STATUSES}
+        else:
+            status_count_dict = get_status_counts(collection, db)
 
         return jsonify({"status_counts": status_count_dict}), 200
 
@@ -725,6 +940,53 @@ def status_count(collection):
             "error": str(e)
         })
         return jsonify({"error": f"Error retrieving status count: {str(e)}"}), 500
+
+@app.route('/reconcile-status-count/<collection>', methods=['POST'])
+def reconcile_status_count(collection):
+    """Run from the scheduler: recount the collection and correct drift in the status counters."""
+    try:
+        status_count_dict, corrections = reconcile_status_counts(collection, db, get_status_count)
+        logger.info({
+            "message": "Reconciled status counters",
+            "collection": collection,
+            "status_counts": status_count_dict,
+            "corrections": corrections
+        })
+        return jsonify({"status_counts": status_count_dict, "corrections": corrections}), 200
+
+    except Exception as e:
+        logger.error({
+            "message": "Error reconciling status count",
+            "collection": collection,
+            "error": str(e)
+        })
+        return jsonify({"error": f"Error reconciling status count: {str(e)}"}), 500
+
+@app.route('/api-usage', methods=['GET'])
+def api_usage():
+    """
+    Salesforce API usage seen by this instance: the org's daily usage from the latest
+    Sforce-Limit-Info header and the requests made per job name since startup.
+    """
+    try:
+        budget = get_api_budget()
+        budget["throttled_jobs"] = [job_name for job_name in migrated_form_types if is_throttled(job_name, get_destination(job_name))]
+        return jsonify(budget), 200
+
+    except Exception as e:
+        logger.error({
+            "message": "Error retrieving API usage",
+            "error": str(e)
+        })
+        return jsonify({"error": f"Error retrieving API usage: {str(e)}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Latency histograms of this instance in OpenMetrics text format, for Prometheus
+    scraping: Salesforce calls, CommCare submissions, PostgreSQL commits and whole jobs.
+    """
+    return Response(render_metrics(), mimetype="application/openmetrics-text; version=1.0.0; charset=utf-8")
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,47 @@
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+from utils import api_budget
+from utils.api_budget import track_job, record_api_call, record_api_usage, refresh_api_usage, is_throttled
+
+def test_record_api_call_attributes_calls_to_job_in_worker_threads():
+    async def process():
+        with track_job("Farm Visit Full"):
+            await asyncio.to_thread(record_api_call)
+            await asyncio.to_thread(record_api_call)
+
+    with patch.dict(api_budget.api_calls, clear=True):
+        asyncio.run(process())
+        record_api_call()
+
+        assert api_budget.api_calls == {"Farm Visit Full": 2, "unattributed": 1}
+
+def test_is_throttled_defers_low_priority_jobs_first():
+    with patch.dict(api_budget.api_usage, {"used": None, "total": None}):
+        record_api_usage("api-usage=8500/10000")
+        assert is_throttled("Farm Visit Full")
+        assert not is_throttled("Farmer Registration")
+
+        record_api_usage("api-usage=9600/10000")
+        assert is_throttled("Farmer Registration")
+
+def test_is_throttled_only_defers_jobs_bound_for_salesforce():
+    with patch.dict(api_budget.api_usage, {"used": None, "total": None}):
+        record_api_usage("api-usage=9900/10000")
+
+        assert is_throttled("Farmer Registration", "Salesforce")
+        assert not is_throttled("Wet Mill Visit", "PostgreSQL")
+
+def test_stale_usage_is_refreshed_from_the_org_limits():
+    mock_sf_connection = MagicMock()
+    mock_sf_connection.limits.return_value = {"DailyApiRequests": {"Max": 10000, "Remaining": 9000}}
+    stale = time.time() - api_budget.SF_API_USAGE_TTL_SECONDS - 1
+
+    with patch.dict(api_budget.api_usage, {"used": 9900, "total": 10000, "read_at": stale}):
+        assert not is_throttled("Farmer Registration")
+
+        refresh_api_usage(mock_sf_connection)
+
+        assert api_budget.api_usage["used"] == 1000
+        refresh_api_usage(mock_sf_connection)
+        assert mock_sf_connection.limits.call_count == 1
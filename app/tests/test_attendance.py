@@ -0,0 +1,26 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+from jobs.commcare_to_salesforce.attendance import send_to_salesforce
+from utils.record_checkpoint import track_records
+
+def attendance_form(participants):
+    return {"id": "form-1", "form": {"@name": "Attendance Full - Current Module", "training_session": "ts-1", "present_participants": participants}}
+
+@patch("jobs.commcare_to_salesforce.attendance.process_training_session")
+@patch("utils.attendance_util.bulk_upsert_to_salesforce")
+def test_rejected_attendances_complete_the_form_and_are_kept_for_retry(mock_bulk_upsert, mock_process_training_session):
+    mock_bulk_upsert.return_value = {"ts-1p-2": "REQUIRED_FIELD_MISSING: Date"}
+
+    with track_records() as checkpoint:
+        success, error = asyncio.run(send_to_salesforce(attendance_form("p-1 p-2 p-3"), MagicMock()))
+
+    assert (success, error) == (True, None)
+    stored = checkpoint.to_fields()["record_checkpoint"]
+    assert stored == {"rejected": ["p-2"]}
+
+    mock_bulk_upsert.return_value = {}
+    with track_records(stored) as retry:
+        asyncio.run(send_to_salesforce(attendance_form("p-1 p-2 p-3"), MagicMock()))
+
+    assert [submission_id for submission_id, _ in mock_bulk_upsert.call_args.args[2]] == ["ts-1p-2"]
+    assert retry.to_fields()["record_checkpoint"] == {"rejected": []}
@@ -0,0 +1,78 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from utils import background_jobs
+from utils.background_jobs import BackgroundJob, get_background_job, run_items, start_background_job
+
+def test_run_items_limits_concurrency_per_destination():
+    job = BackgroundJob("batch_retry", 6, db=MagicMock())
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def worker(item):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return item != "bad", "boom" if item == "bad" else None
+
+    with patch.dict(background_jobs._destination_slots, {"Salesforce": threading.BoundedSemaphore(2)}):
+        run_items(job, ["a", "b", "c", "d", "e", "bad"], lambda item: "Salesforce", worker, get_item_id=lambda item: item)
+
+    assert peak[0] == 2
+    assert job.progress["processed"] == 6
+    assert job.progress["succeeded"] == 5
+    assert job.progress["errors"] == [{"id": "bad", "error": "boom"}]
+
+def test_start_background_job_persists_final_status():
+    mock_db = MagicMock()
+    job = BackgroundJob("batch_retry", 1, db=mock_db)
+    done = threading.Event()
+
+    def target(job):
+        job.record(True)
+        done.set()
+
+    document = mock_db.collection.return_value.document.return_value
+
+    start_background_job(job, target)
+    done.wait(1)
+    for _ in range(100):
+        if document.set.call_args.args[0]["status"] == "completed":
+            break
+        time.sleep(0.01)
+
+    saved = document.set.call_args.args[0]
+    assert saved["status"] == "completed"
+    assert saved["succeeded"] == 1
+
+def test_get_background_job_reports_a_stale_running_job_as_failed():
+    mock_db = MagicMock()
+    snapshot = mock_db.collection.return_value.document.return_value.get.return_value
+    snapshot.exists = True
+    snapshot.to_dict.return_value = {"status": "running", "updated_at": datetime.now(timezone.utc) - timedelta(hours=1)}
+
+    job = get_background_job("job-1", db=mock_db)
+
+    assert job["status"] == "failed"
+    assert "No progress written" in job["error"]
+
+    snapshot.to_dict.return_value = {"status": "running", "updated_at": datetime.now(timezone.utc)}
+    assert get_background_job("job-1", db=mock_db)["status"] == "running"
+
+def test_start_background_job_writes_heartbeats_while_running():
+    mock_db = MagicMock()
+    job = BackgroundJob("batch_retry", 1, db=mock_db)
+    release = threading.Event()
+    document = mock_db.collection.return_value.document.return_value
+
+    with patch.object(background_jobs, "BACKGROUND_JOB_HEARTBEAT_SECONDS", 0.01):
+        start_background_job(job, lambda job: release.wait(1))
+        time.sleep(0.1)
+        writes = document.set.call_count
+        release.set()
+
+    # Creation and the running status, then heartbeats
+    assert writes > 3
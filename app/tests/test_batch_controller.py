@@ -0,0 +1,33 @@
+from unittest.mock import patch
+from utils.batch_controller import AdaptiveBatchController
+
+@patch("utils.batch_controller.time.monotonic")
+def test_first_page_uses_initial_size_capped_by_backlog(mock_monotonic):
+    mock_monotonic.return_value = 0
+    controller = AdaptiveBatchController(initial_size=10, max_size=100, time_budget=600)
+
+    assert controller.next_batch_size(backlog=500) == 10
+    assert controller.next_batch_size(backlog=3) == 3
+    assert controller.next_batch_size(backlog=0) == 0
+
+@patch("utils.batch_controller.time.monotonic")
+def test_pages_grow_with_measured_latency_and_stop_at_budget(mock_monotonic):
+    mock_monotonic.return_value = 0
+    controller = AdaptiveBatchController(initial_size=10, max_size=100, time_budget=600)
+
+    controller.record_batch(10, 20)  # 2 seconds per record
+    assert controller.next_batch_size(backlog=1000) == 100  # 300s of the 600s left fits 150, capped at max
+
+    mock_monotonic.return_value = 560
+    assert controller.next_batch_size(backlog=1000) == 10  # 40s left -> 20s of work
+
+    mock_monotonic.return_value = 599
+    assert controller.next_batch_size(backlog=1000) == 0  # next record would overrun the budget
+
+@patch("utils.batch_controller.time.monotonic")
+def test_pages_stay_within_the_lease(mock_monotonic):
+    mock_monotonic.return_value = 0
+    controller = AdaptiveBatchController(initial_size=10, max_size=1000, time_budget=3480, max_page_seconds=450)
+
+    controller.record_batch(10, 10)  # 1 second per record
+    assert controller.next_batch_size(backlog=5000) == 450  # not the 1740 that half the request time allows
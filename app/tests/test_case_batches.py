@@ -0,0 +1,54 @@
+import asyncio
+from utils.case_batches import find_named_cases, split_batches, submit_case_batch
+
+def run(items, rejected, name_cases=True, server_error=False):
+    """Submit items; forms holding a rejected case ID fail, naming them when `name_cases`."""
+    submissions = []
+
+    async def send_batch(batch):
+        submissions.append(list(batch))
+        if server_error:
+            return False, "HTTP Status: 503, message: 'Service unavailable'", False
+        bad = [item for item in batch if item in rejected]
+        if not bad:
+            return True, None, False
+        return False, f"Invalid case {', '.join(bad)}" if name_cases else "HTTP Status: 422, message: 'Form rejected'", True
+
+    async def send_one(item):
+        success, error, _ = await send_batch([item])
+        return success, error
+
+    results = asyncio.run(submit_case_batch(items, lambda item: item, send_batch, send_one))
+    return results, submissions
+
+def test_split_batches():
+    assert split_batches(list(range(7)), 3) == [[0, 1, 2], [3, 4, 5], [6]]
+
+def test_find_named_cases():
+    assert find_named_cases("Invalid case c-2 in form", ["c-1", "c-2", None]) == [1]
+    assert find_named_cases("Invalid case c-10", ["c-1", "c-10"]) == [1]
+    assert find_named_cases(None, ["c-1"]) == []
+
+def test_accepted_batch_is_one_submission():
+    results, submissions = run(["c-1", "c-2", "c-3"], rejected=set())
+
+    assert results == [(True, None)] * 3
+    assert submissions == [["c-1", "c-2", "c-3"]]
+
+def test_named_case_fails_and_rest_is_resubmitted():
+    results, submissions = run(["c-1", "c-2", "c-3", "c-4"], rejected={"c-3"})
+
+    assert results == [(True, None), (True, None), (False, "Case c-3: Invalid case c-3"), (True, None)]
+    assert submissions == [["c-1", "c-2", "c-3", "c-4"], ["c-1", "c-2", "c-4"]]
+
+def test_unnamed_error_bisects_to_the_failing_record():
+    results, submissions = run(["c-1", "c-2", "c-3", "c-4"], rejected={"c-2"}, name_cases=False)
+
+    assert results == [(True, None), (False, "Case c-2: HTTP Status: 422, message: 'Form rejected'"), (True, None), (True, None)]
+    assert submissions == [["c-1", "c-2", "c-3", "c-4"], ["c-1", "c-2"], ["c-3", "c-4"], ["c-1"], ["c-2"]]
+
+def test_server_error_fails_the_whole_batch_without_splitting():
+    results, submissions = run(["c-1", "c-2", "c-3"], rejected=set(), server_error=True)
+
+    assert results == [(False, f"Case {case_id}: HTTP Status: 503, message: 'Service unavailable'") for case_id in ["c-1", "c-2", "c-3"]]
+    assert submissions == [["c-1", "c-2", "c-3"]]
@@ -0,0 +1,57 @@
+import datetime
+import math
+from utils.field_types import first_positions, infer_field_type, infer_field_types
+
+def legacy_infer_field_type(value):
+    # The strptime/float implementation the classifier replaces
+    if isinstance(value, str):
+        val = value.strip()
+        if val.upper() in ("TRUE", "FALSE"):
+            return "boolean", (val.upper() == "TRUE")
+        if val in ("1", "0"):
+            return "boolean", (val == "1")
+        try:
+            return "date", datetime.datetime.strptime(val, "%Y-%m-%d")
+        except:
+            pass
+        try:
+            return "number", float(val)
+        except:
+            pass
+        return "text", val or None
+    elif isinstance(value, bool):
+        return "boolean", value
+    elif isinstance(value, (int, float)):
+        return "number", float(value)
+    return "text", str(value) if value is not None else None
+
+ANSWERS = [
+    "TRUE", "false", " True ", "1", "0", " 0", "01",
+    "2024-03-15", "2024-3-5", "2024-03- 5", "2024-02-30", "2024-13-01", "0000-01-01", "24-03-15", "٢٠٢٤-03-15",
+    "50", "50.0", "-12.5", ".5", "5.", "1e3", "1_000", "+7", "١٢", "inf", "-Infinity", "nan", "Infrastructure",
+    "", "   ", "yes", "option_a option_b", "12 bags",
+    True, False, 3, 2.5, None, {"a": 1}, ["x"],
+]
+
+def test_matches_legacy_inference():
+    for answer in ANSWERS:
+        expected = legacy_infer_field_type(answer)
+        actual = infer_field_type(answer)
+        assert actual[0] == expected[0], answer
+        if isinstance(expected[1], float) and math.isnan(expected[1]):
+            assert math.isnan(actual[1])
+        else:
+            assert actual[1] == expected[1], answer
+
+def test_batch_types_answers_in_order():
+    assert infer_field_types(["TRUE", "2024-03-15", "50", "well maintained"]) == [
+        ("boolean", True),
+        ("date", datetime.datetime(2024, 3, 15)),
+        ("number", 50.0),
+        ("text", "well maintained"),
+    ]
+
+def test_first_positions_matches_list_index():
+    items = ["a", "b", "a", {"x": 1}, "c", {"x": 1}, "b"]
+
+    assert first_positions(items) == [items.index(item) + 1 for item in items]
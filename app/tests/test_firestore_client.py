@@ -1,5 +1,6 @@
 from unittest.mock import MagicMock, patch
-from utils.firestore_client import save_to_firestore, update_firestore_status
+from utils.firestore_client import save_to_firestore, update_firestore_status, claim_documents, StatusWriteBatcher, find_documents_by_field, find_documents_by_job_ids, backfill_job_ids
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud import firestore
 
 @patch("utils.firestore_client.get_firestore_client")
@@ -59,3 +60,119 @@ def test_update_firestore_status(mock_get_firestore_client):
         "last_step": "step1",
     })
     assert success is True
+
+def test_claim_documents_skips_documents_claimed_elsewhere():
+    mock_db = MagicMock()
+    claimed_ref, taken_ref = MagicMock(), MagicMock()
+    taken_ref.update.side_effect = FailedPrecondition("document changed")
+    counter_ref = MagicMock()
+    mock_db.collection.return_value.document.side_effect = lambda doc_id: {"a": claimed_ref, "b": taken_ref}.get(doc_id, counter_ref)
+    docs = [MagicMock(id="a"), MagicMock(id="b")]
+    docs[0].to_dict.return_value = {"status": "new"}
+
+    claimed = claim_documents(docs, "commcare_collection", "worker-1", db=mock_db)
+
+    assert claimed == [docs[0]]
+    update_data = claimed_ref.update.call_args.args[0]
+    assert update_data["status"] == "processing"
+    assert update_data["lease_owner"] == "worker-1"
+    mock_db.write_option.assert_any_call(last_update_time=docs[0].update_time)
+
+def test_status_write_batcher_merges_and_commits_once():
+    mock_db = MagicMock()
+    mock_batch = MagicMock()
+    mock_db.batch.return_value = mock_batch
+    batcher = StatusWriteBatcher(db=mock_db, max_size=10)
+
+    batcher.update_status("a", "processing", "commcare_collection")
+    batcher.update_status("a", "failed", "commcare_collection", {"error": "boom"})
+    batcher.update_status("b", "completed", "commcare_collection")
+    mock_batch.commit.assert_not_called()
+
+    assert batcher.flush() is True
+    assert mock_batch.update.call_count == 2
+    assert mock_batch.update.call_args_list[0].args[1] == {"status": "failed", "error": "boom"}
+    mock_batch.commit.assert_called_once()
+
+def test_status_write_batcher_flushes_at_threshold():
+    mock_db = MagicMock()
+    batcher = StatusWriteBatcher(db=mock_db, max_size=2)
+
+    batcher.update_status("a", "completed", "commcare_collection")
+    batcher.update_status("b", "completed", "commcare_collection")
+
+    mock_db.batch.return_value.commit.assert_called_once()
+    assert batcher.pending == {}
+
+def test_status_write_batcher_updates_counters_in_the_same_batch():
+    mock_db = MagicMock()
+    mock_batch = mock_db.batch.return_value
+    batcher = StatusWriteBatcher(db=mock_db, max_size=10)
+
+    batcher.update_status("a", "completed", "commcare_collection", previous_status="processing")
+    batcher.update_status("b", "failed", "commcare_collection", {"error": "boom"}, previous_status="processing")
+    batcher.flush()
+
+    counter_update = mock_batch.set.call_args.args[1]
+    assert counter_update["processing"].value == -2
+    assert counter_update["completed"].value == 1
+    assert counter_update["failed"].value == 1
+    assert mock_batch.set.call_args.kwargs == {"merge": True}
+    mock_batch.commit.assert_called_once()
+
+def test_find_documents_by_field_uses_in_queries_of_30():
+    mock_db = MagicMock()
+    query = mock_db.collection.return_value.where.return_value
+    query.select.return_value.get.side_effect = lambda: [MagicMock()]
+    ids = [f"id-{i}" for i in range(65)] + ["id-0"]
+
+    docs = find_documents_by_field("commcare_collection", "data.id", ids, select=["status"], db=mock_db)
+
+    assert len(docs) == 3
+    filters = [call.kwargs["filter"] for call in mock_db.collection.return_value.where.call_args_list]
+    assert [len(f.value) for f in filters] == [30, 30, 5]
+    assert all(f.op_string == "in" and f.field_path == "data.id" for f in filters)
+
+def test_find_documents_by_job_ids_falls_back_to_data_id_for_legacy_documents():
+    current, legacy = MagicMock(id="doc-1"), MagicMock(id="doc-2")
+    current.to_dict.return_value = {"job_id": "form-1"}
+    legacy.to_dict.return_value = {"data": {"id": "form-2"}}
+
+    with patch("utils.firestore_client.find_documents_by_field") as mock_find:
+        mock_find.side_effect = [[current], [legacy]]
+        docs = find_documents_by_job_ids("commcare_collection", ["form-1", "form-2"], db=MagicMock())
+
+    assert docs == [current, legacy]
+    assert mock_find.call_args_list[0].args[1:3] == ("job_id", ["form-1", "form-2"])
+    assert mock_find.call_args_list[1].args[1:3] == ("data.id", ["form-2"])
+
+def test_backfill_job_ids_copies_data_id():
+    mock_db = MagicMock()
+    missing, filled = MagicMock(id="a"), MagicMock(id="b")
+    missing.to_dict.return_value = {"data": {"id": "form-1"}}
+    filled.to_dict.return_value = {"job_id": "form-2", "data": {"id": "form-2"}}
+    mock_db.collection.return_value.order_by.return_value.select.return_value.limit.return_value.get.return_value = [missing, filled]
+
+    scanned, updated, next_page_token = backfill_job_ids("commcare_collection", page_size=2, db=mock_db)
+
+    assert (scanned, updated, next_page_token) == (2, 1, "b")
+    mock_db.bulk_writer.return_value.update.assert_called_once_with(missing.reference, {"job_id": "form-1"})
+
+def test_save_to_firestore_commits_document_and_counter_together():
+    mock_db = MagicMock()
+    mock_db.collection.return_value.document.return_value.id = "new_doc_id"
+    mock_batch = mock_db.batch.return_value
+
+    doc_id = save_to_firestore({"id": "form-1"}, "Farmer Registration", "new", "commcare_collection", db=mock_db)
+
+    assert doc_id == "new_doc_id"
+    assert mock_batch.set.call_count == 2  # the document and a counter shard
+    mock_batch.commit.assert_called_once()
+    mock_db.collection.return_value.add.assert_not_called()
+
+@patch("utils.firestore_client.apply_status_deltas", side_effect=Exception("counter unavailable"))
+def test_update_firestore_status_succeeds_when_only_the_counter_fails(mock_apply_status_deltas):
+    mock_db = MagicMock()
+
+    assert update_firestore_status("doc-1", "completed", "commcare_collection", db=mock_db, previous_status="failed") is True
+    mock_db.collection.return_value.document.return_value.update.assert_called_once_with({"status": "completed"})
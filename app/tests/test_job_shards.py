@@ -0,0 +1,48 @@
+from unittest.mock import MagicMock, patch
+from utils.job_shards import get_parent_status, get_sharded_records, save_sharded_to_firestore, settle_shard
+
+def test_get_sharded_records_only_splits_large_arrays():
+    assert get_sharded_records({"participants": [{}] * 3}, shard_size=5) == (None, None)
+    assert get_sharded_records({"households": [{}] * 6}, shard_size=5) == ("households", [{}] * 6)
+
+def test_get_parent_status():
+    assert get_parent_status(3, {"completed": 1, "failed": 0}) == "sharded"
+    assert get_parent_status(3, {"completed": 2, "failed": 1}) == "shards_failed"
+    assert get_parent_status(3, {"completed": 3, "failed": 0}) == "completed"
+
+@patch("utils.job_shards.SHARD_WRITE_MAX_BYTES", 300)
+def test_save_sharded_to_firestore_writes_parent_after_its_shards():
+    mock_db = MagicMock()
+    mock_db.collection.return_value.document.return_value.id = "parent-1"
+    data = {"id": "job-1", "jobType": "Participant", "participants": [{"n": i} for i in range(5)]}
+
+    assert save_sharded_to_firestore(data, "Participant", "salesforce_collection", "participants", shard_size=2, db=mock_db) == "parent-1"
+
+    writes = [call.args[1] for call in mock_db.batch.return_value.set.call_args_list if "job_name" in call.args[1]]
+    shards, parent = writes[:3], writes[3]
+    assert (parent["status"], parent["shards"], parent["records"]) == ("sharded", 3, 5)
+    assert "participants" not in parent["data"]
+    assert [shard["data"]["participants"] for shard in shards] == [data["participants"][0:2], data["participants"][2:4], data["participants"][4:]]
+    assert {(shard["parent_id"], shard["status"], shard["job_id"]) for shard in shards} == {("parent-1", "sharding", "job-1")}
+    # Shards are split across commits by size and released to "new" once the parent is stored
+    calls = [(call[0], call.args[1].get("status") if call.args else None) for call in mock_db.batch.return_value.method_calls]
+    assert calls[:2] == [("set", "sharding"), ("commit", None)]
+    assert calls.index(("set", "sharded")) > max(i for i, call in enumerate(calls) if call == ("set", "sharding"))
+    assert calls[-4:] == [("update", "new"), ("update", "new"), ("update", "new"), ("commit", None)]
+
+@patch("utils.job_shards.apply_status_deltas")
+@patch("utils.job_shards.firestore.transactional", lambda function: function)
+def test_settle_shard_moves_a_retried_shard_to_completed(mock_apply_status_deltas):
+    mock_db = MagicMock()
+    shard_ref, parent_ref = MagicMock(), MagicMock()
+    mock_db.collection.return_value.document.side_effect = [shard_ref, parent_ref]
+    shard_ref.get.return_value.to_dict.return_value = {"shard_outcome": "failed"}
+    parent_ref.get.return_value.to_dict.return_value = {"status": "shards_failed", "shards": 2, "shard_statuses": {"completed": 1, "failed": 1}}
+
+    assert settle_shard("salesforce_collection", "shard-2", "parent-1", "completed", db=mock_db) == "completed"
+
+    transaction = mock_db.transaction.return_value
+    transaction.update.assert_any_call(shard_ref, {"shard_outcome": "completed"})
+    parent_update = transaction.update.call_args_list[1].args[1]
+    assert (parent_update["status"], parent_update["shard_statuses"]) == ("completed", {"completed": 2, "failed": 0})
+    mock_apply_status_deltas.assert_called_once_with("salesforce_collection", {"shards_failed": -1, "completed": 1}, mock_db, transaction)
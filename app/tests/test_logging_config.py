@@ -0,0 +1,51 @@
+import logging
+import queue
+from unittest.mock import patch
+from flask import Flask
+from utils.logging_config import LazyQueueHandler, SamplingFilter, parse_trace_header
+
+def make_record(msg, level=logging.INFO):
+    return logging.LogRecord("app_logger", level, __file__, 1, msg, None, None)
+
+def test_queue_handler_keeps_dict_messages_unformatted():
+    log_queue = queue.Queue()
+    handler = LazyQueueHandler(log_queue)
+    message = {"message": "Upserted Household__c", "id": "a01"}
+
+    handler.emit(make_record(message))
+    message["id"] = "changed"
+
+    queued = log_queue.get_nowait()
+    assert queued.msg == {"message": "Upserted Household__c", "id": "a01"}
+
+def test_queue_handler_drops_records_when_queue_is_full():
+    handler = LazyQueueHandler(queue.Queue(1))
+    handler.emit(make_record("first"))
+    handler.emit(make_record("second"))
+
+    assert handler.dropped == 1
+
+def test_sampling_filter_only_samples_debug_records():
+    sampling = SamplingFilter(0.1)
+    with patch("utils.logging_config.random.random", return_value=0.5):
+        assert not sampling.filter(make_record("question", logging.DEBUG))
+        assert sampling.filter(make_record("household", logging.INFO))
+    with patch("utils.logging_config.random.random", return_value=0.05):
+        assert sampling.filter(make_record("question", logging.DEBUG))
+
+def test_parse_trace_header():
+    assert parse_trace_header("105445aa7843bc8bf206b12000100000/1;o=1") == ("105445aa7843bc8bf206b12000100000", "0000000000000001", True)
+    assert parse_trace_header("105445aa7843bc8bf206b12000100000") == ("105445aa7843bc8bf206b12000100000", None, False)
+    assert parse_trace_header(None) == (None, None, False)
+
+def test_queue_handler_captures_the_request_trace():
+    handler = LazyQueueHandler(queue.Queue(), capture_request=True)
+    headers = {"X-Cloud-Trace-Context": "105445aa7843bc8bf206b12000100000/255;o=1"}
+
+    with Flask(__name__).test_request_context("/process-firestore-to-sf", method="POST", headers=headers):
+        record = handler.prepare(make_record("processing"))
+
+    assert record.trace.endswith("/traces/105445aa7843bc8bf206b12000100000")
+    assert record.span_id == "00000000000000ff"
+    assert record.trace_sampled is True
+    assert record.http_request["requestMethod"] == "POST"
@@ -0,0 +1,42 @@
+from unittest.mock import MagicMock
+import pytest
+from utils.api_budget import track_job
+from utils.metrics import Gauge, Histogram, SALESFORCE_REQUEST_SECONDS, render_metrics
+from utils.salesforce_client import upsert_to_salesforce
+
+def test_histogram_renders_cumulative_buckets_and_error_outcome():
+    histogram = Histogram("test_step_duration_seconds", "Test steps.", ["step", "outcome"], buckets=(1, 5))
+    histogram.observe(0.5, step="household", outcome="success")
+    histogram.observe(3, step="household", outcome="success")
+    with pytest.raises(ValueError):
+        with histogram.time(step="participant"):
+            raise ValueError("boom")
+
+    lines = histogram.render()
+
+    assert 'test_step_duration_seconds_bucket{step="household",outcome="success",le="1.0"} 1' in lines
+    assert 'test_step_duration_seconds_bucket{step="household",outcome="success",le="+Inf"} 2' in lines
+    assert 'test_step_duration_seconds_sum{step="household",outcome="success"} 3.5' in lines
+    assert 'test_step_duration_seconds_count{step="participant",outcome="error"} 1' in lines
+    assert render_metrics().endswith("# EOF\n")
+
+def process_household(sf_connection):
+    return upsert_to_salesforce("Household__c", "Household_Number__c", "HH-1", {}, sf_connection)
+
+def test_upsert_to_salesforce_is_timed_by_job_step_and_sobject():
+    sf_connection = MagicMock()
+    sf_connection.Household__c.upsert.return_value.headers = {}
+    sf_connection.Household__c.upsert.return_value.json.return_value = {}
+
+    with track_job("Farmer Registration"):
+        process_household(sf_connection)
+
+    key = ("Farmer Registration", "process_household", "Household__c", "upsert", "success")
+    assert SALESFORCE_REQUEST_SECONDS.series[key][0][-1] >= 1
+
+def test_gauge_reads_values_when_rendered():
+    stats = {"checked_out": 2, "idle": 3}
+    gauge = Gauge("test_pool_connections", "Test pool.", ["state"], lambda: {(state,): count for state, count in stats.items()})
+    stats["checked_out"] = 4
+
+    assert gauge.render()[2:] == ['test_pool_connections{state="checked_out"} 4', 'test_pool_connections{state="idle"} 3']
@@ -0,0 +1,38 @@
+import pytest
+from unittest.mock import patch
+from utils.postgres import session_scope
+
+@patch("utils.postgres.SessionLocal")
+def test_session_scope_commits_inside_the_block_and_closes(mock_session_local):
+    session = mock_session_local.return_value
+
+    with session_scope() as scoped:
+        scoped.commit()
+
+    assert scoped is session
+    session.commit.assert_called_once()
+    session.rollback.assert_not_called()
+    session.close.assert_called_once()
+
+@patch("utils.postgres.SessionLocal")
+def test_session_scope_rolls_back_and_closes_when_the_block_raises(mock_session_local):
+    session = mock_session_local.return_value
+
+    with pytest.raises(ValueError, match="bad row"):
+        with session_scope():
+            raise ValueError("bad row")
+
+    session.rollback.assert_called_once()
+    session.commit.assert_not_called()
+    session.close.assert_called_once()
+
+@patch("utils.postgres.SessionLocal")
+def test_session_scope_closes_even_when_rollback_fails(mock_session_local):
+    session = mock_session_local.return_value
+    session.rollback.side_effect = RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError, match="connection lost"):
+        with session_scope():
+            raise ValueError("bad row")
+
+    session.close.assert_called_once()
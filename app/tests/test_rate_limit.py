@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, patch
+from utils.rate_limit import AIMDLimiter, Throttle, TokenBucket, get_throttle, parse_retry_after
+
+def test_aimd_halves_once_per_generation_and_grows_back():
+    async def scenario():
+        limiter = AIMDLimiter(maximum=8, minimum=1)
+        first = await limiter.acquire()
+        second = await limiter.acquire()
+        await limiter.release(first, overloaded=True)
+        await limiter.release(second, overloaded=True)  # started before the decrease
+        halved = limiter.limit
+
+        for _ in range(halved):
+            await limiter.release(await limiter.acquire(), overloaded=False)
+        return halved, limiter.limit
+
+    assert asyncio.run(scenario()) == (4, 5)
+
+def test_parse_retry_after():
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0  # in the past
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+@patch("utils.rate_limit.asyncio.sleep", new_callable=AsyncMock)
+def test_throttle_retries_429_honoring_retry_after(mock_sleep):
+    responses = [
+        (False, "HTTP Status: 429, message: 'Slow down'", 429, 0.2),
+        (False, "HTTP Status: 503, message: ''", 503, None),
+        (True, None, 201, None),
+    ]
+    request = AsyncMock(side_effect=responses)
+    throttle = Throttle(bucket=TokenBucket(rate=0))
+
+    result = asyncio.run(throttle.call(request, "test submission"))
+
+    assert result == (True, None)
+    assert request.await_count == 3
+    assert mock_sleep.await_args_list[0].args[0] >= 0.2
+    assert throttle.bucket.paused_until > 0
+    summary = throttle.summary(processed=1)
+    assert (summary["requests"], summary["retries"], summary["throttled"]) == (3, 2, 1)
+
+@patch("utils.rate_limit.asyncio.sleep", new_callable=AsyncMock)
+def test_throttle_does_not_retry_rejected_forms(mock_sleep):
+    request = AsyncMock(return_value=(False, "HTTP Status: 422, message: 'submit_error'", 422, None))
+    throttle = Throttle(bucket=TokenBucket(rate=0))
+
+    assert asyncio.run(throttle.call(request, "test submission")) == (False, "HTTP Status: 422, message: 'submit_error'")
+    assert request.await_count == 1
+    mock_sleep.assert_not_awaited()
+
+def test_get_throttle_is_shared_across_threads_and_event_loops():
+    throttles = []
+
+    def run():
+        async def acquire():
+            throttle = get_throttle("https://commcare.example/receiver")
+            await throttle.limiter.acquire()
+            throttles.append(throttle)
+        asyncio.run(acquire())
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(throttles) == 3
+    assert all(throttle is throttles[0] for throttle in throttles)
+    assert throttles[0].limiter.in_flight == 3
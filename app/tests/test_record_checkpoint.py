@@ -0,0 +1,44 @@
+from utils.record_checkpoint import RecordCheckpoint, current_checkpoint, track_records
+
+def test_checkpoint_round_trip_skips_delivered_records():
+    checkpoint = RecordCheckpoint()
+    checkpoint.start(10)
+    for position in (0, 3, 9):
+        checkpoint.mark_completed(position)
+    stored = checkpoint.to_fields()["record_checkpoint"]
+
+    assert stored["records"] == 10
+    assert stored["completed_count"] == 3
+
+    retry = RecordCheckpoint(stored)
+    retry.start(10)
+    pending = retry.pending(list("abcdefghij"))
+
+    assert [position for position, _ in pending] == [1, 2, 4, 5, 6, 7, 8]
+    assert retry.skipped == 3
+
+def test_checkpoint_for_another_payload_is_ignored():
+    checkpoint = RecordCheckpoint()
+    checkpoint.start(4)
+    checkpoint.mark_completed(0)
+
+    retry = RecordCheckpoint(checkpoint.to_fields()["record_checkpoint"])
+    retry.start(5)
+
+    assert len(retry.pending(list("abcde"))) == 5
+
+def test_track_records_sets_current_checkpoint():
+    with track_records() as checkpoint:
+        assert current_checkpoint.get() is checkpoint
+
+    assert current_checkpoint.get() is None
+    assert checkpoint.to_fields() == {}
+
+def test_rejected_ids_round_trip():
+    checkpoint = RecordCheckpoint()
+    checkpoint.mark_rejected({"p-2", "p-1"})
+    stored = checkpoint.to_fields()["record_checkpoint"]
+
+    assert stored == {"rejected": ["p-1", "p-2"]}
+    assert RecordCheckpoint(stored).rejected_before() == {"p-1", "p-2"}
+    assert RecordCheckpoint().rejected_before() == set()
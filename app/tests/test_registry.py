@@ -0,0 +1,41 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+from jobs import registry
+from jobs.registry import JobHandler, JOB_HANDLERS, dispatch, get_destination
+
+def test_every_registered_handler_names_a_known_destination():
+    assert {handler.destination for handler in JOB_HANDLERS.values()} == {"Salesforce", "CommCare", "PostgreSQL"}
+    assert get_destination("Wet Mill Visit", "Salesforce") == "PostgreSQL"
+    assert get_destination("Unknown Form", "Salesforce") == "Salesforce"
+
+def test_dispatch_passes_declared_arguments_and_runs_timing_hooks():
+    handler = JobHandler("jobs.commcare_to_salesforce.attendance", "send_to_salesforce", "Salesforce", arguments=("data", "job_name"))
+    function = AsyncMock(return_value=(True, None))
+    hook = MagicMock()
+
+    with patch.dict(JOB_HANDLERS, {"Attendance Full - Current Module": handler}), \
+            patch.object(JobHandler, "resolve", return_value=function), \
+            patch.object(registry, "_timing_hooks", [hook]):
+        result = asyncio.run(dispatch("Attendance Full - Current Module", {"id": "form-1"}, MagicMock()))
+
+    assert result == (True, None)
+    function.assert_awaited_once_with({"id": "form-1"}, "Attendance Full - Current Module")
+    assert hook.call_args.args[0] == "Attendance Full - Current Module"
+    assert hook.call_args.args[3] is True
+
+def test_dispatch_runs_sync_handlers_in_a_thread():
+    handler = JobHandler("jobs.commcare_to_postrgresql.wetmill_visit", "save_form_visit", "PostgreSQL", is_async=False, arguments=("data",))
+    threads = []
+
+    def save_form_visit(data):
+        threads.append(threading.current_thread())
+        return True, None
+
+    with patch.dict(JOB_HANDLERS, {"Wet Mill Visit": handler}), patch.object(JobHandler, "resolve", return_value=save_form_visit):
+        assert asyncio.run(dispatch("Wet Mill Visit", {"id": "form-1"})) == (True, None)
+
+    assert threads[0] is not threading.main_thread()
+
+def test_dispatch_unknown_job():
+    assert asyncio.run(dispatch("Unknown Form", {})) == (False, "No handler registered for job 'Unknown Form'")
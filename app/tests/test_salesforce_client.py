@@ -0,0 +1,164 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from simple_salesforce.exceptions import SalesforceExpiredSession, SalesforceMalformedRequest, SalesforceRefusedRequest
+from utils import salesforce_client
+from utils.salesforce_client import CompositeGraph, commit_composite_graphs, upsert_to_salesforce, bulk_upsert_to_salesforce, async_upsert_to_salesforce
+
+def test_upsert_to_salesforce_records_into_composite_graph():
+    graph = CompositeGraph("registration")
+
+    upsert_to_salesforce(
+        "Participant__c",
+        "CommCare_Case_Id__c",
+        "case/1",
+        {"Household__r": {"Household_ID__c": "H123"}},
+        graph
+    )
+
+    payload = graph.to_payload("59.0")
+    assert payload["graphId"] == "registration"
+    assert payload["compositeRequest"] == [{
+        "method": "PATCH",
+        "url": "/services/data/v59.0/sobjects/Participant__c/CommCare_Case_Id__c/case%2F1",
+        "referenceId": "registration_0",
+        "body": {"Household__r": {"Household_ID__c": "H123"}},
+    }]
+
+def test_commit_composite_graphs_maps_node_errors():
+    mock_sf_connection = MagicMock(sf_version="59.0")
+    graph = CompositeGraph("registration")
+    graph.add_upsert("Household__c", "Household_ID__c", "H123", {"Name": "HN001"})
+    graph.add_upsert("Participant__c", "CommCare_Case_Id__c", "P123", {"Name": "Eunice"})
+    empty_graph = CompositeGraph("training_group")
+
+    mock_sf_connection.restful.return_value = {
+        "graphs": [{
+            "graphId": "registration",
+            "isSuccessful": False,
+            "graphResponse": {
+                "compositeResponse": [
+                    {"referenceId": "registration_0", "httpStatusCode": 400, "body": [{"errorCode": "PROCESSING_HALTED", "message": "halted"}]},
+                    {"referenceId": "registration_1", "httpStatusCode": 400, "body": [{"errorCode": "INVALID_FIELD", "message": "bad field"}]},
+                ]
+            }
+        }]
+    }
+
+    errors = commit_composite_graphs([empty_graph, graph], mock_sf_connection)
+
+    sent = mock_sf_connection.restful.call_args
+    assert sent.args == ("composite/graph",)
+    assert [g["graphId"] for g in sent.kwargs["json"]["graphs"]] == ["registration"]
+    assert errors == {
+        "registration": ["Error upserting Participant__c: INVALID_FIELD: bad field with external ID CommCare_Case_Id__c:P123"]
+    }
+
+def test_commit_composite_graphs_success():
+    mock_sf_connection = MagicMock(sf_version="59.0")
+    graph = CompositeGraph("registration")
+    graph.add_upsert("Household__c", "Household_ID__c", "H123", {"Name": "HN001"})
+    mock_sf_connection.restful.return_value = {"graphs": [{"graphId": "registration", "isSuccessful": True}]}
+
+    assert commit_composite_graphs([graph], mock_sf_connection) == {"registration": []}
+
+def test_bulk_upsert_to_salesforce_chunks_and_maps_failures():
+    mock_sf_connection = MagicMock()
+    records = [(f"TS1P{i}", {"Status__c": "Present"}) for i in range(3)]
+    mock_sf_connection.restful.side_effect = [
+        [{"success": True, "errors": []}, {"success": False, "errors": [{"statusCode": "INVALID_FIELD", "message": "no participant"}]}],
+        [{"success": True, "errors": []}],
+    ]
+
+    failures = bulk_upsert_to_salesforce("Attendance__c", "Submission_ID__c", records, mock_sf_connection, chunk_size=2)
+
+    assert mock_sf_connection.restful.call_count == 2
+    first_call = mock_sf_connection.restful.call_args_list[0]
+    assert first_call.args == ("composite/sobjects/Attendance__c/Submission_ID__c",)
+    assert first_call.kwargs["method"] == "PATCH"
+    assert first_call.kwargs["json"]["records"][0] == {
+        "attributes": {"type": "Attendance__c"},
+        "Submission_ID__c": "TS1P0",
+        "Status__c": "Present",
+    }
+    assert failures == {"TS1P1": "INVALID_FIELD: no participant"}
+
+def test_bulk_upsert_to_salesforce_fails_records_without_a_result():
+    mock_sf_connection = MagicMock()
+    records = [(f"TS1P{i}", {"Status__c": "Present"}) for i in range(3)]
+    mock_sf_connection.restful.return_value = [{"success": True, "errors": []}]
+
+    failures = bulk_upsert_to_salesforce("Attendance__c", "Submission_ID__c", records, mock_sf_connection)
+
+    assert failures == {
+        "TS1P1": "No result returned by Salesforce",
+        "TS1P2": "No result returned by Salesforce",
+    }
+
+def test_upsert_to_salesforce_retries_request_limit_exceeded():
+    mock_sf_connection = MagicMock()
+    response = MagicMock(headers={"Sforce-Limit-Info": "api-usage=25/5000"})
+    response.json.return_value = {"id": "a01", "success": True}
+    busy = SalesforceRefusedRequest("url", 403, "Household__c", [{"errorCode": "REQUEST_LIMIT_EXCEEDED"}])
+    mock_sf_connection.__getattr__("Household__c").upsert.side_effect = [busy, response]
+
+    with patch("utils.salesforce_client.time.sleep") as mock_sleep:
+        result = upsert_to_salesforce("Household__c", "Household_ID__c", "H123", {"Name": "HN001"}, mock_sf_connection)
+
+    assert result == {"id": "a01", "success": True}
+    assert mock_sleep.call_count == 1
+    assert (salesforce_client.api_usage["used"], salesforce_client.api_usage["total"]) == (25, 5000)
+
+def test_upsert_to_salesforce_does_not_retry_other_errors():
+    mock_sf_connection = MagicMock()
+    malformed = SalesforceMalformedRequest("url", 400, "Household__c", [{"errorCode": "INVALID_FIELD"}])
+    mock_sf_connection.__getattr__("Household__c").upsert.side_effect = malformed
+
+    with patch("utils.salesforce_client.time.sleep") as mock_sleep:
+        with pytest.raises(Exception, match="INVALID_FIELD"):
+            upsert_to_salesforce("Household__c", "Household_ID__c", "H123", {"Name": "HN001"}, mock_sf_connection)
+
+    mock_sleep.assert_not_called()
+
+def test_async_upsert_to_salesforce_retries_503():
+    mock_sf_connection = MagicMock(base_url="https://example.my.salesforce.com/services/data/v59.0/", session_id="token")
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        if len(requests_seen) == 1:
+            return httpx.Response(503, text="Server Unavailable")
+        return httpx.Response(200, json={"id": "a01", "success": True})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with patch("utils.salesforce_client.asyncio.sleep", new=AsyncMock()):
+                return await async_upsert_to_salesforce(
+                    "Participant__c", "CommCare_Case_Id__c", "case/1", {"Name": "Eunice"}, mock_sf_connection, client
+                )
+
+    assert asyncio.run(run()) == {"id": "a01", "success": True}
+    assert len(requests_seen) == 2
+    assert str(requests_seen[0].url) == "https://example.my.salesforce.com/services/data/v59.0/sobjects/Participant__c/CommCare_Case_Id__c/case%2F1"
+    assert requests_seen[0].headers["Authorization"] == "Bearer token"
+
+def test_upsert_to_salesforce_refreshes_expired_session_once():
+    class SessionManager:
+        session_id = "expired"
+        refresh = MagicMock(return_value=object())
+
+        def __getattr__(self, name):
+            return sobject
+
+    sobject = MagicMock()
+    response = MagicMock(headers={})
+    response.json.return_value = {"id": "a01", "success": True}
+    expired = SalesforceExpiredSession("url", 401, "Household__c", [{"errorCode": "INVALID_SESSION_ID"}])
+    sobject.upsert.side_effect = [expired, response]
+    manager = SessionManager()
+
+    result = upsert_to_salesforce("Household__c", "Household_ID__c", "H123", {"Name": "HN001"}, manager)
+
+    assert result == {"id": "a01", "success": True}
+    SessionManager.refresh.assert_called_once_with("expired")
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from cryptography.fernet import Fernet
+from utils.salesforce_session import SalesforceSessionManager
+
+CACHE_KEY = Fernet.generate_key().decode("ascii")
+
+def encrypt(session_id):
+    return Fernet(CACHE_KEY).encrypt(session_id.encode("utf-8")).decode("ascii")
+
+def build_manager(cached=None):
+    mock_db = MagicMock()
+    snapshot = mock_db.collection.return_value.document.return_value.get.return_value
+    snapshot.exists = cached is not None
+    snapshot.to_dict.return_value = cached
+    manager = SalesforceSessionManager("user@example.com", "password", "token", "test", "sandbox", db=mock_db)
+    return manager, mock_db
+
+@patch("utils.salesforce_session.SF_SESSION_CACHE_KEY", CACHE_KEY)
+@patch("utils.salesforce_session.SalesforceLogin")
+def test_get_connection_reuses_cached_session(mock_login):
+    manager, _ = build_manager({
+        "encrypted_session_id": encrypt("cached-session"),
+        "instance": "example.my.salesforce.com",
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=30),
+    })
+
+    connection = manager.get_connection()
+
+    mock_login.assert_not_called()
+    assert connection.session_id == "cached-session"
+    assert manager.base_url == "https://example.my.salesforce.com/services/data/v59.0/"
+
+@patch("utils.salesforce_session.SF_SESSION_CACHE_KEY", CACHE_KEY)
+@patch("utils.salesforce_session.SalesforceLogin")
+def test_get_connection_logs_in_and_caches_when_cache_expired(mock_login):
+    manager, mock_db = build_manager({
+        "encrypted_session_id": encrypt("old-session"),
+        "instance": "example.my.salesforce.com",
+        "expires_at": datetime.now(timezone.utc) - timedelta(minutes=1),
+    })
+    mock_login.return_value = ("new-session", "example.my.salesforce.com")
+
+    assert manager.session_id == "new-session"
+    cached = mock_db.collection.return_value.document.return_value.set.call_args.args[0]
+    assert "session_id" not in cached
+    assert "new-session" not in cached["encrypted_session_id"]
+    assert Fernet(CACHE_KEY).decrypt(cached["encrypted_session_id"].encode("ascii")) == b"new-session"
+
+@patch("utils.salesforce_session.SF_SESSION_CACHE_KEY", None)
+@patch("utils.salesforce_session.SalesforceLogin")
+def test_get_connection_skips_the_cache_without_a_key(mock_login):
+    manager, mock_db = build_manager({
+        "session_id": "plaintext-session",
+        "instance": "example.my.salesforce.com",
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=30),
+    })
+    mock_login.return_value = ("new-session", "example.my.salesforce.com")
+
+    assert manager.session_id == "new-session"
+    mock_db.collection.assert_not_called()
+
+@patch("utils.salesforce_session.SalesforceLogin")
+def test_refresh_logs_in_once_for_the_same_stale_session(mock_login):
+    manager, _ = build_manager()
+    mock_login.side_effect = [("first-session", "example.my.salesforce.com"), ("second-session", "example.my.salesforce.com")]
+    manager.get_connection()
+
+    manager.refresh("first-session")
+    manager.refresh("first-session")
+
+    assert mock_login.call_count == 2
+    assert manager.session_id == "second-session"
+
+@patch("utils.salesforce_session.SalesforceLogin")
+def test_is_available_false_when_login_fails(mock_login):
+    manager, _ = build_manager()
+    mock_login.side_effect = Exception("INVALID_LOGIN")
+
+    assert manager.is_available() is False
@@ -0,0 +1,34 @@
+from unittest.mock import MagicMock
+from utils.status_counters import add_status_change, get_status_counts, reconcile_status_counts
+
+def shard(counts):
+    snapshot = MagicMock()
+    snapshot.to_dict.return_value = counts
+    return snapshot
+
+def test_add_status_change_moves_one_document_between_statuses():
+    deltas = add_status_change({}, None, "new")
+    add_status_change(deltas, "new", "processing")
+    add_status_change(deltas, "processing", "processing")
+
+    assert deltas == {"new": 0, "processing": 1}
+
+def test_get_status_counts_sums_shards():
+    mock_db = MagicMock()
+    shards = mock_db.collection.return_value.document.return_value.collection.return_value
+    shards.get.return_value = [shard({"new": 3, "failed": 1}), shard({"new": -1, "completed": 5})]
+
+    assert get_status_counts("commcare_collection", mock_db) == {"new": 2, "processing": 0, "failed": 1, "completed": 5}
+
+def test_reconcile_status_counts_applies_the_difference():
+    mock_db = MagicMock()
+    shards = mock_db.collection.return_value.document.return_value.collection.return_value
+    shards.get.return_value = [shard({"new": 4, "completed": 10})]
+    exact = {"new": 3, "processing": 0, "failed": 2, "completed": 10}
+
+    actual, corrections = reconcile_status_counts("commcare_collection", mock_db, lambda collection, status: exact[status])
+
+    assert actual == exact
+    assert corrections == {"new": -1, "failed": 2}
+    counter_update = shards.document.return_value.set.call_args.args[0]
+    assert {status: increment.value for status, increment in counter_update.items()} == corrections
@@ -0,0 +1,70 @@
+import uuid
+from unittest.mock import MagicMock, patch
+from sqlalchemy.dialects import postgresql
+from jobs.commcare_to_postrgresql import wetmill_visit
+from jobs.commcare_to_postrgresql.wetmill_visit import upsert_question_responses, upsert_survey_responses, write_form_visit
+
+def compile_sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+def test_upsert_survey_responses_is_one_insert_returning_ids():
+    session = MagicMock()
+    survey_id = uuid.uuid4()
+    session.execute.return_value.all.return_value = [("SR-1-kpis", survey_id)]
+
+    ids = upsert_survey_responses(session, "visit-1", [
+        {"submission_id": "SR-1-kpis", "survey_type": "kpis", "completed_date": None, "general_feedback": None},
+    ])
+
+    assert ids == {"SR-1-kpis": survey_id}
+    sql = compile_sql(session.execute.call_args.args[0])
+    assert sql.startswith("INSERT INTO survey_responses")
+    assert "ON CONFLICT (submission_id) DO UPDATE SET" in sql
+    assert "survey_type = excluded.survey_type" in sql
+    assert sql.endswith("RETURNING survey_responses.submission_id, survey_responses.id")
+
+def test_upsert_question_responses_is_one_executemany_upsert():
+    session = MagicMock()
+    rows = [
+        {"submission_id": f"SQR-1-kpis-q{i}", "survey_response_id": "survey-1", "section_name": None, "question_name": f"q{i}",
+         "field_type": "text", "value_text": "yes", "value_number": None, "value_boolean": None, "value_date": None, "value_gps": None}
+        for i in range(3)
+    ]
+
+    upsert_question_responses(session, rows)
+
+    statement, parameters = session.execute.call_args.args
+    sql = compile_sql(statement)
+    assert sql.startswith("INSERT INTO survey_question_responses")
+    assert "ON CONFLICT (submission_id) DO UPDATE SET" in sql
+    assert "value_text = excluded.value_text" in sql
+    assert [row["submission_id"] for row in parameters] == [row["submission_id"] for row in rows]
+
+def test_write_form_visit_collapses_repeated_answers_and_links_survey_ids():
+    session = MagicMock()
+    survey_id = uuid.uuid4()
+    survey_upsert = MagicMock()
+    survey_upsert.all.return_value = [("SR-form-1-kpis", survey_id)]
+    session.execute.side_effect = [survey_upsert, None]
+    data = {
+        "id": "form-1",
+        "form": {
+            "case": {"@case_id": "case-1"},
+            "survey_type": "kpis",
+            "surveys": {"kpis": {"buyers": ["coop", "coop", "trader"], "volumes": {"cherry_kg": "120"}}},
+        },
+    }
+
+    with patch.dict(wetmill_visit.SURVEY_TRANSFORMATIONS, {}, clear=True):
+        assert write_form_visit(session, data) == (True, None)
+
+    survey_rows = session.execute.call_args_list[0].args[0]
+    assert "RETURNING" in compile_sql(survey_rows)
+    question_rows = session.execute.call_args_list[1].args[1]
+    assert sorted(row["submission_id"] for row in question_rows) == [
+        "SQR-form-1-kpis-buyers-1",
+        "SQR-form-1-kpis-buyers-3",
+        "SQR-form-1-kpis-volumes-cherry_kg",
+    ]
+    assert {row["survey_response_id"] for row in question_rows} == {survey_id}
+    session.commit.assert_called_once()
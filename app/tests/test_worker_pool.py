@@ -0,0 +1,44 @@
+import asyncio
+from utils.worker_pool import get_record_lock_keys, group_by_lock_keys, run_lanes
+
+def test_get_record_lock_keys():
+    data = {
+        "form": {
+            "Household_Id": "H1",
+            "training_session": "TS1",
+            "barrios_repeat_group": {"item": [{"training_session": "TS2"}, {"training_session": ""}]},
+        }
+    }
+
+    assert get_record_lock_keys(data) == {
+        "Household_ID__c:H1",
+        "Training_Session__c:TS1",
+        "Training_Session__c:TS2",
+    }
+
+def test_group_by_lock_keys_serializes_shared_records():
+    keys = {
+        "a": {"Household_ID__c:H1"},
+        "b": {"Training_Session__c:TS1"},
+        "c": set(),
+        "d": {"Household_ID__c:H1", "Training_Session__c:TS1"},
+    }
+
+    lanes = group_by_lock_keys(["a", "b", "c", "d"], lambda item: keys[item])
+
+    assert sorted(lanes) == [["a", "b", "d"], ["c"]]
+
+def test_run_lanes_respects_concurrency_cap():
+    running, peak = [0], [0]
+
+    async def worker(item):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return item
+
+    results = asyncio.run(run_lanes([[1], [2], [3], [4, 5]], worker, concurrency=2))
+
+    assert sorted(results) == [1, 2, 3, 4, 5]
+    assert peak[0] == 2
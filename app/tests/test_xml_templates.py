@@ -0,0 +1,80 @@
+from datetime import datetime
+from unittest.mock import patch
+import xml.etree.ElementTree as ET
+from utils.generate_xml import generate_xml
+from utils.xml_templates import TEMPLATES, get_case_id, render_batch, render_case_batch, render_xml
+
+NOW = datetime(2025, 3, 1, 9, 30, 15, 123456)
+
+RECORDS = {
+    "Participant": {
+        "participantName": "Jean", "participantMiddleName": "Marie", "participantLastName": "Nshimiyimana & Sons",
+        "participantAge": "34", "participantGender": "f", "participantPhoneNumber": 254700111222,
+        "tnsId": "TNS/001", "participantPrimaryHouseholdMember": "Yes", "participantOtherIDNumber": "C-42",
+        "householdId": "hh-1", "householdPIMAId": "PIMA-1", "shadeTrees": "12.0", "HHID": "007",
+        "householdFarmSize": "1500", "trainingGroupId": "tg-1", "status": "Active",
+        "commCareCaseId": "case-1", "ccMobileWorkerGroupId": "owner-1",
+    },
+    "Project Role": {
+        "staffName": "Amina <FT>", "tnsId": "ST-9", "locationName": "Ngozi", "roleForCommCare": "Farmer Trainer",
+        "commCareCaseId": "case-2", "currentModule": 3, "currentModuleName": "Nutrition",
+        "previousModule": None, "staffId": "a0X1", "ccMobileWorkerGroupId": "owner-2",
+    },
+    "Training Session": {
+        "sessionStatus": "Active", "trainingGroupName": "FFG 12", "trainingGroupResponsibleStaff": "staff-1",
+        "trainingModuleName": "Pruning", "trainingModuleNumber": "4", "currentPrevious": "Current",
+        "sessionId": "session-1", "trainingGroupCommCareId": "tg-2", "ccMobileWorkerGroupId": "owner-3",
+    },
+    "Training Group": {
+        "trainingGroupName": "FFG \"North\"", "tnsId": "FFG-1", "locationName": "Kirinyaga", "measurementGroup": "A",
+        "cooperative": "Coop 1", "householdCounter": "25", "focalFarmerId": "ff-1", "staffId": "st-1",
+        "market": "", "commCareCaseId": "case-4", "ccMobileWorkerGroupId": "owner-4",
+    },
+    "Household Sampling": {
+        "householdName": "12", "numberOfMembers": "5", "tnsId": "HH-5", "fvAAVisited": "Yes", "fvAASampled": "No",
+        "fvAACurrentSamplingRound": "2", "trainingGroupId": "tg-5", "householdStatus": "Active",
+        "commCareCaseId": "case-5", "moduleName": "Soil", "moduleNumber": "7", "householdParticipants": "a, b",
+    },
+    "Wetmill": {
+        "managerName": "Paul", "country": "Rwanda", "programme": "TNS", "registrationDate": "2024-01-02",
+        "tnsId": "WM-1", "managerRole": "2", "comments": "Needs <repairs> & paint", "millStatus": "1",
+        "exportingStatus": "abc", "commCareCaseId": "case-6", "ccMobileWorkerGroupId": "owner-6", "wetmillName": "Kigali WM",
+    },
+}
+
+def canonical(xml_string):
+    return ET.canonicalize(xml_data=xml_string, strip_text=True)
+
+def test_templates_match_generate_xml():
+    with patch("utils.generate_xml.datetime") as legacy_datetime, patch("utils.xml_templates.datetime") as template_datetime:
+        legacy_datetime.now.return_value = NOW
+        template_datetime.now.return_value = NOW
+        for project in ["coffee_ke_2024ac", "coffee_bdi_tns_2024c", "coffee_et_2024"]:
+            for job_name in TEMPLATES:
+                expected = generate_xml(job_name, "job-1", RECORDS[job_name], project)
+                actual = render_xml(job_name, "job-1", RECORDS[job_name], project)
+
+                assert canonical(actual) == canonical(expected), (job_name, project)
+                assert "\n" not in actual
+
+def test_render_batch_reuses_buffer():
+    buffer = ["stale"]
+    records = [dict(RECORDS["Participant"], commCareCaseId=f"case-{i}") for i in range(3)]
+
+    documents = render_batch("Participant", "job-1", records, "coffee_ke_2024ac", buffer)
+
+    assert documents is buffer
+    assert [ET.fromstring(document.split("?>", 1)[1]).find("{*}Case_Id").text for document in documents] == ["case-0", "case-1", "case-2"]
+
+def test_render_case_batch_packs_case_blocks():
+    records = [dict(RECORDS["Training Group"], commCareCaseId=f"case-{i}") for i in range(3)]
+
+    root = ET.fromstring(render_case_batch("Training Group", "job-1", records, "coffee_ke_2024ac").split("?>", 1)[1])
+
+    assert root.get("name") == "New Training Group"
+    assert root.find("{*}Name") is None
+    assert [case.get("case_id") for case in root.iter("{http://commcarehq.org/case/transaction/v2}case")] == [
+        "case-0", "case-0", "case-1", "case-1", "case-2", "case-2"
+    ]
+    assert len(root.findall("{http://openrosa.org/jr/xforms}meta")) == 1
+    assert get_case_id("Training Session", RECORDS["Training Session"]) == "session-1"
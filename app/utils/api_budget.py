@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from simple_salesforce import Salesforce
+from utils.logging_config import logger
+
+# Share of the org's daily API requests above which low-priority job types are deferred
+SF_API_LOW_PRIORITY_THRESHOLD = float(os.getenv("SF_API_LOW_PRIORITY_THRESHOLD", "0.8"))
+
+# Share above which every job type bound for Salesforce is deferred
+SF_API_HALT_THRESHOLD = float(os.getenv("SF_API_HALT_THRESHOLD", "0.95"))
+
+# Job types deferred first when the daily allocation runs low
+SF_LOW_PRIORITY_JOBS = [
+    job_name.strip()
+    for job_name in os.getenv("SF_LOW_PRIORITY_JOBS", "Training Observation,Demo Plot Observation,Farm Visit Full,Farm Visit - AA").split(",")
+    if job_name.strip()
+]
+
+# Readings older than this are re-read from the org's limits before they throttle anything:
+# with every Salesforce job deferred, no response comes back to refresh them
+SF_API_USAGE_TTL_SECONDS = int(os.getenv("SF_API_USAGE_TTL_SECONDS", "300"))
+
+# Latest "api-usage" reported by Salesforce in the Sforce-Limit-Info header, and when
+# it was read (epoch seconds)
+api_usage = {"used": None, "total": None, "read_at": None}
+
+# Salesforce requests made by this instance, per job name
+api_calls = {}
+
+# Job whose record is being processed; copied into worker threads with the context
+current_job_name = ContextVar("current_job_name", default=None)
+
+_lock = threading.Lock()
+
+@contextmanager
+def track_job(job_name):
+    """Attribute the Salesforce requests made inside the block to `job_name`."""
+    token = current_job_name.set(job_name)
+    try:
+        yield
+    finally:
+        current_job_name.reset(token)
+
+def record_api_call(count=1):
+    job_name = current_job_name.get() or "unattributed"
+    with _lock:
+        api_calls[job_name] = api_calls.get(job_name, 0) + count
+
+def record_api_usage(limit_info):
+    """
+    Store the api-usage from a Sforce-Limit-Info header value, or from the
+    parsed `api_usage` dict simple_salesforce keeps on the connection.
+    """
+    if isinstance(limit_info, str):
+        limit_info = Salesforce.parse_api_usage(limit_info)
+    if not isinstance(limit_info, dict):
+        return
+    usage = limit_info.get("api-usage")
+    if usage is not None:
+        with _lock:
+            api_usage["used"], api_usage["total"], api_usage["read_at"] = usage.used, usage.total, time.time()
+
+def is_usage_stale():
+    return api_usage["read_at"] is None or time.time() - api_usage["read_at"] > SF_API_USAGE_TTL_SECONDS
+
+def refresh_api_usage(sf_connection):
+    """Read the org's daily API usage from its limits when the latest reading is stale."""
+    if not is_usage_stale():
+        return
+    try:
+        daily = sf_connection.limits()["DailyApiRequests"]
+    except Exception as e:
+        logger.warning({
+            "message": "Could not read Salesforce API limits",
+            "error": str(e)
+        })
+        return
+    with _lock:
+        api_usage["used"], api_usage["total"], api_usage["read_at"] = daily["Max"] - daily["Remaining"], daily["Max"], time.time()
+
+def api_usage_ratio():
+    if not api_usage["total"]:
+        return 0.0
+    return api_usage["used"] / api_usage["total"]
+
+def is_throttled(job_name, destination="Salesforce"):
+    """Whether to defer `job_name`; only jobs bound for Salesforce are, and never on a stale reading."""
+    if destination != "Salesforce" or is_usage_stale():
+        return False
+    ratio = api_usage_ratio()
+    if ratio >= SF_API_HALT_THRESHOLD:
+        return True
+    return ratio >= SF_API_LOW_PRIORITY_THRESHOLD and job_name in SF_LOW_PRIORITY_JOBS
+
+def get_api_budget():
+    """Snapshot for the /api-usage endpoint."""
+    with _lock:
+        calls = dict(api_calls)
+    return {
+        "api_usage": {**api_usage, "ratio": round(api_usage_ratio(), 4)},
+        "calls_by_job": calls,
+        "total_calls": sum(calls.values()),
+        "thresholds": {"low_priority": SF_API_LOW_PRIORITY_THRESHOLD, "halt": SF_API_HALT_THRESHOLD},
+        "low_priority_jobs": SF_LOW_PRIORITY_JOBS,
+    }
@@ -1,6 +1,7 @@
-from utils.salesforce_client import upsert_to_salesforce
+from utils.salesforce_client import upsert_to_salesforce, bulk_upsert_to_salesforce
 from utils.training_group_util import training_group_exists
 from utils.logging_config import logger
+from utils.record_checkpoint import current_checkpoint
 import os
 environment = os.getenv("SALESFORCE_ENV")
 
@@ -132,6 +133,7 @@ def process_attendance(data: dict, sf_connection):
     form_name = data.get("form", {}).get("@name", "")
     request_id = data.get("id")
     survey_detail = data.get("form",{}).get("survey_detail", "")
+    failed_participants = {}
 
     if form_name == 'Farmer Registration' or form_name == 'Field Day Farmer Registration':
         # 1. Process for Farmer Registration - New Farmer
@@ -179,23 +181,16 @@ def process_attendance(data: dict, sf_connection):
         if present_participants:
             # Split the participants and create records
             participants = present_participants.split(" ")
+            session = data.get("form", {}).get("training_session", "")
+            attendances = {}
             for p_id in participants:
-                session = data.get("form", {}).get("training_session", "")
-                submission_id = f"{session}{p_id}"
-
-                record = {
+                attendances[f"{session}{p_id}"] = (p_id, {
                     "Status__c": "Present",
                     "Training_Session__r": {"CommCare_Case_Id__c": session},
                     "Participant__r": {"CommCare_Case_Id__c": p_id},
-                }
+                })
 
-                upsert_to_salesforce (
-                    "Attendance__c",
-                    "Submission_ID__c",
-                    submission_id,
-                    record,
-                    sf_connection
-                )
+            failed_participants = upsert_attendances(attendances, request_id, sf_connection)
                 
     # 4. Process for Field Day Attendance Full
     elif form_name == "Field Day Attendance Full" or survey_detail == "Field Day Attendance Full":
@@ -204,31 +199,62 @@ def process_attendance(data: dict, sf_connection):
         # 5.1. Get all training groups where trainees came from
         session_records = [i for i in items if i.get("attendance_count_repeat", "") not in ["", "0"]]
         
+        attendances = {}
         for session in session_records:
             participants = session.get("present_participants_repeat", "").split(" ")
             
-            # 5.1.1. Loop through each participant and upsert an attendance
+            # 5.1.1. Collect an attendance for each participant
             for participant in participants:
-                attendance_fields = {
+                attendances[f'{session.get("training_session", "")}{participant}'] = (participant, {
                     "Status__c": "Present",
                     "Training_Session__r": {"CommCare_Case_Id__c": session.get("training_session", "")},
                     "Participant__r": {"CommCare_Case_Id__c": participant},
-                }
-                
-                # 5.1.1.1. Upsert to salesforce
-                upsert_to_salesforce (
-                    "Attendance__c",
-                    "Submission_ID__c",
-                    f'{session.get("training_session", "")}{participant}',
-                    attendance_fields,
-                    sf_connection
-                )
+                })
+
+        # 5.1.2. Upsert all attendances to salesforce
+        failed_participants = upsert_attendances(attendances, request_id, sf_connection)
     
     else: 
         logger.info({
             "message": "Skipping attendance upsert logic",
             "request_id": request_id,
         })
+
+    return failed_participants
+
+# Upsert attendances in collections of up to 200 records
+def upsert_attendances(attendances: dict, request_id, sf_connection):
+    """
+    Send attendances keyed by Submission_ID__c as (participant_id, record) pairs.
+    Returns a dict of participant_id -> error for the rejected attendances; only raises
+    when none of them could be saved. The rejected participant IDs are kept on the
+    record checkpoint, and a retry sends only the attendances of those participants.
+    """
+    checkpoint = current_checkpoint.get()
+    if checkpoint is not None and checkpoint.rejected_before():
+        retry_ids = checkpoint.rejected_before()
+        attendances = {
+            submission_id: attendance for submission_id, attendance in attendances.items()
+            if attendance[0] in retry_ids
+        }
+
+    if not attendances:
+        return {}
+
+    failures = bulk_upsert_to_salesforce(
+        "Attendance__c",
+        "Submission_ID__c",
+        [(submission_id, record) for submission_id, (_, record) in attendances.items()],
+        sf_connection
+    )
+    failed_participants = {attendances[submission_id][0]: error for submission_id, error in failures.items()}
+    if checkpoint is not None:
+        checkpoint.mark_rejected(failed_participants)
+
+    if failed_participants and len(failed_participants) == len(attendances):
+        raise Exception(f"Error upserting Attendance__c: {failed_participants}")
+
+    return failed_participants
                 
 # def training_session_exists(sf_connection, training_session_id):
 #         """Check if the Training Group exists in Salesforce."""
@@ -0,0 +1,158 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from utils.firestore_client import get_firestore_client
+from utils.logging_config import logger
+
+# Progress of background jobs, readable from any instance
+BACKGROUND_JOB_COLLECTION = os.getenv("BACKGROUND_JOB_COLLECTION", "background_jobs")
+
+# Records processed at once per destination, shared by all background jobs in the instance
+DESTINATION_CONCURRENCY = {
+    "Salesforce": int(os.getenv("SF_RETRY_CONCURRENCY", "5")),
+    "CommCare": int(os.getenv("CC_RETRY_CONCURRENCY", "3")),
+    "PostgreSQL": int(os.getenv("PG_RETRY_CONCURRENCY", "5")),
+}
+
+# Progress is written to Firestore after this many records, and when the job ends
+PROGRESS_WRITE_INTERVAL = 25
+
+# Errors kept on the job document
+MAX_JOB_ERRORS = 20
+
+# A running job rewrites its document (updated_at) at least this often; one silent for
+# longer than the stale threshold died with its instance and is reported as failed
+BACKGROUND_JOB_HEARTBEAT_SECONDS = int(os.getenv("BACKGROUND_JOB_HEARTBEAT_SECONDS", "30"))
+BACKGROUND_JOB_STALE_SECONDS = int(os.getenv("BACKGROUND_JOB_STALE_SECONDS", "300"))
+
+_destination_slots = {destination: threading.BoundedSemaphore(limit) for destination, limit in DESTINATION_CONCURRENCY.items()}
+
+# Large enough for every destination to use all its slots at once
+_executor = ThreadPoolExecutor(max_workers=sum(DESTINATION_CONCURRENCY.values()), thread_name_prefix="background-job")
+
+class BackgroundJob:
+    """Progress of one background job, mirrored to a Firestore document."""
+
+    def __init__(self, kind, total, params=None, db=None):
+        self.db = db if db is not None else get_firestore_client()
+        self.job_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.progress = {
+            "kind": kind,
+            "params": params or {},
+            "status": "queued",
+            "total": total,
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "not_found": 0,
+            "errors": [],
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        self.save()
+
+    def save(self):
+        with self.lock:
+            self.progress["updated_at"] = datetime.now(timezone.utc)
+            progress = dict(self.progress, errors=list(self.progress["errors"]))
+        try:
+            self.db.collection(BACKGROUND_JOB_COLLECTION).document(self.job_id).set(progress)
+        except Exception as e:
+            logger.error({
+                "message": "Failed to save background job progress",
+                "job_id": self.job_id,
+                "error": str(e)
+            })
+
+    def update(self, **fields):
+        with self.lock:
+            self.progress.update(fields)
+        self.save()
+
+    def record(self, success, error=None, item_id=None):
+        with self.lock:
+            self.progress["processed"] += 1
+            self.progress["succeeded" if success else "failed"] += 1
+            if not success and len(self.progress["errors"]) < MAX_JOB_ERRORS:
+                self.progress["errors"].append({"id": item_id, "error": str(error)})
+            write = self.progress["processed"] % PROGRESS_WRITE_INTERVAL == 0
+        if write:
+            self.save()
+
+def get_background_job(job_id, db=None):
+    """The job's progress document, reported as failed when it stopped writing its heartbeat while unfinished."""
+    if db is None:
+        db = get_firestore_client()
+    snapshot = db.collection(BACKGROUND_JOB_COLLECTION).document(job_id).get()
+    if not snapshot.exists:
+        return None
+
+    job = {"job_id": job_id, **snapshot.to_dict()}
+    updated_at = job.get("updated_at")
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=BACKGROUND_JOB_STALE_SECONDS)
+    if job.get("status") in ["queued", "running"] and updated_at is not None and updated_at < stale_before:
+        job.update(status="failed", error=f"No progress written since {updated_at.isoformat()}; the job stopped with its instance")
+    return job
+
+def run_items(job, items, get_destination, worker, get_item_id=None):
+    """
+    Run `worker(item)` for every item on the shared pool, holding a slot of the item's
+    destination while it runs. `worker` returns (success, error). Blocks until done.
+    """
+    def run(item):
+        slot = _destination_slots.get(get_destination(item))
+        if slot is None:
+            return worker(item)
+        with slot:
+            return worker(item)
+
+    futures = {_executor.submit(run, item): item for item in items}
+    for future in as_completed(futures):
+        item = futures[future]
+        item_id = get_item_id(item) if get_item_id else None
+        try:
+            success, error = future.result()
+        except Exception as e:
+            success, error = False, str(e)
+        job.record(success, error, item_id)
+
+def start_background_job(job, target, *args):
+    """
+    Run `target(job, *args)` on its own thread and return straight away. The job is
+    marked running, then completed or failed when `target` returns or raises; while
+    it runs its document is rewritten every BACKGROUND_JOB_HEARTBEAT_SECONDS.
+    """
+    finished = threading.Event()
+
+    def heartbeat():
+        while not finished.wait(BACKGROUND_JOB_HEARTBEAT_SECONDS):
+            job.save()
+
+    def run():
+        job.update(status="running", started_at=datetime.now(timezone.utc))
+        threading.Thread(target=heartbeat, name=f"background-job-heartbeat-{job.job_id}", daemon=True).start()
+        try:
+            target(job, *args)
+            job.update(status="completed", finished_at=datetime.now(timezone.utc))
+        except Exception as e:
+            logger.error({
+                "message": "Background job failed",
+                "job_id": job.job_id,
+                "kind": job.progress["kind"],
+                "error": str(e)
+            })
+            job.update(status="failed", error=str(e), finished_at=datetime.now(timezone.utc))
+        finally:
+            finished.set()
+
+        logger.info({
+            "message": "Background job finished",
+            "job_id": job.job_id,
+            **{key: job.progress[key] for key in ["kind", "status", "total", "processed", "succeeded", "failed", "not_found"]}
+        })
+
+    threading.Thread(target=run, name=f"background-job-{job.job_id}", daemon=True).start()
+    return job.job_id
@@ -0,0 +1,68 @@
+import os
+import time
+
+# Cloud Run request timeout (see the deploy command in the README)
+REQUEST_TIMEOUT_SECONDS = int(os.getenv("REQUEST_TIMEOUT_SECONDS", "3600"))
+
+# Time kept back from the request timeout for the final status writes and the response
+TIME_BUDGET_MARGIN_SECONDS = int(os.getenv("TIME_BUDGET_MARGIN_SECONDS", "120"))
+
+# Longest a page may be planned to run. Documents of a page are claimed under a
+# FIRESTORE_LEASE_SECONDS lease and handed back to the queue when it expires, so a
+# page has to finish well inside the lease or its documents are processed twice
+PAGE_MAX_SECONDS = float(os.getenv("FIRESTORE_PAGE_MAX_SECONDS", str(int(os.getenv("FIRESTORE_LEASE_SECONDS", "900")) / 2)))
+
+class AdaptiveBatchController:
+    """
+    Sizes each page pulled from the Firestore queue from the measured time per
+    document, the time left in the request and the remaining backlog.
+    """
+
+    def __init__(self, initial_size, max_size, time_budget=None, smoothing=0.3, max_page_seconds=PAGE_MAX_SECONDS):
+        if time_budget is None:
+            time_budget = REQUEST_TIMEOUT_SECONDS - TIME_BUDGET_MARGIN_SECONDS
+        self.deadline = time.monotonic() + time_budget
+        self.initial_size = initial_size
+        self.max_size = max_size
+        self.smoothing = smoothing
+        self.max_page_seconds = max_page_seconds
+        self.seconds_per_record = None
+        self.pages = 0
+
+    def remaining_time(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def next_batch_size(self, backlog=None):
+        """
+        Return how many documents to pull next, or 0 when the backlog is empty or
+        the next document would not finish before the time budget runs out.
+        """
+        remaining = self.remaining_time()
+        if remaining <= 0 or (backlog is not None and backlog <= 0):
+            return 0
+
+        if self.seconds_per_record is None:
+            size = self.initial_size
+        elif self.seconds_per_record > remaining:
+            return 0
+        else:
+            # Aim for pages that use at most half of the remaining time, so the
+            # estimate is refreshed before the budget is committed, and that end
+            # before the leases on their documents expire
+            page_seconds = min(remaining / 2, self.max_page_seconds)
+            size = int(page_seconds / self.seconds_per_record) if self.seconds_per_record else self.max_size
+
+        size = min(max(size, 1), self.max_size)
+        return min(size, backlog) if backlog is not None else size
+
+    def record_batch(self, count, elapsed):
+        """Update the per-document latency estimate (moving average) after a page."""
+        self.pages += 1
+        if count <= 0:
+            return
+
+        seconds_per_record = elapsed / count
+        if self.seconds_per_record is None:
+            self.seconds_per_record = seconds_per_record
+        else:
+            self.seconds_per_record = self.smoothing * seconds_per_record + (1 - self.smoothing) * self.seconds_per_record
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import re
+from utils.logging_config import logger
+
+# Case blocks packed into one XForm submission; 1 keeps one form per record
+CC_CASES_PER_SUBMISSION = max(1, int(os.getenv("CC_CASES_PER_SUBMISSION", "1")))
+
+def split_batches(items, size=CC_CASES_PER_SUBMISSION):
+    """Consecutive slices of at most `size` items."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def find_named_cases(error, case_ids):
+    """Positions of the case IDs that a receiver error message mentions as a whole word."""
+    return [
+        position for position, case_id in enumerate(case_ids)
+        if case_id and re.search(rf"(?<![\w-]){re.escape(case_id)}(?![\w-])", error or "")
+    ]
+
+async def submit_case_batch(items, get_case_id, send_batch, send_one):
+    """
+    Submit the case blocks of several records as one form and return a
+    (success, error) per item, in order.
+
+    `send_batch(items)` posts one multi-case form and returns (success, error, rejected),
+    `rejected` being true when the receiver refused the form itself; `send_one(item)`
+    posts a record's own form and returns (success, error). The receiver rejects a form
+    as a whole, so a rejected batch is split: when the error names some of the batch's
+    case IDs those records fail with it and the rest are resubmitted together, otherwise
+    the batch is halved, down to single-record forms. Any other failure (no response,
+    429 or 5xx after retries) fails the whole batch without resubmitting it. Errors are
+    prefixed with their case ID.
+    """
+    if len(items) == 1:
+        success, error = await send_one(items[0])
+        return [(success, f"Case {get_case_id(items[0])}: {error}" if error else None)]
+
+    success, error, rejected = await send_batch(items)
+    if success:
+        return [(True, None)] * len(items)
+
+    case_ids = [get_case_id(item) for item in items]
+    if not rejected:
+        return [(False, f"Case {case_id}: {error}") for case_id in case_ids]
+
+    named = find_named_cases(error, case_ids)
+    if named and len(named) < len(items):
+        results = {position: (False, f"Case {case_ids[position]}: {error}") for position in named}
+        groups = [[position for position in range(len(items)) if position not in results]]
+    else:
+        results = {}
+        middle = len(items) // 2
+        groups = [list(range(middle)), list(range(middle, len(items)))]
+
+    logger.warning({
+        "message": "CommCare rejected a multi-case submission, splitting it",
+        "cases": len(items),
+        "named_cases": [case_ids[position] for position in named],
+        "resubmitted_as": [len(group) for group in groups],
+        "error": error,
+    })
+
+    group_results = await asyncio.gather(*(
+        submit_case_batch([items[position] for position in group], get_case_id, send_batch, send_one)
+        for group in groups
+    ))
+    for group, outcomes in zip(groups, group_results):
+        results.update(zip(group, outcomes))
+    return [results[position] for position in range(len(items))]
@@ -0,0 +1,10 @@
+import os
+
+def authenticate_commcare():
+    domain = os.getenv("CC_DOMAIN")
+    apikey = os.getenv("CC_API_KEY")
+    username = os.getenv("CC_USERNAME")
+    url = f'https://www.commcarehq.org/a/{domain}/receiver/GCP_Forms/'
+    headers = {'Authorization': 'ApiKey ' + f'{username}:{apikey}',
+               "Content-Type": "text/xml"}
+    return url, headers
@@ -0,0 +1,96 @@
+import datetime
+import os
+import re
+from functools import lru_cache
+
+# Distinct answer strings whose type is remembered; survey answers repeat a lot
+# ("TRUE", "0", option codes), so most lookups are cache hits
+FIELD_TYPE_CACHE_SIZE = int(os.getenv("FIELD_TYPE_CACHE_SIZE", "4096"))
+
+# Plain YYYY-MM-DD, built directly without strptime
+ISO_DATE = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})")
+
+# Everything else strptime("%Y-%m-%d") could accept (single-digit month or day,
+# a space-padded day, non-ASCII digits), confirmed with strptime
+LOOSE_DATE = re.compile(r"\d{4}-\d{1,2}-(?:\d{1,2}| \d)")
+
+# Plain decimal numbers, parsed by float() without an exception on the text path
+NUMBER = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+
+# Other strings float() accepts all contain a digit or are inf/nan
+NUMBER_CANDIDATE = re.compile(r"\d|^[+-]?(?:inf|infinity|nan)$", re.IGNORECASE)
+
+def _parse_date(val):
+    match = ISO_DATE.fullmatch(val)
+    if match:
+        try:
+            return datetime.datetime(int(match[1]), int(match[2]), int(match[3]))
+        except ValueError:
+            return None
+    if LOOSE_DATE.fullmatch(val):
+        try:
+            return datetime.datetime.strptime(val, "%Y-%m-%d")
+        except ValueError:
+            return None
+    return None
+
+@lru_cache(maxsize=FIELD_TYPE_CACHE_SIZE)
+def _infer_text_type(val):
+    # Detect booleans
+    if val.upper() in ("TRUE", "FALSE"):
+        return "boolean", (val.upper() == "TRUE")
+    if val in ("1", "0"):
+        return "boolean", (val == "1")
+    # Detect dates
+    date = _parse_date(val)
+    if date is not None:
+        return "date", date
+    # Detect numbers
+    if NUMBER.fullmatch(val):
+        return "number", float(val)
+    if NUMBER_CANDIDATE.search(val):
+        try:
+            return "number", float(val)
+        except ValueError:
+            pass
+    # Otherwise text
+    return "text", val or None
+
+def infer_field_type(value):
+    """
+    Infer the data type of the answer and return (field_type, parsed_value).
+    - Booleans: 'TRUE', 'FALSE', '1', '0'
+    - Dates: ISO format 'YYYY-MM-DD'
+    - Numbers: integers or floats (e.g., '50', '50.0')
+    - Fallback to text
+    """
+    # Handle string inputs
+    if isinstance(value, str):
+        return _infer_text_type(value.strip())
+    # Non-strings
+    elif isinstance(value, bool):
+        return "boolean", value
+    elif isinstance(value, (int, float)):
+        return "number", float(value)
+    # Turn unknown types to text
+    return "text", str(value) if value is not None else None
+
+def infer_field_types(values):
+    """Infer the type of every answer of a visit in one pass; returns a list of (field_type, parsed_value)."""
+    return [infer_field_type(value) for value in values]
+
+def first_positions(items):
+    """
+    1-based position of the first item equal to each item, as `items.index(item) + 1`
+    gives, in one pass. Repeated answers share their first position, and so one
+    submission_id.
+    """
+    seen = {}
+    positions = []
+    for position, item in enumerate(items, start=1):
+        try:
+            positions.append(seen.setdefault(item, position))
+        except TypeError:
+            # Unhashable answers (dicts) fall back to a scan
+            positions.append(items.index(item) + 1)
+    return positions
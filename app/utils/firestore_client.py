@@ -1,14 +1,51 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud import firestore
+from google.cloud.firestore import FieldFilter
+from utils.status_counters import add_status_change, apply_status_deltas
 from utils.logging_config import logger
 
+# How long a worker may hold a claimed document before it is returned to the queue
+LEASE_SECONDS = int(os.getenv("FIRESTORE_LEASE_SECONDS", "900"))
+
+# Status updates queued before a batch is committed (Firestore allows 500 writes per batch)
+STATUS_BATCH_SIZE = int(os.getenv("FIRESTORE_STATUS_BATCH_SIZE", "200"))
+
+# Firestore allows at most 30 values in an "in" filter
+IN_QUERY_MAX_VALUES = 30
+
+# "in" queries run at the same time when looking up many documents
+LOOKUP_CONCURRENCY = int(os.getenv("FIRESTORE_LOOKUP_CONCURRENCY", "10"))
+
+# Fall back to the nested data.id for documents saved before job_id was written.
+# Can be switched off once /backfill-job-id has run over both collections.
+LEGACY_ID_LOOKUP = os.getenv("FIRESTORE_LEGACY_ID_LOOKUP", "true").lower() == "true"
+
+_client = None
+_client_lock = threading.Lock()
+
 def get_firestore_client():
-    return firestore.Client()
+    """Return the process-wide Firestore client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = firestore.Client()
+    return _client
 
 def save_to_firestore(data, job_name, status, collection, db=None):
     if db is None:
         db = get_firestore_client()
-        
-    doc_ref = db.collection(collection).add({
+
+    # The document and its status counter commit together, so a failed counter write
+    # cannot fail a save that already stored the document
+    doc_ref = db.collection(collection).document()
+    batch = db.batch()
+    batch.set(doc_ref, {
         "data": data,
         "job_name": job_name,
         "job_id": data.get("id"),
@@ -19,10 +56,16 @@ def save_to_firestore(data, job_name, status, collection, db=None):
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
     })
+    apply_status_deltas(collection, add_status_change({}, None, status), db, batch)
+    batch.commit()
     
-    return doc_ref[1].id
+    return doc_ref.id
 
-def update_firestore_status(doc_id, status, collection, fields=None, db=None):
+def update_firestore_status(doc_id, status, collection, fields=None, db=None, previous_status=None):
+    """
+    Set the document's status. Pass the status the document had before
+    (`previous_status`) to keep the status counters in step.
+    """
     if db is None:
         db = get_firestore_client()
     try:
@@ -36,8 +79,6 @@ def update_firestore_status(doc_id, status, collection, fields=None, db=None):
             "status": status,
             "fields": fields
         })
-        
-        return True
     except Exception as e:
         logger.error({
             "message": "Failed to update Firestore document",
@@ -47,3 +88,235 @@ def update_firestore_status(doc_id, status, collection, fields=None, db=None):
             "error": str(e)
         })
         return False
+
+    # The status is written; a failed counter write only leaves drift for /reconcile-status-count to correct
+    if previous_status is not None:
+        try:
+            apply_status_deltas(collection, add_status_change({}, previous_status, status), db)
+        except Exception as e:
+            logger.error({
+                "message": "Failed to update status counters",
+                "doc_id": doc_id,
+                "collection": collection,
+                "status": status,
+                "previous_status": previous_status,
+                "error": str(e)
+            })
+    return True
+
+def find_documents_by_field(collection, field, values, select=None, db=None):
+    """
+    Return the documents whose `field` equals any of `values`, looked up with
+    concurrent "in" queries of 30 values instead of one query per value.
+    `select` limits the fields read from each document.
+    """
+    if db is None:
+        db = get_firestore_client()
+
+    values = list(dict.fromkeys(values))
+    chunks = [values[i:i + IN_QUERY_MAX_VALUES] for i in range(0, len(values), IN_QUERY_MAX_VALUES)]
+    if not chunks:
+        return []
+
+    def lookup(chunk):
+        query = db.collection(collection).where(filter=FieldFilter(field, "in", chunk))
+        if select:
+            query = query.select(select)
+        return query.get()
+
+    with ThreadPoolExecutor(max_workers=min(LOOKUP_CONCURRENCY, len(chunks))) as executor:
+        return [doc for docs in executor.map(lookup, chunks) for doc in docs]
+
+def get_job_id(fields):
+    return fields.get("job_id") or (fields.get("data") or {}).get("id")
+
+def find_documents_by_job_ids(collection, job_ids, select=None, db=None):
+    """
+    Return the documents stored for the given form IDs, looked up on the top-level
+    job_id. IDs with no match are looked up on data.id, for legacy documents.
+    """
+    if select:
+        select = list(dict.fromkeys([*select, "job_id", "data.id"]))
+
+    docs = find_documents_by_field(collection, "job_id", job_ids, select=select, db=db)
+    found = {(doc.to_dict() or {}).get("job_id") for doc in docs}
+    missing = [job_id for job_id in job_ids if job_id not in found]
+    if missing and LEGACY_ID_LOOKUP:
+        seen = {doc.id for doc in docs}
+        legacy_docs = find_documents_by_field(collection, "data.id", missing, select=select, db=db)
+        docs.extend(doc for doc in legacy_docs if doc.id not in seen)
+    return docs
+
+def backfill_job_ids(collection, page_token=None, page_size=500, db=None):
+    """
+    Copy data.id to job_id on one page of documents (ordered by document ID) that
+    have no job_id yet. Returns (scanned, updated, next_page_token); the token is
+    None once the end of the collection is reached.
+    """
+    if db is None:
+        db = get_firestore_client()
+
+    # Documents without a field are not indexed, so the page is scanned rather than queried
+    query = db.collection(collection).order_by("__name__").select(["job_id", "data.id"]).limit(page_size)
+    if page_token:
+        query = query.start_after({"__name__": page_token})
+    docs = query.get()
+
+    bulk_writer = db.bulk_writer()
+    updated = 0
+    for doc in docs:
+        fields = doc.to_dict() or {}
+        job_id = (fields.get("data") or {}).get("id")
+        if fields.get("job_id") is None and job_id is not None:
+            bulk_writer.update(doc.reference, {"job_id": job_id})
+            updated += 1
+    bulk_writer.close()
+
+    next_page_token = docs[-1].id if len(docs) == page_size else None
+    return len(docs), updated, next_page_token
+
+def new_lease_owner():
+    return f"{os.getenv('K_REVISION', 'local')}-{uuid.uuid4().hex[:12]}"
+
+def claim_documents(docs, collection, lease_owner, lease_seconds=LEASE_SECONDS, db=None):
+    """
+    Move queried documents to "processing" under a lease. Each update is conditioned
+    on the document being unchanged since it was read, so when two scheduler runs
+    pick up the same document only one of them claims it. Returns the claimed documents.
+    """
+    if db is None:
+        db = get_firestore_client()
+
+    lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    claimed = []
+    deltas = {}
+    for doc in docs:
+        try:
+            db.collection(collection).document(doc.id).update(
+                {
+                    "status": "processing",
+                    "lease_owner": lease_owner,
+                    "lease_expires_at": lease_expires_at,
+                },
+                option=db.write_option(last_update_time=doc.update_time)
+            )
+            claimed.append(doc)
+            add_status_change(deltas, (doc.to_dict() or {}).get("status"), "processing")
+        except FailedPrecondition:
+            logger.info({
+                "message": "Document already claimed by another worker",
+                "doc_id": doc.id,
+                "lease_owner": lease_owner
+            })
+
+    apply_status_deltas(collection, deltas, db)
+    return claimed
+
+def release_expired_leases(collection, limit=100, db=None):
+    """
+    Return documents whose lease has expired (the worker crashed or timed out)
+    to the queue with status "new".
+    """
+    if db is None:
+        db = get_firestore_client()
+
+    docs = db.collection(collection).where(
+        filter=FieldFilter("status", "==", "processing")).where(
+        filter=FieldFilter("lease_expires_at", "<", datetime.now(timezone.utc))
+        ).limit(limit).get()
+
+    released = []
+    for doc in docs:
+        try:
+            db.collection(collection).document(doc.id).update(
+                {
+                    "status": "new",
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                },
+                option=db.write_option(last_update_time=doc.update_time)
+            )
+            released.append(doc.id)
+        except FailedPrecondition:
+            continue
+
+    apply_status_deltas(collection, {"processing": -len(released), "new": len(released)}, db)
+
+    if released:
+        logger.warning({
+            "message": "Released expired leases",
+            "collection": collection,
+            "doc_ids": released
+        })
+
+    return released
+
+class StatusWriteBatcher:
+    """
+    Queues Firestore status updates and commits them together in one db.batch().
+    Updates to the same document are merged. Call flush() at the end of each run;
+    the batch is also committed once it reaches `max_size` documents. The status
+    counters are updated in the same batch.
+    """
+
+    def __init__(self, db=None, max_size=STATUS_BATCH_SIZE):
+        self.db = db if db is not None else get_firestore_client()
+        self.max_size = max_size
+        self.pending = {}
+        self.previous_statuses = {}
+        self.lock = threading.Lock()
+
+    def update_status(self, doc_id, status, collection, fields=None, previous_status=None):
+        update_data = {"status": status}
+        if fields:
+            update_data.update(fields)
+
+        with self.lock:
+            self.pending.setdefault((collection, doc_id), {}).update(update_data)
+            # Keep the status from before the first queued update of the document
+            self.previous_statuses.setdefault((collection, doc_id), previous_status)
+            full = len(self.pending) >= self.max_size
+
+        if full:
+            self.flush()
+        return True
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            previous_statuses, self.previous_statuses = self.previous_statuses, {}
+        if not pending:
+            return True
+
+        batch = self.db.batch()
+        deltas = {}
+        for (collection, doc_id), update_data in pending.items():
+            batch.update(self.db.collection(collection).document(doc_id), update_data)
+            previous_status = previous_statuses.get((collection, doc_id))
+            if previous_status is not None:
+                add_status_change(deltas.setdefault(collection, {}), previous_status, update_data["status"])
+        for collection, collection_deltas in deltas.items():
+            apply_status_deltas(collection, collection_deltas, self.db, batch)
+
+        try:
+            batch.commit()
+            logger.info({
+                "message": "Committed batched Firestore status updates",
+                "updates": len(pending)
+            })
+            return True
+        except Exception as e:
+            # The whole batch is rejected if any document fails, so fall back to
+            # individual writes to keep the other updates
+            logger.error({
+                "message": "Failed to commit batched Firestore status updates, writing individually",
+                "updates": len(pending),
+                "error": str(e)
+            })
+            results = [
+                update_firestore_status(doc_id, update_data.get("status"), collection,
+                                        {key: value for key, value in update_data.items() if key != "status"}, db=self.db,
+                                        previous_status=previous_statuses.get((collection, doc_id)))
+                for (collection, doc_id), update_data in pending.items()
+            ]
+            return all(results)
@@ -0,0 +1,177 @@
+import json
+import os
+from google.cloud import firestore
+from utils.firestore_client import get_firestore_client
+from utils.status_counters import add_status_change, apply_status_deltas
+from utils.logging_config import logger
+
+# Records per shard document; Salesforce payloads with more are split at ingest so
+# no document nears the 1 MiB limit and several workers can push one job
+SF_SHARD_SIZE = int(os.getenv("SF_SHARD_SIZE", "500"))
+
+# Payload arrays that are split into shards
+SHARDED_RECORD_KEYS = ["participants", "households", "trainingGroups"]
+
+# Shard documents written per Firestore batch: at most 500 writes and 10 MiB per commit
+SHARD_WRITE_BATCH_SIZE = 400
+SHARD_WRITE_MAX_BYTES = 8 * 1024 * 1024
+
+# Shard statuses counted on the parent
+SHARD_OUTCOMES = ["completed", "failed"]
+
+def get_sharded_records(data, shard_size=SF_SHARD_SIZE):
+    """Return (key, records) of the payload array to split, or (None, None) when it fits one document."""
+    for key in SHARDED_RECORD_KEYS:
+        records = data.get(key)
+        if isinstance(records, list) and len(records) > shard_size:
+            return key, records
+    return None, None
+
+def is_shard_parent(fields):
+    """Parent documents only aggregate their shards; there is nothing in them to send."""
+    return "shards" in (fields or {})
+
+def get_parent_status(shards, shard_statuses):
+    """The parent's status: completed when every shard is, shards_failed once all settled with failures, else sharded."""
+    completed = shard_statuses.get("completed", 0)
+    if completed >= shards:
+        return "completed"
+    if completed + shard_statuses.get("failed", 0) >= shards:
+        return "shards_failed"
+    return "sharded"
+
+def _estimate_size(fields):
+    return len(json.dumps(fields, default=str).encode("utf-8"))
+
+def _commit_in_batches(db, writes):
+    """Commit (reference, fields, is_update) writes in batches under the Firestore write count and size limits."""
+    batch, count, size = db.batch(), 0, 0
+    for reference, fields, is_update in writes:
+        fields_size = _estimate_size(fields)
+        if count and (count >= SHARD_WRITE_BATCH_SIZE or size + fields_size > SHARD_WRITE_MAX_BYTES):
+            batch.commit()
+            batch, count, size = db.batch(), 0, 0
+        if is_update:
+            batch.update(reference, fields)
+        else:
+            batch.set(reference, fields)
+        count += 1
+        size += fields_size
+    if count:
+        batch.commit()
+
+def save_sharded_to_firestore(data, job_name, collection, records_key, shard_size=SF_SHARD_SIZE, db=None):
+    """
+    Store a large payload as one document per `shard_size` records of `records_key`,
+    each carrying the rest of the payload and the parent's ID, under a parent document
+    (status "sharded", no records). Returns the parent document ID.
+
+    Shards are written held back (status "sharding", which no worker picks up), then
+    the parent, then the shards are released to "new", so no shard runs before its
+    parent exists. A failed ingest leaves only held-back shards behind; a failure
+    while releasing them marks the parent "shards_failed".
+    """
+    if db is None:
+        db = get_firestore_client()
+
+    records = data[records_key]
+    shared = {key: value for key, value in data.items() if key != records_key}
+    chunks = [records[start:start + shard_size] for start in range(0, len(records), shard_size)]
+
+    parent_ref = db.collection(collection).document()
+    shard_refs = [db.collection(collection).document() for _ in chunks]
+    _commit_in_batches(db, [
+        (shard_ref, {
+            "data": {**shared, records_key: chunk},
+            "job_name": job_name,
+            "job_id": data.get("id"),
+            "parent_id": parent_ref.id,
+            "shard_index": shard_index,
+            "status": "sharding",
+            "run_retries": 0,
+            "last_retried_at": "",
+            "last_step": "",
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }, False)
+        for shard_index, (shard_ref, chunk) in enumerate(zip(shard_refs, chunks))
+    ])
+
+    batch = db.batch()
+    batch.set(parent_ref, {
+        "data": shared,
+        "job_name": job_name,
+        "job_id": data.get("id"),
+        "status": "sharded",
+        "records_key": records_key,
+        "records": len(records),
+        "shards": len(chunks),
+        "shard_statuses": {outcome: 0 for outcome in SHARD_OUTCOMES},
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    apply_status_deltas(collection, {"sharded": 1}, db, batch)
+    batch.commit()
+
+    try:
+        _commit_in_batches(db, [(shard_ref, {"status": "new"}, True) for shard_ref in shard_refs])
+    except Exception as e:
+        parent_ref.update({"status": "shards_failed", "error": f"Failed to release shards: {e}"})
+        apply_status_deltas(collection, {"sharded": -1, "shards_failed": 1}, db)
+        raise
+    apply_status_deltas(collection, {"new": len(shard_refs)}, db)
+
+    logger.info({
+        "message": "Stored sharded payload",
+        "parent_id": parent_ref.id,
+        "job_name": job_name,
+        "records": len(records),
+        "shards": len(chunks)
+    })
+    return parent_ref.id
+
+def settle_shard(collection, doc_id, parent_id, status, db=None):
+    """
+    Count a shard's outcome ("completed" or "failed") on its parent and re-derive the
+    parent's status, in one transaction. The outcome last counted is kept on the shard
+    so a retried shard moves its count instead of adding another. Returns the
+    parent's status, or None when the update failed.
+    """
+    if db is None:
+        db = get_firestore_client()
+    shard_ref = db.collection(collection).document(doc_id)
+    parent_ref = db.collection(collection).document(parent_id)
+
+    @firestore.transactional
+    def settle(transaction):
+        shard = shard_ref.get(transaction=transaction).to_dict() or {}
+        parent = parent_ref.get(transaction=transaction).to_dict() or {}
+        deltas = add_status_change({}, shard.get("shard_outcome"), status)
+        if not deltas:
+            return parent.get("status")
+
+        shard_statuses = dict(parent.get("shard_statuses") or {})
+        for outcome, delta in deltas.items():
+            shard_statuses[outcome] = max(0, shard_statuses.get(outcome, 0) + delta)
+        parent_status = get_parent_status(parent.get("shards", 0), shard_statuses)
+
+        transaction.update(shard_ref, {"shard_outcome": status})
+        transaction.update(parent_ref, {
+            "status": parent_status,
+            "shard_statuses": shard_statuses,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+        apply_status_deltas(collection, add_status_change({}, parent.get("status"), parent_status), db, transaction)
+        return parent_status
+
+    try:
+        return settle(db.transaction())
+    except Exception as e:
+        logger.error({
+            "message": "Failed to aggregate shard status on parent",
+            "doc_id": doc_id,
+            "parent_id": parent_id,
+            "status": status,
+            "error": str(e)
+        })
+        return None
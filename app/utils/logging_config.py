@@ -1,11 +1,38 @@
+import atexit
+import copy
+import functools
 import logging
 import json
+import queue
+import random
+import re
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
 from google.cloud import logging as cloud_logging
+from google.cloud.logging_v2.handlers.transports import BackgroundThreadTransport
 import os
 
+# High-volume lines (one per question, one per upsert) are logged at DEBUG; set
+# LOG_LEVEL=DEBUG to keep a sample of them
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Fraction of DEBUG lines kept when LOG_LEVEL=DEBUG
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+# Records waiting for the listener thread; once full, new records are dropped rather
+# than blocking the worker that logs them
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Entries sent to Cloud Logging per API call, and the longest an entry waits for a batch
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_MAX_LATENCY_SECONDS = float(os.getenv("LOG_MAX_LATENCY_SECONDS", "1"))
+
 # Initialize Google Cloud Logging client
 cloud_logging_client = cloud_logging.Client()
-cloud_handler = cloud_logging.handlers.CloudLoggingHandler(cloud_logging_client)
+cloud_handler = cloud_logging.handlers.CloudLoggingHandler(
+    cloud_logging_client,
+    transport=functools.partial(BackgroundThreadTransport, batch_size=LOG_BATCH_SIZE, max_latency=LOG_MAX_LATENCY_SECONDS)
+)
 
 # Custom JSON Formatter for Structured Logging
 class JSONFormatter(logging.Formatter):
@@ -20,19 +47,103 @@ class JSONFormatter(logging.Formatter):
             log_record.update(record.extra)
         return json.dumps(log_record)
 
+class SamplingFilter(logging.Filter):
+    """Keep a `rate` fraction of the records at or below `level`; all others pass."""
+
+    def __init__(self, rate, level=logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record):
+        return record.levelno > self.level or random.random() < self.rate
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hand records to the listener thread unformatted. The standard QueueHandler formats
+    the message on the calling thread and replaces the dict with a string, which both
+    costs the worker the formatting and loses the structured payload Cloud Logging
+    builds from dict messages.
+    """
+
+    def __init__(self, log_queue, capture_request=False):
+        super().__init__(log_queue)
+        self.capture_request = capture_request
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.msg, dict):
+            # Shallow copy, in case the caller changes the dict after logging it
+            record.msg = dict(record.msg)
+        if record.exc_info:
+            # Tracebacks hold the caller's frames alive, so they are rendered here
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self.capture_request:
+            _capture_request_context(record)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_trace_header(header):
+    """
+    (trace_id, span_id, sampled) from an X-Cloud-Trace-Context header
+    ("TRACE_ID/SPAN_ID;o=OPTIONS", the span as a decimal number); span_id is hex
+    as Cloud Logging expects it. (None, None, False) when the header is missing.
+    """
+    match = re.match(r"^([0-9a-fA-F]+)(?:/(\d+))?(?:;o=(\d+))?", header or "")
+    if not match:
+        return None, None, False
+    trace_id, span_id, options = match.groups()
+    return trace_id, f"{int(span_id):016x}" if span_id else None, options == "1"
+
+def _capture_request_context(record):
+    # The request is only visible on the thread handling it, so its trace is read
+    # here for the Cloud Logging handler on the listener thread
+    if not has_request_context():
+        return
+    trace, span_id, trace_sampled = parse_trace_header(request.headers.get("X-Cloud-Trace-Context"))
+    if trace is not None and not hasattr(record, "trace"):
+        record.trace = f"projects/{cloud_logging_client.project}/traces/{trace}"
+        record.span_id = span_id
+        record.trace_sampled = trace_sampled
+    if not hasattr(record, "http_request"):
+        record.http_request = {
+            "requestMethod": request.method,
+            "requestUrl": request.url,
+            "userAgent": request.user_agent.string,
+            "protocol": request.environ.get("SERVER_PROTOCOL"),
+        }
+
 formatter = JSONFormatter()
 cloud_handler.setFormatter(formatter)
 
 logger = logging.getLogger("app_logger")
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
 
 if "K_SERVICE" in os.environ:  # Detect if running in Cloud Run
-    logger.addHandler(cloud_handler)
+    output_handler = cloud_handler
 else:
     # for local development
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    output_handler = logging.StreamHandler()
+    output_handler.setFormatter(formatter)
+
+# Workers only enqueue; formatting and export happen on the listener thread
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+queue_handler = LazyQueueHandler(log_queue, capture_request="K_SERVICE" in os.environ)
+queue_handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+logger.addHandler(queue_handler)
+
+log_listener = QueueListener(log_queue, output_handler, respect_handler_level=True)
+log_listener.start()
+# Registered after the Cloud Logging transport, so it runs first at exit and the
+# queued records still reach the transport's final flush
+atexit.register(log_listener.stop)
 
 # Log initialization message
 logger.info({
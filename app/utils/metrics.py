@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from utils.api_budget import current_job_name
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metrics = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}" if labels else ""
+
+def _format_number(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Histogram:
+    """
+    Latency histogram with fixed label names, served in OpenMetrics format at /metrics.
+    If "outcome" is one of the labels it defaults to "success", or "error" when the
+    timed block raises.
+    """
+
+    def __init__(self, name, description, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            self.series[key] = (counts, total + seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        """Time the block. Labels can be changed inside it through the yielded dict."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            if "outcome" in self.label_names:
+                labels["outcome"] = "error"
+            raise
+        finally:
+            if "outcome" in self.label_names:
+                labels.setdefault("outcome", "success")
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.description}"]
+        with self.lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self.series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_number(bound))])} {count}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        return lines
+
+class Gauge:
+    """
+    Values read when /metrics is scraped: `collect()` returns a dict of label values
+    (a tuple in `label_names` order) -> value.
+    """
+
+    def __init__(self, name, description, label_names, collect):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# TYPE {self.name} gauge", f"# HELP {self.name} {self.description}"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.label_names, key)))} {value}")
+        return lines
+
+def get_job_name():
+    return current_job_name.get() or "unattributed"
+
+def get_caller_step(depth=2):
+    """Name of the function `depth` frames up, e.g. the process_* helper calling upsert_to_salesforce."""
+    try:
+        return sys._getframe(depth).f_code.co_name
+    except ValueError:
+        return "unknown"
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+SALESFORCE_REQUEST_SECONDS = Histogram(
+    "salesforce_request_duration_seconds",
+    "Salesforce API calls, including retries, by job, step and sObject.",
+    ["job_name", "step", "sobject", "operation", "outcome"],
+)
+
+COMMCARE_SUBMISSION_SECONDS = Histogram(
+    "commcare_submission_duration_seconds",
+    "Form submissions to the CommCare receiver.",
+    ["job_name", "step", "outcome"],
+)
+
+POSTGRES_COMMIT_SECONDS = Histogram(
+    "postgres_commit_duration_seconds",
+    "SQLAlchemy session commits.",
+    ["job_name", "step", "outcome"],
+)
+
+JOB_SECONDS = Histogram(
+    "job_duration_seconds",
+    "Whole job handler runs, per queued document.",
+    ["job_name", "destination", "outcome"],
+)
+
+def observe_job(job_name, handler, seconds, success):
+    """Timing hook for jobs.registry."""
+    outcome = "success" if success else "failed" if success is False else "error"
+    JOB_SECONDS.observe(seconds, job_name=job_name, destination=handler.destination, outcome=outcome)
+
+POSTGRES_POOL_WAIT_SECONDS = Histogram(
+    "postgres_pool_checkout_wait_seconds",
+    "Time taken to get a connection from the SQLAlchemy pool, including opening new ones.",
+    [],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
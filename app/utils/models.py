@@ -60,7 +60,7 @@ class SurveyResponse(Base):
     survey_type = Column(String, nullable=False)
     completed_date = Column(DateTime, nullable=True)
     general_feedback = Column(Text, nullable=True)
-    submission_id = Column(String, nullable=False)  # Adding the Form ID from CommCare
+    submission_id = Column(String, nullable=False, unique=True)  # Adding the Form ID from CommCare
     created_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
     updated_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc), onupdate=datetime.datetime.now(datetime.timezone.utc))
 
@@ -79,7 +79,7 @@ class SurveyQuestionResponse(Base):
     section_name = Column(String, nullable=True)
     question_name = Column(String, nullable=False)
     field_type = Column(String, nullable=False)
-    submission_id = Column(String, nullable=False)  # Adding the Form ID from CommCare
+    submission_id = Column(String, nullable=False, unique=True)  # Adding the Form ID from CommCare
     created_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
     updated_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc), onupdate=datetime.datetime.now(datetime.timezone.utc))
 
@@ -1,7 +1,10 @@
 import os
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from dotenv import load_dotenv
+from utils.metrics import POSTGRES_POOL_WAIT_SECONDS, Gauge
 
 # Load .env variables
 load_dotenv()
@@ -11,10 +14,79 @@ DATABASE_URL = os.getenv("PG_PROD_DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not set in environment")
 
+# Connections kept open per instance, and extra ones opened under load and closed after use.
+# Keep (PG_POOL_SIZE + PG_MAX_OVERFLOW) x Cloud Run max instances below max_connections.
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "5"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "5"))
+
+# How long a session waits for a free connection before failing
+PG_POOL_TIMEOUT_SECONDS = int(os.getenv("PG_POOL_TIMEOUT_SECONDS", "30"))
+
+# Connections older than this are replaced, before the server or a proxy drops them
+PG_POOL_RECYCLE_SECONDS = int(os.getenv("PG_POOL_RECYCLE_SECONDS", "1800"))
+
+# Behind PgBouncer (transaction pooling) the pooling happens there, so each session
+# opens and closes its own connection to PgBouncer
+PG_USE_PGBOUNCER = os.getenv("PG_USE_PGBOUNCER", "false").lower() == "true"
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait, for /metrics."""
+
+    def _do_get(self):
+        with POSTGRES_POOL_WAIT_SECONDS.time():
+            return super()._do_get()
+
+def build_engine(database_url):
+    if PG_USE_PGBOUNCER:
+        return create_engine(database_url, echo=False, poolclass=NullPool)
+    return create_engine(
+        database_url,
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_size=PG_POOL_SIZE,
+        max_overflow=PG_MAX_OVERFLOW,
+        pool_timeout=PG_POOL_TIMEOUT_SECONDS,
+        pool_recycle=PG_POOL_RECYCLE_SECONDS,
+        # Checks connections with a cheap round trip on checkout, so ones dropped while idle are replaced
+        pool_pre_ping=True,
+    )
+
+def get_pool_stats():
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
 # SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL, echo=False)
+engine = build_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
 
+Gauge(
+    "postgres_pool_connections",
+    "Connections in the SQLAlchemy pool by state.",
+    ["state"],
+    lambda: {(state,): count for state, count in get_pool_stats().items()},
+)
+
+@contextmanager
+def session_scope():
+    """
+    Session that is rolled back if the block raises and always closed, returning its
+    connection to the pool. Commit inside the block.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
 # Import models here to register tables
 from .models import Base
 from utils.postgres import engine
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from utils.logging_config import logger
+
+# Submissions in flight to the CommCare receiver. The adaptive limit starts here,
+# halves when the receiver is overloaded and creeps back up while it keeps up
+CC_MAX_CONCURRENCY = int(os.getenv("CC_MAX_CONCURRENCY", "50"))
+CC_MIN_CONCURRENCY = int(os.getenv("CC_MIN_CONCURRENCY", "1"))
+
+# Token bucket in front of the receiver: sustained submissions per second and
+# burst size (a rate of 0 disables it)
+CC_RATE_PER_SECOND = float(os.getenv("CC_RATE_PER_SECOND", "50"))
+CC_RATE_BURST = int(os.getenv("CC_RATE_BURST", "50"))
+
+# How often a submission waiting for a concurrency slot checks for one
+CC_SLOT_POLL_SECONDS = 0.01
+
+# Retries of a submission answered with 429/5xx or lost to a connection error
+# (exponential backoff with full jitter, never shorter than Retry-After)
+CC_MAX_RETRIES = int(os.getenv("CC_MAX_RETRIES", "5"))
+CC_BACKOFF_BASE_SECONDS = float(os.getenv("CC_BACKOFF_BASE_SECONDS", "1"))
+CC_BACKOFF_MAX_SECONDS = float(os.getenv("CC_BACKOFF_MAX_SECONDS", "60"))
+
+class TokenBucket:
+    """
+    Admits `rate` calls per second on average, in bursts of up to `capacity`.
+    `pause()` holds every caller, e.g. for a Retry-After sent to one of them.
+    Thread-safe: callers on different event loops share one bucket.
+    """
+
+    def __init__(self, rate=CC_RATE_PER_SECOND, capacity=CC_RATE_BURST):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _take(self):
+        """Take a token; returns 0, or the seconds to wait before asking again."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.rate <= 0:
+                return 0
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit: one more slot after each full window of successes
+    (additive increase), half the slots when a request reports overload
+    (multiplicative decrease). Requests that started before a decrease cannot
+    decrease the limit again, so one burst of 429s halves it once. Thread-safe:
+    waiting callers poll for a slot, so they can run on different event loops.
+    """
+
+    def __init__(self, maximum=CC_MAX_CONCURRENCY, minimum=CC_MIN_CONCURRENCY):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = self.maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        """Wait for a free slot; returns the generation to hand back to release()."""
+        while True:
+            with self._lock:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return self.generation
+            await asyncio.sleep(CC_SLOT_POLL_SECONDS)
+
+    async def release(self, generation, overloaded):
+        with self._lock:
+            self.in_flight -= 1
+            if overloaded:
+                if generation == self.generation:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.generation += 1
+                    self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+
+def is_retryable_status(status):
+    """429 and 5xx responses, and requests that got no response at all (None)."""
+    return status is None or status == 429 or status >= 500
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(CC_BACKOFF_MAX_SECONDS, CC_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    return max(delay, retry_after) if retry_after is not None else delay
+
+class Throttle:
+    """
+    Paces the submissions to one receiver: a token bucket, then an AIMD concurrency
+    slot, then per-request retries with backoff. One throttle is shared by every
+    job of the instance (see get_throttle), so their submissions in flight add up
+    to one limit and a Retry-After holds them all. Counts what it sent.
+    """
+
+    def __init__(self, limiter=None, bucket=None, max_retries=CC_MAX_RETRIES):
+        self.limiter = limiter or AIMDLimiter()
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self.started = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    async def call(self, request, description):
+        """
+        Await `request()`, which returns (success, error, status, retry_after), and
+        retry it while it fails with a retryable status. Returns (success, error).
+        """
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            generation = await self.limiter.acquire()
+            overloaded = False
+            try:
+                success, error, status, retry_after = await request()
+                overloaded = not success and is_retryable_status(status)
+            finally:
+                await self.limiter.release(generation, overloaded)
+            self._count("requests")
+
+            if not overloaded or attempt >= self.max_retries:
+                return success, error
+
+            if status == 429:
+                self._count("throttled")
+            if retry_after is not None:
+                self.bucket.pause(retry_after)
+            delay = get_backoff_delay(attempt, retry_after)
+            logger.warning({
+                "message": f"Retrying {description} after HTTP {status}",
+                "attempt": attempt + 1,
+                "delay_seconds": round(delay, 2),
+                "retry_after": retry_after,
+                "concurrency_limit": self.limiter.limit,
+            })
+            self._count("retries")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def counters(self):
+        """Snapshot to pass to summary() as `since`."""
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "throttled": self.throttled, "at": time.monotonic()}
+
+    def summary(self, processed, since=None):
+        """
+        Achieved throughput and pacing counters since the throttle was created, or
+        since the `since` snapshot; they include other jobs sharing the throttle.
+        """
+        since = since or {"requests": 0, "retries": 0, "throttled": 0, "at": self.started}
+        now = self.counters()
+        seconds = now["at"] - since["at"]
+        requests = now["requests"] - since["requests"]
+        return {
+            "requests": requests,
+            "retries": now["retries"] - since["retries"],
+            "throttled": now["throttled"] - since["throttled"],
+            "concurrency_limit": self.limiter.limit,
+            "records_per_second": round(processed / seconds, 2) if seconds > 0 else None,
+            "requests_per_second": round(requests / seconds, 2) if seconds > 0 else None,
+        }
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+def get_throttle(receiver):
+    """The instance's throttle for `receiver`, created on first use."""
+    with _throttles_lock:
+        if receiver not in _throttles:
+            _throttles[receiver] = Throttle()
+        return _throttles[receiver]
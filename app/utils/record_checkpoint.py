@@ -0,0 +1,81 @@
+import base64
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Checkpoint of the stored document whose records are being sent; handlers that
+# send records one by one read it to skip the ones already delivered
+current_checkpoint = ContextVar("current_checkpoint", default=None)
+
+class RecordCheckpoint:
+    """
+    Which records of a stored payload were delivered, as a bitmap over their
+    positions in the payload (bit i set = record i accepted). Stored on the
+    document as base64 so a retry resends only the failed or never-attempted
+    records. Handlers that send records keyed by ID instead keep the IDs the
+    destination rejected, so a form can complete and a retry resend only those.
+    """
+
+    def __init__(self, stored=None):
+        self.stored = stored or {}
+        self.total = None
+        self.bitmap = None
+        self.skipped = 0
+        self.rejected = None
+
+    def start(self, total):
+        """Size the bitmap for `total` records, keeping the stored one if it matches the payload."""
+        self.total = total
+        size = (total + 7) // 8
+        completed = self.stored.get("completed")
+        bitmap = base64.b64decode(completed) if completed and self.stored.get("records") == total else b""
+        self.bitmap = bytearray(bitmap) if len(bitmap) == size else bytearray(size)
+        self.skipped = 0
+
+    @property
+    def started(self):
+        return self.bitmap is not None
+
+    def is_completed(self, position):
+        return bool(self.bitmap[position >> 3] & (1 << (position & 7)))
+
+    def mark_completed(self, position):
+        self.bitmap[position >> 3] |= 1 << (position & 7)
+
+    def pending(self, records):
+        """(position, record) pairs still to send; counts the others as skipped."""
+        pending = [(position, record) for position, record in enumerate(records) if not self.is_completed(position)]
+        self.skipped = len(records) - len(pending)
+        return pending
+
+    def completed_count(self):
+        return int.from_bytes(self.bitmap, "little").bit_count()
+
+    def rejected_before(self):
+        """IDs an earlier run left rejected; empty when it sent everything."""
+        return set(self.stored.get("rejected") or [])
+
+    def mark_rejected(self, ids):
+        self.rejected = sorted(ids)
+
+    def to_fields(self):
+        """Document fields holding the checkpoint; empty when no handler used it."""
+        fields = {}
+        if self.started:
+            fields.update({
+                "records": self.total,
+                "completed": base64.b64encode(bytes(self.bitmap)).decode("ascii"),
+                "completed_count": self.completed_count(),
+            })
+        if self.rejected is not None:
+            fields["rejected"] = self.rejected
+        return {"record_checkpoint": fields} if fields else {}
+
+@contextmanager
+def track_records(stored=None):
+    """Make a checkpoint, loaded from a document's stored `record_checkpoint`, current inside the block."""
+    checkpoint = RecordCheckpoint(stored)
+    token = current_checkpoint.set(checkpoint)
+    try:
+        yield checkpoint
+    finally:
+        current_checkpoint.reset(token)
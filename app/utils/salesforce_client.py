@@ -1,10 +1,347 @@
+import asyncio
+import os
+import random
+import time
+from urllib.parse import quote
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from simple_salesforce.exceptions import SalesforceError, SalesforceExpiredSession
+from utils.api_budget import api_usage, api_usage_ratio, record_api_call, record_api_usage
 from utils.logging_config import logger
-def upsert_to_salesforce(object_name, external_id_field, external_id, record_data, sf_connection):
+from utils.metrics import SALESFORCE_REQUEST_SECONDS, get_caller_step, get_job_name
+
+# Salesforce caps a single Composite Graph at 500 nodes
+COMPOSITE_GRAPH_MAX_NODES = 500
+
+# Salesforce caps a single sObject Collections request at 200 records
+SOBJECT_COLLECTION_MAX_RECORDS = 200
+
+# Requests one instance serves at once (its Cloud Run concurrency)
+REQUEST_CONCURRENCY = int(os.getenv("REQUEST_CONCURRENCY", "10"))
+
+# Keep-alive connections held open to the Salesforce instance. Workers wait for a free
+# one, so the default covers every thread that can upsert at once: the queue workers
+# of each concurrent request plus the batch retry workers
+SF_POOL_SIZE = int(os.getenv("SF_POOL_SIZE", str(
+    REQUEST_CONCURRENCY * int(os.getenv("FIRESTORE_WORKER_CONCURRENCY", "5")) + int(os.getenv("SF_RETRY_CONCURRENCY", "5"))
+)))
+SF_REQUEST_TIMEOUT_SECONDS = float(os.getenv("SF_REQUEST_TIMEOUT_SECONDS", "60"))
+
+# Retries for 503 and REQUEST_LIMIT_EXCEEDED responses (exponential backoff with full jitter)
+SF_MAX_RETRIES = int(os.getenv("SF_MAX_RETRIES", "4"))
+SF_BACKOFF_BASE_SECONDS = float(os.getenv("SF_BACKOFF_BASE_SECONDS", "1"))
+SF_BACKOFF_MAX_SECONDS = float(os.getenv("SF_BACKOFF_MAX_SECONDS", "30"))
+
+# Share of the org's daily API requests above which retries wait the full backoff
+SF_API_USAGE_HIGH_WATERMARK = float(os.getenv("SF_API_USAGE_HIGH_WATERMARK", "0.9"))
+
+class CompositeGraph:
+    """
+    Collects upserts for one form so they can be sent to Salesforce as a single
+    Composite Graph. Passing a graph in place of `sf_connection` to the process_*
+    helpers records their upserts instead of sending them.
+    """
+
+    def __init__(self, graph_id):
+        self.graph_id = graph_id
+        self.nodes = []
+
+    def add_upsert(self, object_name, external_id_field, external_id, record_data):
+        if len(self.nodes) >= COMPOSITE_GRAPH_MAX_NODES:
+            raise ValueError(f"Composite graph '{self.graph_id}' exceeds {COMPOSITE_GRAPH_MAX_NODES} nodes")
+
+        reference_id = f"{self.graph_id}_{len(self.nodes)}"
+        self.nodes.append({
+            "reference_id": reference_id,
+            "object_name": object_name,
+            "external_id_field": external_id_field,
+            "external_id": external_id,
+            "record_data": record_data,
+        })
+        return {"referenceId": reference_id}
+
+    def to_payload(self, sf_version):
+        return {
+            "graphId": self.graph_id,
+            "compositeRequest": [
+                {
+                    "method": "PATCH",
+                    "url": f"/services/data/v{sf_version}/sobjects/{node['object_name']}/{node['external_id_field']}/{quote(str(node['external_id'] or ''), safe='')}",
+                    "referenceId": node["reference_id"],
+                    "body": node["record_data"],
+                }
+                for node in self.nodes
+            ]
+        }
+
+    def parse_errors(self, graph_result):
+        """
+        Map a graph response back to per-node error messages, in the same format
+        raised by upsert_to_salesforce. Nodes rolled back because another node
+        failed (PROCESSING_HALTED) are only reported if nothing else is.
+        """
+        if graph_result.get("isSuccessful"):
+            return []
+
+        nodes = {node["reference_id"]: node for node in self.nodes}
+        errors, halted = [], []
+        for response in graph_result.get("graphResponse", {}).get("compositeResponse", []):
+            if response.get("httpStatusCode", 500) < 300:
+                continue
+
+            node = nodes.get(response.get("referenceId"), {})
+            body = response.get("body") or [{}]
+            body = body if isinstance(body, list) else [body]
+            for item in body:
+                message = (
+                    f"Error upserting {node.get('object_name')}: {item.get('errorCode')}: {item.get('message')} "
+                    f"with external ID {node.get('external_id_field')}:{node.get('external_id')}"
+                )
+                (halted if item.get("errorCode") == "PROCESSING_HALTED" else errors).append(message)
+
+        return errors or halted or [f"Composite graph '{self.graph_id}' failed without node errors"]
+
+def build_salesforce_session(pool_size=SF_POOL_SIZE):
+    """
+    Return a requests Session for simple_salesforce that keeps up to `pool_size`
+    connections alive, so concurrent workers reuse TLS connections instead of
+    opening one per upsert. Workers wait for a free connection rather than
+    opening extra ones that would be thrown away.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+def build_async_salesforce_client(pool_size=SF_POOL_SIZE):
+    """Return an httpx AsyncClient with the same pool limits, for async_upsert_to_salesforce."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=SF_REQUEST_TIMEOUT_SECONDS,
+    )
+
+def is_retryable_error(status, content):
+    """503 (server unavailable) and REQUEST_LIMIT_EXCEEDED (concurrent or rate limits) are transient."""
+    return status == 503 or "REQUEST_LIMIT_EXCEEDED" in str(content)
+
+def get_backoff_delay(attempt):
+    """
+    Full-jitter exponential backoff. Once the org is close to its daily API limit,
+    wait the whole window instead of a random share of it.
+    """
+    window = min(SF_BACKOFF_MAX_SECONDS, SF_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    if api_usage_ratio() >= SF_API_USAGE_HIGH_WATERMARK:
+        return window
+    return random.uniform(0, window)
+
+def should_retry(attempt, status, content):
+    # Retrying cannot help once the daily allocation itself is spent
+    return attempt < SF_MAX_RETRIES and is_retryable_error(status, content) and api_usage_ratio() < 1
+
+def refresh_expired_session(sf_connection, stale_session_id):
+    """
+    Ask a SalesforceSessionManager to log in again after INVALID_SESSION_ID.
+    Returns False for plain connections, which cannot be refreshed here.
+    """
+    # Looked up on the class: simple_salesforce turns unknown attributes into sObject types
+    if getattr(type(sf_connection), "refresh", None) is None:
+        return False
+    return sf_connection.refresh(stale_session_id) is not None
+
+def call_with_backoff(request, description, sf_connection=None):
+    """
+    Call `request()` and retry retryable Salesforce errors with backoff. An expired
+    session is refreshed once through `sf_connection` and the call repeated.
+    Any other error, or the last retryable one, is raised unchanged.
+    """
+    attempt = 0
+    refreshed = False
+    while True:
+        session_id = getattr(sf_connection, "session_id", None) if sf_connection is not None else None
+        record_api_call()
+        try:
+            return request()
+        except SalesforceExpiredSession:
+            if refreshed or not refresh_expired_session(sf_connection, session_id):
+                raise
+            refreshed = True
+        except SalesforceError as e:
+            if not should_retry(attempt, e.status, e.content):
+                raise
+            delay = get_backoff_delay(attempt)
+            logger.warning({
+                "message": f"Retrying {description} after Salesforce {e.status}",
+                "attempt": attempt + 1,
+                "delay_seconds": round(delay, 2),
+                "api_usage": api_usage,
+            })
+            time.sleep(delay)
+            attempt += 1
+
+def commit_composite_graphs(graphs, sf_connection):
+    """
+    Send the graphs in one Composite Graph request. Each graph is applied
+    all-or-nothing. Returns a dict of graph_id -> list of error messages.
+    """
+    graphs = [graph for graph in graphs if graph.nodes]
+    if not graphs:
+        return {}
+
+    payload = {"graphs": [graph.to_payload(sf_connection.sf_version) for graph in graphs]}
     try:
-        result = sf_connection.__getattr__(object_name).upsert(f"{external_id_field}/{external_id}", record_data, True)
+        with SALESFORCE_REQUEST_SECONDS.time(job_name=get_job_name(), step=get_caller_step(), sobject="composite", operation="composite_graph"):
+            response = call_with_backoff(
+                lambda: sf_connection.restful("composite/graph", method="POST", json=payload),
+                "composite graph",
+                sf_connection
+            ) or {}
+    except Exception as e:
+        raise Exception(f"Error sending composite graph: {e}")
+    record_api_usage(getattr(sf_connection, "api_usage", None))
+
+    results = {graph.graph_id: graph for graph in graphs}
+    errors = {}
+    for graph_result in response.get("graphs", []):
+        graph = results.get(graph_result.get("graphId"))
+        if graph is None:
+            continue
+        errors[graph.graph_id] = graph.parse_errors(graph_result)
         logger.info({
-            "message": f"Upserted {object_name}: {result.json()} with external ID {external_id_field}:{external_id}",
+            "message": f"Committed composite graph {graph.graph_id}",
+            "nodes": len(graph.nodes),
+            "successful": graph_result.get("isSuccessful"),
         })
-        return result.json()
+    return errors
+
+def upsert_to_salesforce(object_name, external_id_field, external_id, record_data, sf_connection):
+    if isinstance(sf_connection, CompositeGraph):
+        return sf_connection.add_upsert(object_name, external_id_field, external_id, record_data)
+
+    try:
+        # The step is the process_* helper making the call, e.g. process_household
+        with SALESFORCE_REQUEST_SECONDS.time(job_name=get_job_name(), step=get_caller_step(), sobject=object_name, operation="upsert"):
+            result = call_with_backoff(
+                lambda: sf_connection.__getattr__(object_name).upsert(f"{external_id_field}/{external_id}", record_data, True),
+                f"{object_name} upsert",
+                sf_connection
+            )
+        record_api_usage(result.headers.get("Sforce-Limit-Info"))
+        response = result.json()
+        # One line per record: sampled (see utils.logging_config)
+        logger.debug({
+            "message": f"Upserted {object_name}: {response} with external ID {external_id_field}:{external_id}",
+        })
+        return response
     except Exception as e:
-        raise Exception(f"Error upserting {object_name}: {e} data {record_data}") 
\ No newline at end of file
+        raise Exception(f"Error upserting {object_name}: {e} data {record_data}")
+
+async def async_upsert_to_salesforce(object_name, external_id_field, external_id, record_data, sf_connection, client=None):
+    """
+    Async variant of upsert_to_salesforce for job code running on an event loop.
+    Sends the PATCH with httpx using the connection's session, so the loop is not
+    blocked while Salesforce responds. Pass a client from
+    build_async_salesforce_client to reuse its keep-alive connections.
+    """
+    if isinstance(sf_connection, CompositeGraph):
+        return sf_connection.add_upsert(object_name, external_id_field, external_id, record_data)
+
+    url = f"{sf_connection.base_url}sobjects/{object_name}/{external_id_field}/{quote(str(external_id), safe='')}"
+    owns_client = client is None
+    client = client or build_async_salesforce_client()
+    try:
+        with SALESFORCE_REQUEST_SECONDS.time(job_name=get_job_name(), step=get_caller_step(), sobject=object_name, operation="upsert"):
+            attempt = 0
+            refreshed = False
+            while True:
+                session_id = sf_connection.session_id
+                headers = {"Authorization": f"Bearer {session_id}", "Content-Type": "application/json"}
+                record_api_call()
+                response = await client.patch(url, json=record_data, headers=headers)
+                record_api_usage(response.headers.get("Sforce-Limit-Info"))
+                if response.status_code == 401 and not refreshed:
+                    refreshed = True
+                    # The login is blocking, so it runs off the event loop
+                    if await asyncio.to_thread(refresh_expired_session, sf_connection, session_id):
+                        continue
+                if response.status_code < 300:
+                    result = response.json() if response.content else {}
+                    logger.debug({
+                        "message": f"Upserted {object_name}: {result} with external ID {external_id_field}:{external_id}",
+                    })
+                    return result
+
+                if not should_retry(attempt, response.status_code, response.text):
+                    raise Exception(f"Error upserting {object_name}: {response.status_code} {response.text} data {record_data}")
+                delay = get_backoff_delay(attempt)
+                logger.warning({
+                    "message": f"Retrying {object_name} upsert after Salesforce {response.status_code}",
+                    "attempt": attempt + 1,
+                    "delay_seconds": round(delay, 2),
+                    "api_usage": api_usage,
+                })
+                await asyncio.sleep(delay)
+                attempt += 1
+    finally:
+        if owns_client:
+            await client.aclose()
+
+def bulk_upsert_to_salesforce(object_name, external_id_field, records, sf_connection, chunk_size=SOBJECT_COLLECTION_MAX_RECORDS):
+    """
+    Upsert many records of one sObject through the sObject Collections endpoint,
+    `chunk_size` records per request. `records` is a list of (external_id, record_data)
+    pairs. Records are not all-or-none: returns a dict of external_id -> error for the
+    records Salesforce rejected, and only raises if a whole request fails.
+    """
+    if isinstance(sf_connection, CompositeGraph):
+        for external_id, record_data in records:
+            sf_connection.add_upsert(object_name, external_id_field, external_id, record_data)
+        return {}
+
+    failures = {}
+    step = get_caller_step()
+    for i in range(0, len(records), chunk_size):
+        chunk = records[i:i + chunk_size]
+        payload = {
+            "allOrNone": False,
+            "records": [
+                {"attributes": {"type": object_name}, external_id_field: external_id, **record_data}
+                for external_id, record_data in chunk
+            ]
+        }
+        try:
+            with SALESFORCE_REQUEST_SECONDS.time(job_name=get_job_name(), step=step, sobject=object_name, operation="collection_upsert"):
+                results = call_with_backoff(
+                    lambda: sf_connection.restful(f"composite/sobjects/{object_name}/{external_id_field}", method="PATCH", json=payload),
+                    f"{object_name} collection upsert",
+                    sf_connection
+                ) or []
+        except Exception as e:
+            raise Exception(f"Error upserting {object_name}: {e}")
+        record_api_usage(getattr(sf_connection, "api_usage", None))
+
+        # Results come back in the same order as the records sent; a record
+        # without one was not confirmed, so it counts as failed
+        if len(results) != len(chunk):
+            logger.error({
+                "message": f"Salesforce returned {len(results)} results for {len(chunk)} {object_name} records",
+                "records": len(chunk),
+                "results": len(results),
+            })
+        for position, (external_id, _) in enumerate(chunk):
+            result = results[position] if position < len(results) else None
+            if result is None:
+                failures[external_id] = "No result returned by Salesforce"
+            elif not result.get("success"):
+                failures[external_id] = "; ".join(
+                    f"{error.get('statusCode')}: {error.get('message')}" for error in result.get("errors", [])
+                ) or "Unknown error"
+
+        logger.info({
+            "message": f"Upserted {object_name} collection with external ID {external_id_field}",
+            "records": len(chunk),
+            "failed": len([external_id for external_id, _ in chunk if external_id in failures]),
+        })
+
+    return failures
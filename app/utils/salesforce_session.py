@@ -0,0 +1,167 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from cryptography.fernet import Fernet
+from simple_salesforce import Salesforce, SalesforceLogin
+from utils.firestore_client import get_firestore_client
+from utils.salesforce_client import build_salesforce_session
+from utils.logging_config import logger
+
+# Cache the access token in Firestore so cold starts reuse it instead of logging in again
+SF_SESSION_CACHE_ENABLED = os.getenv("SF_SESSION_CACHE_ENABLED", "true").lower() == "true"
+SF_SESSION_CACHE_COLLECTION = os.getenv("SF_SESSION_CACHE_COLLECTION", "salesforce_sessions")
+
+# Fernet key the cached token is encrypted with (mount it from Secret Manager); without
+# it nothing is cached, so the token is never stored in plaintext
+SF_SESSION_CACHE_KEY = os.getenv("SF_SESSION_CACHE_KEY")
+
+# Kept below the org's session timeout (2 hours by default) so cached tokens are rarely stale
+SF_SESSION_CACHE_SECONDS = int(os.getenv("SF_SESSION_CACHE_SECONDS", "3600"))
+
+class SalesforceSessionManager:
+    """
+    Shares one authenticated Salesforce connection across all worker threads.
+
+    The manager can be passed anywhere a simple_salesforce connection is expected:
+    attribute access is forwarded to the current connection. When Salesforce reports
+    INVALID_SESSION_ID, refresh() logs in again once, under a lock, and every thread
+    picks up the new session on its next call.
+    """
+
+    def __init__(self, username, password, security_token, domain, environment, db=None):
+        self.username = username
+        self.password = password
+        self.security_token = security_token
+        self.domain = domain
+        self.environment = environment
+        self.db = db
+        self.session = build_salesforce_session()
+        self.connection = None
+        self.cache_checked = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        environment = os.getenv("SALESFORCE_ENV", "sandbox")
+        if environment == "sandbox":
+            username = os.getenv("SF_TEST_USERNAME")
+            domain = "test"  # Salesforce sandbox domain
+        else:
+            username = os.getenv("SF_PROD_USERNAME")
+            domain = "login"  # Salesforce production domain
+
+        return cls(
+            username=username,
+            password=os.getenv("SF_PROD_PASSWORD"),
+            security_token=os.getenv("SF_PROD_SECURITY_TOKEN"),
+            domain=domain,
+            environment=environment
+        )
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        connection = self.get_connection()
+        if connection is None:
+            raise Exception("Salesforce session is unavailable")
+        return getattr(connection, name)
+
+    def get_connection(self):
+        """Return the current connection, authenticating first if there is none. None if login fails."""
+        if self.connection is None:
+            with self.lock:
+                if self.connection is None:
+                    # The cache is only read on cold start; after that it may hold the expired token
+                    if not self.cache_checked:
+                        self.cache_checked = True
+                        self.connection = self._load_cached_connection()
+                    self.connection = self.connection or self._login()
+        return self.connection
+
+    def is_available(self):
+        return self.get_connection() is not None
+
+    def refresh(self, stale_session_id=None):
+        """
+        Log in again after the session expired. Threads that saw the same stale
+        session wait for the first one's login instead of each logging in.
+        """
+        with self.lock:
+            current = self.connection
+            if current is not None and stale_session_id is not None and current.session_id != stale_session_id:
+                return current
+
+            self.connection = self._login()
+            return self.connection
+
+    def _build_connection(self, session_id, instance):
+        return Salesforce(session_id=session_id, instance=instance, session=self.session)
+
+    def _login(self):
+        try:
+            session_id, instance = SalesforceLogin(
+                username=self.username,
+                password=self.password,
+                security_token=self.security_token,
+                domain=self.domain,
+                session=self.session
+            )
+            logger.info({
+                "message": "Authenticated with Salesforce",
+                "environment": self.environment
+            })
+        except Exception as e:
+            logger.error({
+                "message": "Error authenticating with Salesforce",
+                "environment": self.environment,
+                "error": str(e)
+            })
+            return None
+
+        self._save_cached_session(session_id, instance)
+        return self._build_connection(session_id, instance)
+
+    def _cache_document(self):
+        if not SF_SESSION_CACHE_ENABLED or not SF_SESSION_CACHE_KEY:
+            return None
+        db = self.db or get_firestore_client()
+        return db.collection(SF_SESSION_CACHE_COLLECTION).document(f"{self.environment}-{self.username}")
+
+    def _load_cached_connection(self):
+        try:
+            document = self._cache_document()
+            snapshot = document.get() if document is not None else None
+            cached = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+            if not cached or not cached.get("encrypted_session_id"):
+                return None
+            if cached.get("expires_at") is None or cached["expires_at"] <= datetime.now(timezone.utc):
+                return None
+            session_id = Fernet(SF_SESSION_CACHE_KEY).decrypt(cached["encrypted_session_id"].encode("ascii")).decode("utf-8")
+        except Exception as e:
+            # Includes tokens encrypted with a rotated key, which are replaced on the next login
+            logger.warning({
+                "message": "Could not read cached Salesforce session",
+                "error": str(e)
+            })
+            return None
+
+        logger.info({
+            "message": "Reusing cached Salesforce session",
+            "environment": self.environment
+        })
+        return self._build_connection(session_id, cached["instance"])
+
+    def _save_cached_session(self, session_id, instance):
+        try:
+            document = self._cache_document()
+            if document is not None:
+                document.set({
+                    "encrypted_session_id": Fernet(SF_SESSION_CACHE_KEY).encrypt(session_id.encode("utf-8")).decode("ascii"),
+                    "instance": instance,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=SF_SESSION_CACHE_SECONDS),
+                })
+        except Exception as e:
+            logger.warning({
+                "message": "Could not cache Salesforce session",
+                "error": str(e)
+            })
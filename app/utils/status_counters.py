@@ -0,0 +1,60 @@
+import os
+import random
+from google.cloud import firestore
+
+# Counters live in <STATUS_COUNTER_COLLECTION>/<collection>/shards/<shard>, one field per status
+STATUS_COUNTER_COLLECTION = os.getenv("FIRESTORE_COUNTER_COLLECTION", "status_counters")
+
+# Each shard document takes about one write per second, so updates are spread across shards
+STATUS_COUNTER_SHARDS = int(os.getenv("FIRESTORE_COUNTER_SHARDS", "10"))
+
+STATUSES = ["new", "processing", "failed", "completed"]
+
+def add_status_change(deltas, previous_status, status):
+    """Add a document moving from `previous_status` to `status` (None when created) to `deltas`."""
+    if previous_status == status:
+        return deltas
+    if previous_status:
+        deltas[previous_status] = deltas.get(previous_status, 0) - 1
+    if status:
+        deltas[status] = deltas.get(status, 0) + 1
+    return deltas
+
+def _shards(collection, db):
+    return db.collection(STATUS_COUNTER_COLLECTION).document(collection).collection("shards")
+
+def apply_status_deltas(collection, deltas, db, batch=None):
+    """
+    Write `deltas` (status -> change) to one random shard, as part of `batch` when
+    given so the counters commit together with the status updates.
+    """
+    deltas = {status: delta for status, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    shard = _shards(collection, db).document(str(random.randrange(STATUS_COUNTER_SHARDS)))
+    update = {status: firestore.Increment(delta) for status, delta in deltas.items()}
+    if batch is not None:
+        batch.set(shard, update, merge=True)
+    else:
+        shard.set(update, merge=True)
+
+def get_status_counts(collection, db):
+    """Sum the shards: a fixed number of document reads whatever the size of the collection."""
+    counts = {status: 0 for status in STATUSES}
+    for shard in _shards(collection, db).get():
+        for status, count in (shard.to_dict() or {}).items():
+            counts[status] = counts.get(status, 0) + count
+    return counts
+
+def reconcile_status_counts(collection, db, count_status):
+    """
+    Correct drift (writes made outside these helpers, failed counter writes) by
+    comparing the counters with `count_status(collection, status)`, an exact count,
+    and applying the difference. Returns the exact counts and the corrections made.
+    """
+    counted = get_status_counts(collection, db)
+    actual = {status: count_status(collection, status) for status in counted}
+    corrections = {status: actual[status] - counted[status] for status in counted if actual[status] != counted[status]}
+    apply_status_deltas(collection, corrections, db)
+    return actual, corrections
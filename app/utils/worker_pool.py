@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+# Number of Firestore documents processed at the same time by one scheduler run
+FIRESTORE_WORKER_CONCURRENCY = int(os.getenv("FIRESTORE_WORKER_CONCURRENCY", "5"))
+
+def get_record_lock_keys(data: dict):
+    """
+    Return the Salesforce records a CommCare form writes to that must not be
+    updated by two forms at once (Household_ID__c and Training_Session__c).
+    """
+    form = data.get("form", {}) if isinstance(data, dict) else {}
+    if not isinstance(form, dict):
+        return set()
+
+    participant_data = form.get("participant_data", {})
+    registration_details = participant_data.get("farmer_registration_details", {}) if isinstance(participant_data, dict) else {}
+    registration_details = registration_details if isinstance(registration_details, dict) else {}
+
+    households = [
+        form.get("Household_Id"),
+        form.get("household_tns_id"),
+        registration_details.get("Household_Id"),
+    ]
+
+    sessions = [
+        form.get("training_session"),
+        form.get("selected_training_module"),
+        form.get("selected_session"),
+    ]
+    barrios = form.get("barrios_repeat_group", {})
+    items = barrios.get("item", []) if isinstance(barrios, dict) else []
+    items = items if isinstance(items, list) else [items]
+    sessions.extend(item.get("training_session") for item in items if isinstance(item, dict))
+
+    keys = {f"Household_ID__c:{household}" for household in households if household}
+    keys.update(f"Training_Session__c:{session}" for session in sessions if session)
+    return keys
+
+def group_by_lock_keys(items, key_func):
+    """
+    Split items into lanes so that items sharing any lock key end up in the same
+    lane. Lanes keep the original order of their items.
+    """
+    lanes = []
+    for index, item in enumerate(items):
+        keys = set(key_func(item))
+        merged_keys, merged_items, remaining = set(keys), [(index, item)], []
+        for lane_keys, lane_items in lanes:
+            if keys & lane_keys:
+                merged_keys |= lane_keys
+                merged_items.extend(lane_items)
+            else:
+                remaining.append((lane_keys, lane_items))
+        remaining.append((merged_keys, sorted(merged_items, key=lambda entry: entry[0])))
+        lanes = remaining
+
+    return [[item for _, item in lane_items] for _, lane_items in lanes]
+
+async def run_lanes(lanes, worker, concurrency=FIRESTORE_WORKER_CONCURRENCY):
+    """
+    Run `worker` over every item, at most `concurrency` at a time. Items in the
+    same lane run one after the other. Returns the results in lane order.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_lane(lane):
+        results = []
+        for item in lane:
+            async with semaphore:
+                results.append(await worker(item))
+        return results
+
+    lane_results = await asyncio.gather(*(run_lane(lane) for lane in lanes))
+    return [result for results in lane_results for result in results]
+
+async def run_in_thread(coroutine_function, *args):
+    """
+    Run a job coroutine on its own event loop in a worker thread. The job modules
+    are declared async but make blocking Salesforce/Firestore calls, so awaiting
+    them directly would serialize every document on the request's event loop.
+    """
+    return await asyncio.to_thread(asyncio.run, coroutine_function(*args))
@@ -0,0 +1,545 @@
+import re
+from datetime import datetime
+from operator import itemgetter
+from utils.generate_xml import safe_escape, safe_int
+
+# CommCare mobile worker the case blocks are submitted as
+COMMCARE_USER_ID = "e926526fc13b126fffdb6d001f25b269"
+
+KE_PROJECTS = ["coffee_ke_2024ac", "coffee_ke_2024bc"]
+BDI_PROJECTS = ["coffee_bdi_kahawatu_2024c", "coffee_bdi_tns_2024c"]
+ZW_PROJECTS = ["coffee_zw_2024c", "coffee_zw_c21_ag", "coffee_zim", "coffee_zim_c2_ag"]
+
+# Projects whose farm size is sent as a number of coffee trees
+TREE_COUNT_PROJECTS = KE_PROJECTS + ZW_PROJECTS
+
+class XmlTemplate:
+    """
+    An XForm template compiled once: whitespace between tags is dropped and the
+    {field} placeholders become positional %s slots, so rendering is one C-level
+    substitution of fields that were each escaped once.
+    """
+
+    def __init__(self, source):
+        compact = re.sub(r">\s+<", "><", source.strip())
+        self.fields = re.findall(r"\{(\w+)\}", compact)
+        self.compiled = re.sub(r"\{\w+\}", "%s", compact.replace("%", "%%"))
+        self.values = itemgetter(*self.fields) if self.fields else lambda fields: ()
+
+    def render(self, fields):
+        return self.compiled % self.values(fields)
+
+class XForm:
+    """
+    The XForm of one job, compiled whole for single-record submissions and in parts
+    so that the case blocks of many records can share one submission. The receiver
+    applies every case block of a form, wherever it sits in the document.
+    """
+
+    def __init__(self, header, questions, cases, meta, case_id_key="commCareCaseId"):
+        self.document = XmlTemplate(header + questions + cases + meta + "</data>")
+        self.header = XmlTemplate(header)
+        self.cases = XmlTemplate(cases)
+        self.footer = XmlTemplate(meta + "</data>")
+        # Record key holding the case ID the blocks are written to
+        self.case_id_key = case_id_key
+
+    def render(self, fields):
+        return self.document.render(fields)
+
+def _meta_fields(job_id, project_unique_id):
+    now = safe_escape(datetime.now())
+    return {
+        "job_id": job_id,
+        "project": safe_escape(project_unique_id),
+        "time_start": now,
+        "now": now,
+    }
+
+def _participant_fields(data, project_unique_id):
+    # Extract and format participant names
+    firstname = data.get("participantName", "")
+    middlename = data.get("participantMiddleName", "")
+    lastname = data.get("participantLastName", "")
+    fullname = f"{firstname} {middlename} {lastname}" if middlename else f"{firstname} {lastname}"
+
+    # Determine farmer number based on primary household membership
+    farmernumber = (
+        "1" if data.get("participantPrimaryHouseholdMember") == "Yes" else
+        "2" if data.get("participantPrimaryHouseholdMember") == "No" else ""
+    )
+
+    # Values interpolated unescaped, as generate_xml does
+    hhid = data.get("HHID", "")
+    other_id = data.get("participantOtherIDNumber", "")
+    return {
+        "fullname": safe_escape(fullname),
+        "firstname": safe_escape(firstname),
+        "middlename": safe_escape(middlename),
+        "lastname": safe_escape(lastname),
+        "age": safe_int(data.get("participantAge", "")),
+        "gender": safe_escape(data.get("participantGender", "")),
+        "phone_number": safe_int(data.get("participantPhoneNumber", "")),
+        "tns_id": safe_escape(data.get("tnsId", "")),
+        "farmer_number": safe_int(farmernumber),
+        "coopno": str(other_id if project_unique_id in KE_PROJECTS else ""),
+        "grower_number": str(other_id if project_unique_id in ZW_PROJECTS else ""),
+        "national_id_number": safe_escape(other_id if project_unique_id in BDI_PROJECTS else ""),
+        "household_id": safe_escape(data.get("householdId", "")),
+        "household_pima_id": safe_escape(data.get("householdPIMAId", "")),
+        "shade_trees": safe_int(data.get("shadeTrees", "")),
+        "household_number": str(hhid if hhid else ""),
+        "household_number_int": safe_int(hhid),
+        "household_number_escaped": safe_escape(hhid),
+        # Determine Farm Size/Number of Coffee trees based on project
+        "farm_size": safe_int(data.get("householdFarmSize", "0")) if project_unique_id in TREE_COUNT_PROJECTS else str(data.get("householdFarmSize", "0")),
+        "parent_id": safe_escape(data.get("trainingGroupId", "")),
+        "status": safe_escape(data.get("status", "")),
+        "primary_household_member": safe_escape(data.get("participantPrimaryHouseholdMember", "")),
+        "case_id": safe_escape(data.get("commCareCaseId", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+    }
+
+def _project_role_fields(data, project_unique_id):
+    return {
+        "staff_name": safe_escape(data.get("staffName", "")),
+        "tns_id": safe_escape(data.get("tnsId", "")),
+        "city": safe_escape(data.get("locationName", "")),
+        "role": safe_escape(data.get("roleForCommCare", "")),
+        "case_id": safe_escape(data.get("commCareCaseId", "")),
+        "current_module": safe_int(data.get("currentModule", "")),
+        "current_module_name": safe_escape(data.get("currentModuleName", "")),
+        "previous_module": safe_int(data.get("previousModule", "")),
+        "previous_module_name": safe_escape(data.get("previousModuleName", "")),
+        "staff_id": safe_escape(data.get("staffId", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+    }
+
+def _training_session_fields(data, project_unique_id):
+    return {
+        "session_status": str(data.get("sessionStatus", "")),
+        "training_group_name": safe_escape(data.get("trainingGroupName", "")),
+        "secondary_parent_id": safe_escape(data.get("trainingGroupResponsibleStaff", "")),
+        "module_name": safe_escape(data.get("trainingModuleName", "")),
+        "module_number": safe_int(data.get("trainingModuleNumber", "")),
+        "module_number_escaped": safe_escape(data.get("trainingModuleNumber", "")),
+        "current_previous": str(data.get("currentPrevious", "")),
+        "current_previous_escaped": safe_escape(data.get("currentPrevious", "")),
+        "case_id": safe_escape(data.get("sessionId", "")),
+        "parent_id": safe_escape(data.get("trainingGroupCommCareId", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+    }
+
+def _training_group_fields(data, project_unique_id):
+    return {
+        "name": safe_escape(data.get("trainingGroupName", "")),
+        "tns_id": safe_escape(data.get("tnsId", "")),
+        "location": safe_escape(data.get("locationName", "")),
+        "measurement_group": safe_escape(data.get("measurementGroup", "")),
+        "cooperative": safe_escape(data.get("cooperative", "")),
+        "cooperative_raw": str(data.get("cooperative", "")),
+        "household_counter": safe_int(data.get("householdCounter", "")),
+        "focal_farmer_id": safe_escape(data.get("focalFarmerId", "")),
+        "assistant_focal_farmer_id": safe_escape(data.get("assistantFocalFarmerId", "")),
+        "parent_id": safe_escape(data.get("staffId", "")),
+        "market": safe_escape(data.get("market", "")),
+        "case_id": safe_escape(data.get("commCareCaseId", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+    }
+
+def _household_sampling_fields(data, project_unique_id):
+    return {
+        "name": safe_int(data.get("householdName", "")),
+        "case_name": safe_escape(data.get("householdName", "")),
+        "number_of_members": safe_int(data.get("numberOfMembers", "")),
+        "tns_id": safe_escape(data.get("tnsId", "")),
+        "fv_aa_visited": safe_escape(data.get("fvAAVisited", "")),
+        "fv_aa_sampled": safe_escape(data.get("fvAASampled", "")),
+        "fv_aa_current_sampling_round": safe_int(data.get("fvAACurrentSamplingRound", "")),
+        "parent_id": safe_escape(data.get("trainingGroupId", "")),
+        "status": safe_escape(data.get("householdStatus", "")),
+        "case_id": safe_escape(data.get("commCareCaseId", "")),
+        "module_name": safe_escape(data.get("moduleName", "")),
+        "module_number": safe_int(data.get("moduleNumber", "")),
+        "household_participants": safe_escape(data.get("householdParticipants", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+    }
+
+def _wetmill_fields(data, project_unique_id):
+    return {
+        "manager_name": safe_escape(data.get("managerName", "")),
+        "country": safe_escape(data.get("country", "")),
+        "programme": safe_escape(data.get("programme", "")),
+        "registration_date": safe_escape(data.get("registrationDate", "")),
+        "tns_id": safe_escape(data.get("tnsId", "")),
+        "manager_role": safe_int(data.get("managerRole", "")),
+        "comments": safe_escape(data.get("comments", "")),
+        "date_ba_signature": safe_escape(data.get("dateBASignature", "")),
+        "mill_status": safe_int(data.get("millStatus", "")),
+        "exporting_status": safe_int(data.get("exportingStatus", "")),
+        "case_id": safe_escape(data.get("commCareCaseId", "")),
+        "owner_id": safe_escape(data.get("ccMobileWorkerGroupId", "")),
+        "case_name": safe_escape(data.get("wetmillName", "")),
+    }
+
+META = f'''
+    <n1:meta xmlns:n1="http://openrosa.org/jr/xforms">
+        <n1:deviceID>ID-10_t</n1:deviceID>
+        <n1:timeStart>{{time_start}}</n1:timeStart>
+        <n1:timeEnd>{{now}}</n1:timeEnd>
+        <n1:username>api</n1:username>
+        <n1:userID>{COMMCARE_USER_ID}</n1:userID>
+        <n1:jobID>{{job_id}}</n1:jobID>
+    </n1:meta>
+'''
+
+# The same meta block under the n2 prefix, for forms that already use n1
+META_N2 = META.replace("n1:", "n2:").replace("xmlns:n1", "xmlns:n2")
+
+PARTICIPANT = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns:jrm="http://dev.commcarehq.org/jr/xforms" xmlns="http://openrosa.org/formdesigner/3E266629-AFD8-4A1C-8825-1DCDDF24E5A8" uiVersion="1" version="325" name="New Participant">''',
+    questions=f'''
+    <Name>{{fullname}}</Name>
+    <First_Name>{{firstname}}</First_Name>
+    <Middle_Name>{{middlename}}</Middle_Name>
+    <Last_Name>{{lastname}}</Last_Name>
+    <Age>{{age}}</Age>
+    <Gender>{{gender}}</Gender>
+    <Phone_Number>{{phone_number}}</Phone_Number>
+    <Farmer_Id>{{tns_id}}</Farmer_Id>
+    <Farmer_Number>{{farmer_number}}</Farmer_Number>
+    <Cooperative_Membership_Number>{{coopno}}</Cooperative_Membership_Number>
+    <Grower_Number>{{grower_number}}</Grower_Number>
+    <National_ID_Number>{{national_id_number}}</National_ID_Number>
+    <Household_Id>{{household_id}}</Household_Id>
+    <Household_PIMA_Id>{{household_pima_id}}</Household_PIMA_Id>
+    <Shade_Trees>{{shade_trees}}</Shade_Trees>
+    <Household_Number>{{household_number}}</Household_Number>
+    <Number_of_Trees>{{farm_size}}</Number_of_Trees>
+    <Parent_Id>{{parent_id}}</Parent_Id>
+    <Status>{{status}}</Status>
+    <Primary_Household_Member>{{primary_household_member}}</Primary_Household_Member>
+    <Case_Id>{{case_id}}</Case_Id>
+    <Name_Household_Concat>{{fullname}} {{household_number_int}}-{{farmer_number}}</Name_Household_Concat>
+''',
+    cases=f'''
+    <n0:case case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}" xmlns:n0="http://commcarehq.org/case/transaction/v2">
+        <n0:create>
+            <n0:case_name>{{fullname}}</n0:case_name>
+            <n0:owner_id>{{owner_id}}</n0:owner_id>
+            <n0:case_type>{{project}}_participant</n0:case_type>
+        </n0:create>
+        <n0:update>
+            <n0:Case_Id>{{case_id}}</n0:Case_Id>
+            <n0:First_Name>{{firstname}}</n0:First_Name>
+            <n0:Middle_Name>{{middlename}}</n0:Middle_Name>
+            <n0:Last_Name>{{lastname}}</n0:Last_Name>
+            <n0:Age>{{age}}</n0:Age>
+            <n0:Gender>{{gender}}</n0:Gender>
+            <n0:Phone_Number>{{phone_number}}</n0:Phone_Number>
+            <n0:Farmer_Id>{{tns_id}}</n0:Farmer_Id>
+            <n0:Farmer_Number>{{farmer_number}}</n0:Farmer_Number>
+            <n0:Cooperative_Membership_Number>{{coopno}}</n0:Cooperative_Membership_Number>
+            <n0:Grower_Number>{{grower_number}}</n0:Grower_Number>
+            <n0:National_ID_Number>{{national_id_number}}</n0:National_ID_Number>
+            <n0:Household_Id>{{household_id}}</n0:Household_Id>
+            <n0:Household_PIMA_Id>{{household_pima_id}}</n0:Household_PIMA_Id>
+            <n0:Shade_Trees>{{shade_trees}}</n0:Shade_Trees>
+            <n0:Household_Number>{{household_number}}</n0:Household_Number>
+            <n0:Number_of_Trees>{{farm_size}}</n0:Number_of_Trees>
+            <n0:Status>{{status}}</n0:Status>
+            <n0:Primary_Household_Member>{{primary_household_member}}</n0:Primary_Household_Member>
+            <n0:Name_Household_Concat>{{fullname}} {{household_number_escaped}}-{{farmer_number}}</n0:Name_Household_Concat>
+            <n0:TNS_Id>{{tns_id}}</n0:TNS_Id>
+            <n0:Parent_Id>{{parent_id}}</n0:Parent_Id>
+        </n0:update>
+        <n0:index>
+            <n0:parent case_type="{{project}}_training_group">{{parent_id}}</n0:parent>
+        </n0:index>
+    </n0:case>
+''',
+    meta=META,
+)
+
+PROJECT_ROLE = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns="http://openrosa.org/formdesigner/CBD34B15-1442-4548-9B2D-C9937E3CB347" xmlns:jrm="http://dev.commcarehq.org/jr/xforms" name="New Project Role" uiVersion="1" version="1">''',
+    questions=f'''
+    <Name>{{staff_name}}</Name>
+    <TNS_Id>{{tns_id}}</TNS_Id>
+    <City>{{city}}</City>
+    <Role>{{role}}</Role>
+    <Case_Id>{{case_id}}</Case_Id>
+    <Current_Module>{{current_module}}</Current_Module>
+    <Current_Module_Name>{{current_module_name}}</Current_Module_Name>
+    <Previous_Module>{{previous_module}}</Previous_Module>
+    <Previous_Module_Name>{{previous_module_name}}</Previous_Module_Name>
+    <FFGs_Observed/>
+    <Name_id_concat>{{staff_name}} {{tns_id}}</Name_id_concat>
+    <Salesforce_Staff_Id>{{staff_id}}</Salesforce_Staff_Id>
+''',
+    cases=f'''
+    <n0:case xmlns:n0="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}">
+        <n0:create>
+            <n0:case_name>{{staff_name}}</n0:case_name>
+            <n0:owner_id>{{owner_id}}</n0:owner_id>
+            <n0:case_type>{{project}}_staff</n0:case_type>
+        </n0:create>
+        <n0:update>
+            <n0:Case_Id>{{case_id}}</n0:Case_Id>
+            <n0:Name_Id_Concat>{{staff_name}} {{tns_id}}</n0:Name_Id_Concat>
+            <n0:Role>{{role}}</n0:Role>
+            <n0:City>{{city}}</n0:City>
+            <n0:TNS_Id>{{tns_id}}</n0:TNS_Id>
+            <n0:Current_Module>{{current_module}}</n0:Current_Module>
+            <n0:Current_Module_Name>{{current_module_name}}</n0:Current_Module_Name>
+            <n0:Previous_Module>{{previous_module}}</n0:Previous_Module>
+            <n0:Previous_Module_Name>{{previous_module_name}}</n0:Previous_Module_Name>
+            <n0:FFGs_Observed/>
+            <n0:Salesforce_Staff_Id>{{staff_id}}</n0:Salesforce_Staff_Id>
+        </n0:update>
+    </n0:case>
+''',
+    meta=META,
+)
+
+TRAINING_SESSION = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns="http://openrosa.org/formdesigner/3FA54AF1-A35E-4163-BDB0-5094F709753C" xmlns:jrm="http://dev.commcarehq.org/jr/xforms" name="New Training Session" uiVersion="1" version="148">''',
+    questions=f'''
+    <Session_1_Date/>
+    <Session_2_Date/>
+    <Session_Status>{{session_status}}</Session_Status>
+    <Training_Group_Name>{{training_group_name}}</Training_Group_Name>
+    <Secondary_Parent_Id>{{secondary_parent_id}}</Secondary_Parent_Id>
+    <Module_Name>{{module_name}}</Module_Name>
+    <Module_Number>{{module_number}}</Module_Number>
+    <Current_Previous_Name>({{current_previous_escaped}}) {{module_name}}</Current_Previous_Name>
+    <Training_Session_Name>{{module_number_escaped}} {{module_name}}</Training_Session_Name>
+    <Current_Previous>{{current_previous}}</Current_Previous>
+    <Case_Id>{{case_id}}</Case_Id>
+    <Parent_Id>{{parent_id}}</Parent_Id>
+''',
+    cases=f'''
+    <subcase_0>
+        <n0:case xmlns:n0="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}">
+            <n0:create>
+                <n0:case_name>{{module_number_escaped}} {{module_name}}</n0:case_name>
+                <n0:owner_id>{{owner_id}}</n0:owner_id>
+                <n0:case_type>{{project}}_training_session</n0:case_type>
+            </n0:create>
+            <n0:update>
+                <n0:Case_Id>{{case_id}}</n0:Case_Id>
+                <n0:Date>{{now}}</n0:Date>
+                <n0:Module_Name>{{module_name}}</n0:Module_Name>
+                <n0:Module_Number>{{module_number}}</n0:Module_Number>
+                <n0:Current_Previous>{{current_previous}}</n0:Current_Previous>
+                <n0:Current_Previous_Name>({{current_previous_escaped}}) {{module_name}}</n0:Current_Previous_Name>
+                <n0:Parent_Id>{{parent_id}}</n0:Parent_Id>
+                <n0:Session_1_Date/>
+                <n0:Session_2_Date/>
+                <n0:Session_Status>{{session_status}}</n0:Session_Status>
+                <n0:Training_Group_Name>{{training_group_name}}</n0:Training_Group_Name>
+                <n0:Secondary_Parent_Id>{{secondary_parent_id}}</n0:Secondary_Parent_Id>
+            </n0:update>
+            <n0:index>
+                <n0:parent case_type="{{project}}_training_group">{{parent_id}}</n0:parent>
+            </n0:index>
+        </n0:case>
+    </subcase_0>
+    <n1:case xmlns:n1="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}"/>
+''',
+    meta=META_N2, case_id_key="sessionId",
+)
+
+TRAINING_GROUP = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns="http://openrosa.org/formdesigner/3FA54AF1-A35E-4163-BDB0-5094F709753C" xmlns:jrm="http://dev.commcarehq.org/jr/xforms" name="New Training Group" uiVersion="1" version="1">''',
+    questions=f'''
+    <Name>{{name}}</Name>
+    <FFG_Number>{{tns_id}}</FFG_Number>
+    <Location>{{location}}</Location>
+    <Measurement_Group>{{measurement_group}}</Measurement_Group>
+    <Cooperative_ID>{{cooperative}}</Cooperative_ID>
+    <Household_Counter>{{household_counter}}</Household_Counter>
+    <Focal_Farmer_Case_Id>{{focal_farmer_id}}</Focal_Farmer_Case_Id>
+    <Assistant_Focal_Farmer_Case_Id>{{assistant_focal_farmer_id}}</Assistant_Focal_Farmer_Case_Id>
+    <Name_Id_Concat>{{name}} {{tns_id}}</Name_Id_Concat>
+    <Parent_Id>{{parent_id}}</Parent_Id>
+''',
+    cases=f'''
+    <n0:case xmlns:n0="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}">
+        <n0:create>
+            <n0:case_name>{{name}}</n0:case_name>
+            <n0:owner_id>{{owner_id}}</n0:owner_id>
+            <n0:case_type>{{project}}_training_group</n0:case_type>
+        </n0:create>
+        <n0:update>
+            <n0:Location>{{location}}</n0:Location>
+            <n0:Market>{{market}}</n0:Market>
+            <n0:Household_Counter>{{household_counter}}</n0:Household_Counter>
+            <n0:Name_Id_Concat>{{name}} {{tns_id}}</n0:Name_Id_Concat>
+            <n0:Parent_Id>{{parent_id}}</n0:Parent_Id>
+            <n0:FFG_Number>{{tns_id}}</n0:FFG_Number>
+            <n0:Focal_Farmer_Case_Id>{{focal_farmer_id}}</n0:Focal_Farmer_Case_Id>
+            <n0:Assistant_Focal_Farmer_Case_Id>{{assistant_focal_farmer_id}}</n0:Assistant_Focal_Farmer_Case_Id>
+            <n0:Measurement_Group>{{measurement_group}}</n0:Measurement_Group>
+            <n0:Cooperative_ID>{{cooperative_raw}}</n0:Cooperative_ID>
+        </n0:update>
+        <n0:index>
+            <n0:parent case_type="{{project}}_staff">{{parent_id}}</n0:parent>
+        </n0:index>
+    </n0:case>
+    <n1:case xmlns:n1="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}"/>
+''',
+    meta=META_N2,
+)
+
+HOUSEHOLD_SAMPLING = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns:jrm="http://dev.commcarehq.org/jr/xforms" xmlns="http://openrosa.org/formdesigner/3E266629-AFD8-4A1C-8825-1DCDDF24E5A8" uiVersion="1" version="325" name="New Household Sample">''',
+    questions=f'''
+    <Name>{{name}}</Name>
+    <Number_Of_Members>{{number_of_members}}</Number_Of_Members>
+    <TNS_Id>{{tns_id}}</TNS_Id>
+    <FV_AA_Visited>{{fv_aa_visited}}</FV_AA_Visited>
+    <FV_AA_Sampled>{{fv_aa_sampled}}</FV_AA_Sampled>
+    <FV_AA_Current_Sampling_Round>{{fv_aa_current_sampling_round}}</FV_AA_Current_Sampling_Round>
+    <Parent_Id>{{parent_id}}</Parent_Id>
+    <Status>{{status}}</Status>
+    <Case_Id>{{case_id}}</Case_Id>
+    <Module_Name>{{module_name}}</Module_Name>
+    <Module_Number>{{module_number}}</Module_Number>
+    <Household_Participants>{{household_participants}}</Household_Participants>
+''',
+    cases=f'''
+    <n0:case xmlns:n0="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}">
+        <n0:create>
+            <n0:case_name>{{case_name}}</n0:case_name>
+            <n0:owner_id>{{owner_id}}</n0:owner_id>
+            <n0:case_type>{{project}}_household_samples</n0:case_type>
+        </n0:create>
+        <n0:update>
+            <n0:Case_Id>{{case_id}}</n0:Case_Id>
+            <n0:Name>{{name}}</n0:Name>
+            <n0:Number_Of_Members>{{number_of_members}}</n0:Number_Of_Members>
+            <n0:TNS_Id>{{tns_id}}</n0:TNS_Id>
+            <n0:FV_AA_Visited>{{fv_aa_visited}}</n0:FV_AA_Visited>
+            <n0:FV_AA_Sampled>{{fv_aa_sampled}}</n0:FV_AA_Sampled>
+            <n0:FV_AA_Current_Sampling_Round>{{fv_aa_current_sampling_round}}</n0:FV_AA_Current_Sampling_Round>
+            <n0:Status>{{status}}</n0:Status>
+            <n0:Module_Name>{{module_name}}</n0:Module_Name>
+            <n0:Module_Number>{{module_number}}</n0:Module_Number>
+            <n0:Household_Participants>{{household_participants}}</n0:Household_Participants>
+            <n0:Parent_Id>{{parent_id}}</n0:Parent_Id>
+        </n0:update>
+        <n0:index>
+            <n0:parent case_type="{{project}}_training_group">{{parent_id}}</n0:parent>
+        </n0:index>
+    </n0:case>
+''',
+    meta=META,
+)
+
+WETMILL = XForm(
+    '''<?xml version="1.0" ?>
+<data xmlns="http://openrosa.org/formdesigner/WETMILL-REGISTRATION" xmlns:jrm="http://dev.commcarehq.org/jr/xforms" name="Wetmill Registration" uiVersion="1" version="1">''',
+    questions=f'''
+    <manager_name>{{manager_name}}</manager_name>
+    <country>{{country}}</country>
+    <programme>{{programme}}</programme>
+    <registration_date>{{registration_date}}</registration_date>
+    <TNS_Id>{{tns_id}}</TNS_Id>
+    <manager_role>{{manager_role}}</manager_role>
+    <comments>{{comments}}</comments>
+    <date_ba_signature>{{date_ba_signature}}</date_ba_signature>
+    <mill_status>{{mill_status}}</mill_status>
+    <exporting_status>{{exporting_status}}</exporting_status>
+    <Case_Id>{{case_id}}</Case_Id>
+''',
+    cases=f'''
+    <n0:case xmlns:n0="http://commcarehq.org/case/transaction/v2" case_id="{{case_id}}" date_modified="{{now}}" user_id="{COMMCARE_USER_ID}">
+        <n0:create>
+            <n0:case_name>{{case_name}}</n0:case_name>
+            <n0:owner_id>{{owner_id}}</n0:owner_id>
+            <n0:case_type>{{project}}_wetmill1</n0:case_type>
+        </n0:create>
+        <n0:update>
+            <n0:Case_Id>{{case_id}}</n0:Case_Id>
+            <n0:manager_name>{{manager_name}}</n0:manager_name>
+            <n0:country>{{country}}</n0:country>
+            <n0:programme>{{programme}}</n0:programme>
+            <n0:registration_date>{{registration_date}}</n0:registration_date>
+            <n0:TNS_Id>{{tns_id}}</n0:TNS_Id>
+            <n0:manager_role>{{manager_role}}</n0:manager_role>
+            <n0:comments>{{comments}}</n0:comments>
+            <n0:date_ba_signature>{{date_ba_signature}}</n0:date_ba_signature>
+            <n0:mill_status>{{mill_status}}</n0:mill_status>
+            <n0:exporting_status>{{exporting_status}}</n0:exporting_status>
+        </n0:update>
+    </n0:case>
+''',
+    meta=META,
+)
+
+# job_name -> (form, function building its escaped fields from a record)
+TEMPLATES = {
+    "Participant": (PARTICIPANT, _participant_fields),
+    "Project Role": (PROJECT_ROLE, _project_role_fields),
+    "Training Session": (TRAINING_SESSION, _training_session_fields),
+    "Training Group": (TRAINING_GROUP, _training_group_fields),
+    "Household Sampling": (HOUSEHOLD_SAMPLING, _household_sampling_fields),
+    "Wetmill": (WETMILL, _wetmill_fields),
+}
+
+def _get_template(job_name):
+    try:
+        return TEMPLATES[job_name]
+    except KeyError:
+        raise ValueError(f"No XML template for job '{job_name}'")
+
+def render_xml(job_name, job_id, data, project_unique_id):
+    """Compact equivalent of generate_xml: the same XForm without indentation."""
+    template, build_fields = _get_template(job_name)
+    return template.render({**_meta_fields(job_id, project_unique_id), **build_fields(data, project_unique_id)})
+
+def render_batch(job_name, job_id, records, project_unique_id, buffer=None):
+    """
+    Render many records of one job, looking up the template and building the meta
+    fields once. Documents are appended to `buffer` (a list, cleared first), which
+    callers can keep and reuse between batches; returns it.
+    """
+    template, build_fields = _get_template(job_name)
+    meta = _meta_fields(job_id, project_unique_id)
+    if buffer is None:
+        buffer = []
+    buffer.clear()
+    append = buffer.append
+    for data in records:
+        fields = build_fields(data, project_unique_id)
+        fields.update(meta)
+        append(template.render(fields))
+    return buffer
+
+def get_case_id(job_name, data):
+    """The CommCare case ID a record of this job is written to."""
+    template, _ = _get_template(job_name)
+    return data.get(template.case_id_key)
+
+def render_case_batch(job_name, job_id, records, project_unique_id):
+    """
+    One XForm carrying the case blocks of every record (no question fields), under
+    the job's form header and a single meta block. The receiver accepts or rejects
+    the form as a whole.
+    """
+    template, build_fields = _get_template(job_name)
+    meta = _meta_fields(job_id, project_unique_id)
+    render_cases = template.cases.render
+    parts = [template.header.render(meta)]
+    for data in records:
+        fields = build_fields(data, project_unique_id)
+        fields.update(meta)
+        parts.append(render_cases(fields))
+    parts.append(template.footer.render(meta))
+    return "".join(parts)